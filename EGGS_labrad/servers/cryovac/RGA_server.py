@@ -94,30 +94,30 @@ class RGAServer(SerialDeviceServer, PollingServer):
         """
         # getter
         yield self.ser.acquire()
-        yield self.ser.write('ER?\r')
-        error_status = yield self.ser.read_line(_SRS_EOL)
+        error_status = yield self.ser.transaction([('ER?\r', 0, _SRS_EOL, 0)])
         self.ser.release()
-        error_status = error_status.strip()
         # convert status response to binary
-        error_status = format(int(error_status), '08b')
+        error_status = format(int(error_status[0].strip()), '08b')
         error_status = error_status[::-1]
-        # parse the STATUS byte for error flags
+        # query the component-specific status registers of all flagged components at once
+        flagged = [query_parameters for bit_number, query_parameters in _SRS_RGA_STATUS_QUERIES.items()
+                   if error_status[bit_number] == '1']
+        if not flagged:
+            returnValue([])
+        yield self.ser.acquire()
+        component_registers = yield self.ser.transaction([('{:s}?\r'.format(query_msg), 0, _SRS_EOL, 0)
+                                                          for query_msg, _ in flagged])
+        self.ser.release()
+        # parse the component registers for error flags
         error_list = []
-        for bit_number, query_parameters in _SRS_RGA_STATUS_QUERIES.items():
-            if error_status[bit_number] == '1':
-                query_msg, dict_tmp = query_parameters
-                # query the component-specific status register for flags
-                yield self.ser.acquire()
-                yield self.ser.write('{:s}?\r'.format(query_msg))
-                component_register = yield self.ser.read_line(_SRS_EOL)
-                self.ser.release()
-                # convert component response to binary
-                component_register = format(int(component_register.strip()), '08b')
-                component_register = component_register[::-1]
-                # parse response
-                error_list_tmp = [error_msg for bit_number, error_msg in dict_tmp.items()
-                                  if component_register[bit_number] == '1']
-                error_list.extend(error_list_tmp)
+        for (query_msg, dict_tmp), component_register in zip(flagged, component_registers):
+            # convert component response to binary
+            component_register = format(int(component_register.strip()), '08b')
+            component_register = component_register[::-1]
+            # parse response
+            error_list_tmp = [error_msg for bit_number, error_msg in dict_tmp.items()
+                              if component_register[bit_number] == '1']
+            error_list.extend(error_list_tmp)
         returnValue(error_list)
 
     @setting(131, 'Degas', time=['', 'i', 's'], returns='')
@@ -431,7 +431,7 @@ class RGAServer(SerialDeviceServer, PollingServer):
         else:
             raise Exception('Error: invalid input.')
         # initiate scan
-        yield self.ser.acquire()
+        yield self.ser.acquire(priority='bulk')
         yield self.ser.write(msg)
         resp = yield self.ser.read(bytes_to_read)
         self.ser.release()
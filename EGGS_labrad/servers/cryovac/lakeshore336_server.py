@@ -69,7 +69,7 @@ class Lakeshore336Server(SerialDeviceServer, PollingServer):
             raise Exception('Invalid input: channel must be one of: ' + str(INPUT_CHANNELS))
 
         # query
-        yield self.ser.acquire()
+        yield self.ser.acquire(priority=self._priority(c))
         yield self.ser.write('KRDG? ' + str(channel) + TERMINATOR)
         resp = yield self.ser.read_line()
         self.ser.release()
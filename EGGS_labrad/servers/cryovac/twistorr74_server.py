@@ -143,7 +143,7 @@ class TwisTorr74Server(SerialDeviceServer, PollingServer):
         message = yield self._create_message(CMD_msg=b'224', DIR_msg=_TT74_READ_msg)
 
         # query device with message
-        yield self.ser.acquire()
+        yield self.ser.acquire(priority=self._priority(c))
         yield self.ser.write(message)
         resp = yield self.ser.read_line(_TT74_ETX_msg)
         yield self.ser.read(2)
@@ -167,7 +167,7 @@ class TwisTorr74Server(SerialDeviceServer, PollingServer):
         message = yield self._create_message(CMD_msg=b'202', DIR_msg=_TT74_READ_msg)
 
         # query device with message
-        yield self.ser.acquire()
+        yield self.ser.acquire(priority=self._priority(c))
         yield self.ser.write(message)
         resp = yield self.ser.read_line(_TT74_ETX_msg)
         yield self.ser.read()
@@ -191,7 +191,7 @@ class TwisTorr74Server(SerialDeviceServer, PollingServer):
         message = yield self._create_message(CMD_msg=b'120', DIR_msg=_TT74_READ_msg)
 
         # query device with message
-        yield self.ser.acquire()
+        yield self.ser.acquire(priority=self._priority(c))
         yield self.ser.write(message)
         resp = yield self.ser.read_line(_TT74_ETX_msg)
         yield self.ser.read(2)
@@ -108,7 +108,9 @@ def main(argv=sys.argv):
         yield cxn.disconnect()
 
         # create SessionStore
-        session_store = SessionStore(datadir, hub=None)
+        session_store = SessionStore(datadir, hub=None, threaded=True, search=True, wal=True)
+        # apply changes that were logged but not saved before the last shutdown
+        session_store.recover()
         server = DataVault(session_store)
         session_store.hub = server
 
@@ -4,8 +4,14 @@ Contains the class structures needed for creating data files and directories.
 import os
 import re
 import h5py
+import json
+import weakref
+import threading
+import numpy as np
+from time import time
 from datetime import datetime
 from weakref import WeakValueDictionary
+from twisted.internet import defer, reactor
 
 from . import backend, errors, util
 # todo: move session/sessionstore/dataset objects into a different file
@@ -116,10 +122,254 @@ def check_if_multiple_datasets(filename):
         return False
 
 
+def probe_datafile(filename):
+    """
+    Get the kind of dataset stored in a data file, and its number of rows.
+    Arguments:
+        filename    (str): the name of the .hdf5, .h5, or .csv file to check.
+    Returns:
+                    (str, int): the kind of dataset ('dataset', 'multiple', or 'csv'), and the
+                                    number of rows (None if unknown, or the number of datasets
+                                    for hdf5 files with multiple datasets).
+    Raises:
+        Exception: if the file can't be opened (e.g. it's locked or being written), or isn't a data file.
+    """
+    if filename.endswith('.csv'):
+        with open(filename, 'rb') as f:
+            return 'csv', sum(1 for _ in f)
+
+    with h5py.File(filename, 'r') as file_tmp:
+        # artiq files
+        if 'datasets' in file_tmp:
+            datasets = file_tmp['datasets']
+            if len(datasets) > 1:
+                return 'multiple', len(datasets)
+            return 'dataset', len(datasets[list(datasets.keys())[0]])
+        # data vault files (extended columnar datasets store their columns in a group)
+        dataset = file_tmp['DataVault']
+        if 'Rows' in dataset.attrs:
+            return 'dataset', int(dataset.attrs['Rows'])
+        if isinstance(dataset, h5py.Group):
+            dataset = dataset['f0']
+        return 'dataset', dataset.shape[0]
+
+
+class SessionIndex(object):
+    """
+    Persistent index of the data files in a session directory.
+
+    Stores the kind of dataset and the row count of each .hdf5, .h5, and .csv file,
+    along with the file's modification time and size when it was probed.
+    Files are only probed again when their modification time or size changes,
+    so listing a directory doesn't need to open every file in it.
+    """
+
+    FILENAME = 'session_index.json'
+    VERSION = 1
+
+    def __init__(self, directory):
+        self.dir = directory
+        self.path = os.path.join(directory, self.FILENAME)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        """
+        Load the index from disk. Starts over if the index is missing or can't be read.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                index = json.load(f)
+            if index.get('version') == self.VERSION:
+                self.entries = index['files']
+        except (OSError, ValueError, KeyError, AttributeError):
+            self.entries = {}
+
+    def save(self):
+        """
+        Save the index to disk if it has changed.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            index = {'version': self.VERSION, 'files': dict(self.entries)}
+            self._dirty = False
+        # write to a temporary file first so a crash can't leave a partial index
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, filename, stat, probe=True):
+        """
+        Get the index entry for a data file, probing the file if it has changed.
+        Arguments:
+            filename    (str): the (encoded) name of the file in the directory.
+            stat        (os.stat_result): the current stat of the file.
+            probe       (bool): whether the file may be opened (e.g. False for files that are open for writing).
+        Returns:
+                        (dict): the entry, with the keys 'kind' and 'rows'.
+        """
+        with self._lock:
+            entry = self.entries.get(filename)
+        if (entry is not None) and (entry['mtime'], entry['size']) == (stat.st_mtime, stat.st_size):
+            return entry
+        unknown = {'kind': 'csv' if filename.endswith('.csv') else 'dataset', 'rows': None}
+        if not probe:
+            return entry or unknown
+
+        # files that can't be probed (e.g. while another process is writing them) aren't indexed,
+        # so they're probed again the next time they're looked up
+        try:
+            kind, rows = probe_datafile(os.path.join(self.dir, filename))
+        except Exception:
+            return unknown
+        return self.set(filename, kind, rows, stat)
+
+    def set(self, filename, kind, rows, stat):
+        """
+        Set the entry for a data file that has been probed.
+        Arguments:
+            filename    (str): the (encoded) name of the file in the directory.
+            kind        (str): the kind of dataset (see probe_datafile).
+            rows        (int): the number of rows.
+            stat        (os.stat_result): the stat of the file when it was probed.
+        Returns:
+                        (dict): the entry.
+        """
+        entry = {'kind': kind, 'rows': rows, 'mtime': stat.st_mtime, 'size': stat.st_size}
+        with self._lock:
+            self.entries[filename] = entry
+            self._dirty = True
+        return entry
+
+    def add(self, filename, kind, rows=0):
+        """
+        Add an entry for a new data file.
+            The file will be probed the next time it's looked up after it has been modified.
+        """
+        with self._lock:
+            self.entries[filename] = {'kind': kind, 'rows': rows, 'mtime': None, 'size': None}
+            self._dirty = True
+
+    def remove(self, filename):
+        """
+        Remove the entry for a data file (e.g. once it has been deleted).
+        """
+        with self._lock:
+            if self.entries.pop(filename, None) is not None:
+                self._dirty = True
+
+    def prune(self, filenames):
+        """
+        Remove the entries of all files not in filenames.
+        """
+        filenames = set(filenames)
+        with self._lock:
+            for filename in list(self.entries):
+                if filename not in filenames:
+                    del self.entries[filename]
+                    self._dirty = True
+
+
+## notifications
+NOTIFY_INTERVAL = 0.02  # min time between row count notifications of a dataset (see Dataset.streamRows)
+PUSH_BATCH_ROWS = 1000  # default max rows pushed to a subscribed context per notify interval (see Dataset.subscribeRows)
+
+
 ## data-url support for storing parameters
 DATA_URL_PREFIX = 'data:application/labrad;base64,'
 
 
+class ListenerIndex(object):
+    """
+    Reverse index from context keys to the listener sets they have been added to.
+
+    Sessions and datasets each keep sets of the contexts listening for their
+    signals. These are ListenerSets, which record each context added to them
+    here, so that an expired context can be removed from all of its sets
+    without looking through every session and dataset.
+    """
+
+    def __init__(self):
+        # {context key: {id(listener set): weakref to listener set}}
+        self._sets = {}
+
+    def register(self, key, listeners):
+        """
+        Record that a context has been added to a listener set.
+        """
+        sets = self._sets.setdefault(key, {})
+        ref = sets.get(id(listeners))
+        # ids of deleted sets can be reused
+        if (ref is None) or (ref() is not listeners):
+            sets[id(listeners)] = weakref.ref(listeners)
+
+    def expire(self, key):
+        """
+        Remove a context from all listener sets it has been added to.
+        """
+        for ref in self._sets.pop(key, {}).values():
+            listeners = ref()
+            if listeners is not None:
+                listeners.discard(key)
+
+    def __len__(self):
+        return len(self._sets)
+
+
+class ListenerSet(set):
+    """
+    A set of listening contexts that records its members in a ListenerIndex.
+    """
+
+    def __init__(self, index, keys=()):
+        set.__init__(self)
+        self.index = index
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        set.add(self, key)
+        self.index.register(key, self)
+
+
+class ListenerDict(dict):
+    """
+    A dict keyed by listening context that records its keys in a ListenerIndex.
+    """
+
+    def __init__(self, index):
+        dict.__init__(self)
+        self.index = index
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.index.register(key, self)
+
+    def discard(self, key):
+        self.pop(key, None)
+
+
+class RowSubscription(object):
+    """
+    The state of a context that has rows of a dataset pushed to it (see Dataset.subscribeRows).
+    """
+
+    def __init__(self, columns, max_batch, pos):
+        self.columns = columns
+        self.max_batch = max_batch
+        # the next row to push
+        self.pos = pos
+        # whether the context fell behind, and only gets notified until it reads up to the end
+        self.behind = False
+        # start time of the current notify interval, and rows pushed during it
+        self.window_start = None
+        self.window_rows = 0
+
+
 class SessionStore(object):
     """
     Handles session objects.
@@ -127,9 +377,23 @@ class SessionStore(object):
     """
     # todo: ensure repositories can't contain one another
 
-    def __init__(self, datadirs, hub):
+    def __init__(self, datadirs, hub, storage=None, write_buffer=None, metadata_interval=None, notify_interval=None,
+                 threaded=False, search=False, wal=False, wal_interval=None):
         self._sessions = WeakValueDictionary()
         self.hub = hub
+        # run hdf5 file i/o on a worker thread per file instead of the reactor thread
+        self.threaded = threaded
+        # default chunking/compression options for new datasets
+        self.storage = backend.storage_options(storage)
+        # write-behind buffering of added rows for all datasets
+        self.write_buffer = dict(backend.WRITE_BUFFER)
+        self.write_buffer.update(write_buffer or {})
+        # max time parameters, comments and access times of all datasets are held in memory
+        self.metadata_interval = backend.METADATA_INTERVAL if metadata_interval is None else metadata_interval
+        # min time between row count notifications of each dataset
+        self.notify_interval = NOTIFY_INTERVAL if notify_interval is None else notify_interval
+        # contexts listening to sessions and datasets
+        self.listener_index = ListenerIndex()
 
         datadirs = [datadirs] if isinstance(datadirs, str) else datadirs
 
@@ -137,6 +401,50 @@ class SessionStore(object):
         # (e.g. {'labrad': C:\\Users\\EGGS1\\Documents\\.labrad})
         self.datadirs = {os.path.basename(datadir): os.path.dirname(datadir) for datadir in datadirs}
 
+        # search index of each data directory, built in the background
+        self.search = {}
+        if search:
+            # imported here since the search module uses the filename functions of this one
+            from .search import SearchIndex
+            for name, parent in self.datadirs.items():
+                self.search[name] = SearchIndex(os.path.join(parent, name))
+                self.search[name].build().addErrback(print)
+
+        # write-ahead log of the changes to the datasets in each data directory
+        self.wal = {}
+        if wal:
+            from .wal import WriteAheadLog, WAL_INTERVAL
+            for name, parent in self.datadirs.items():
+                self.wal[name] = WriteAheadLog(os.path.join(parent, name),
+                                               WAL_INTERVAL if wal_interval is None else wal_interval)
+
+    def searchIndex(self, path):
+        """
+        Get the search index for a session path, or None if there isn't one.
+        """
+        return self.search.get(path[1]) if len(path) > 1 else None
+
+    def writeAheadLog(self, path):
+        """
+        Get the write-ahead log for a session path, or None if there isn't one.
+        """
+        return self.wal.get(path[1]) if len(path) > 1 else None
+
+    def recover(self):
+        """
+        Replay the write-ahead logs left by a previous run into the datasets.
+            Call before serving any requests (see wal.recover).
+        Returns:
+                    (int): the number of records that couldn't be applied.
+        """
+        from .wal import recover
+        failed = 0
+        for wal in self.wal.values():
+            segments = wal.previousSegments()
+            if segments:
+                failed += recover(wal.dir, segments)[1]
+        return failed
+
     def get_all(self):
         return self._sessions.values()
 
@@ -202,9 +510,11 @@ class Session(object):
         """
         self.path = path
         self.hub = hub
+        self.session_store = session_store
         self.dir = filedir(datadir, path)
         self.infofile = os.path.join(self.dir, 'session.ini')
         self.datasets = WeakValueDictionary()
+        self._index = None
 
         # create new directory if it doesn't exist
         if not os.path.exists(self.dir):
@@ -226,7 +536,7 @@ class Session(object):
 
         # update current access time and save
         self.access()
-        self.listeners = set()
+        self.listeners = ListenerSet(session_store.listener_index)
 
     def load(self):
         """
@@ -291,31 +601,34 @@ class Session(object):
             tuple(str), tuple(str): sorted tuples of directories and datasets, respectively.
         """
         # get all names in the directory
-        files = os.listdir(self.dir)
+        entries = list(os.scandir(self.dir))
 
         # get directories (objects that end in '.dir' are directories, though we also allow folders that don't end in dir)
         # todo: fix .dir suffix problem, maybe try/except block that does .dir if fails?
-        #dirs = [filename_decode(filename.split('.')[0]) for filename in files if os.path.isdir(os.path.join(self.dir, filename))]
-        dirs = [filename_decode(filename) for filename in files if os.path.isdir(os.path.join(self.dir, filename))]
+        dirs = [filename_decode(entry.name) for entry in entries if entry.is_dir()]
 
         # get only valid dataset files (ignore csv since they're partnered with ini files)
-        filetype_suffixes = ('.ini', '.hdf5', '.h5')
-        def valid_datafile(filename):
-            if filename == "session.ini":
-                return False
-            # hdf5 files with more than multiple datasets are to be treated as virtual directories
-            elif (filename.endswith('.hdf5') or filename.endswith('.h5')):
-                multiple_datasets = check_if_multiple_datasets(os.path.join(self.dir, filename))
-                # add filename to directories
-                if multiple_datasets:
+        # hdf5 files with multiple datasets are to be treated as virtual directories;
+        # the session index remembers which files these are, so only new or modified files are opened
+        datasets = []
+        datafiles = []
+        for entry in entries:
+            filename = entry.name
+            if entry.is_dir() or (filename == "session.ini"):
+                continue
+            elif filename.endswith(('.hdf5', '.h5', '.csv')):
+                datafiles.append(filename)
+                # don't open files that we have open for writing
+                name = filename_decode(filename.rpartition('.')[0])
+                info = self.index.lookup(filename, entry.stat(), probe=(name not in self.datasets))
+                if info['kind'] == 'multiple':
                     dirs.append(filename_decode(filename))
-                    return False
-                else:
-                    return True
-            else:
-                return any([filename.endswith(filetype) for filetype in filetype_suffixes])
-
-        datasets = sorted([filename_decode(filename.split('.')[0]) for filename in files if valid_datafile(filename)])
+                elif info['kind'] == 'dataset':
+                    datasets.append(filename_decode(filename.split('.')[0]))
+            elif filename.endswith('.ini'):
+                datasets.append(filename_decode(filename.split('.')[0]))
+        self.index.prune(datafiles)
+        self.index.save()
 
         # todo: turn these functions into lambda functions
         # tag filtering functions
@@ -349,6 +662,15 @@ class Session(object):
 
         return sorted(dirs), sorted(datasets)
 
+    @property
+    def index(self):
+        """
+        The index of data files in this directory (loaded on first use).
+        """
+        if self._index is None:
+            self._index = SessionIndex(self.dir)
+        return self._index
+
     def listDatasets(self):
         """
         Get a list of dataset names in this directory.
@@ -367,7 +689,7 @@ class Session(object):
                 filenames.append(filename_decode(base))
         return sorted(filenames)
 
-    def newDataset(self, title, independents, dependents, extended=False):
+    def newDataset(self, title, independents, dependents, extended=False, storage=None):
         """
         todo: document
         Args:
@@ -375,6 +697,7 @@ class Session(object):
             independents:
             dependents:
             extended:
+            storage:    storage options that override the session store defaults.
         Returns:
             todo
         """
@@ -387,10 +710,24 @@ class Session(object):
         dataset = Dataset(self, name, title, create=True,
                           independents=independents,
                           dependents=dependents,
-                          extended=extended)
+                          extended=extended,
+                          storage=backend.storage_options(storage, self.session_store.storage),
+                          write_buffer=self.session_store.write_buffer,
+                          metadata_interval=self.session_store.metadata_interval,
+                          notify_interval=self.session_store.notify_interval,
+                          threaded=self.session_store.threaded,
+                          listener_index=self.session_store.listener_index,
+                          search_index=self.session_store.searchIndex(self.path),
+                          wal=self.session_store.writeAheadLog(self.path))
         self.datasets[name] = dataset
+        self.index.add(filename_encode(name) + '.hdf5', 'dataset')
         self.access()
 
+        # add the dataset to the search index (the worker thread isn't running yet, so we can read the file here)
+        if dataset.search_index is not None:
+            labels = [var.label for var in dataset.getIndependents() + dataset.getDependents()]
+            dataset.search_index.addDataset(self.path, name, title, labels).addErrback(print)
+
         # notify listeners about the new dataset
         self.hub.onNewDataset(name, self.listeners)
         return dataset
@@ -425,10 +762,16 @@ class Session(object):
         # get dataset wrapper if it already exists
         if name in self.datasets:
             dataset = self.datasets[name]
-            dataset.access()
+            dataset.run(dataset.access)
         # otherwise, create new wrapper for dataset
         else:
-            dataset = Dataset(self, name)
+            dataset = Dataset(self, name, write_buffer=self.session_store.write_buffer,
+                              metadata_interval=self.session_store.metadata_interval,
+                              notify_interval=self.session_store.notify_interval,
+                              threaded=self.session_store.threaded,
+                              listener_index=self.session_store.listener_index,
+                              search_index=self.session_store.searchIndex(self.path),
+                              wal=self.session_store.writeAheadLog(self.path))
             self.datasets[name] = dataset
         self.access()
 
@@ -471,6 +814,9 @@ class Session(object):
 
         self.access()
         if len(sessUpdates) + len(dataUpdates):
+            search_index = self.session_store.searchIndex(self.path)
+            if search_index is not None:
+                search_index.setTags(self.path, self.session_tags, self.dataset_tags).addErrback(print)
             # fire a message about the new tags
             msg = (sessUpdates, dataUpdates)
             self.hub.onTagsUpdated(msg, self.listeners)
@@ -493,7 +839,7 @@ class VirtualSession(object):
         """
         self.path = path
         self.hub = hub
-        self.listeners = set()
+        self.listeners = ListenerSet(session_store.listener_index)
         self.datasets = WeakValueDictionary()
         self.subdirs = sorted(datadirs.keys())
 
@@ -503,7 +849,7 @@ class VirtualSession(object):
         """
         return self.subdirs, []
 
-    def newDataset(self, title, independents, dependents, extended=False):
+    def newDataset(self, title, independents, dependents, extended=False, storage=None):
         raise errors.VirtualSessionError("newDataset")
 
     def openDataset(self, name):
@@ -527,9 +873,10 @@ class VirtualFileSession(VirtualSession):
         """
         self.path = path
         self.hub = hub
+        self.session_store = session_store
         self.datasets = WeakValueDictionary()
         self.dataset_names = []
-        self.listeners = set()
+        self.listeners = ListenerSet(session_store.listener_index)
 
         # need to have a dir pointing to directory that holds the hdf5 file
         # since Dataset takes session.dir and adds on the hdf5 filename
@@ -543,10 +890,8 @@ class VirtualFileSession(VirtualSession):
         if not os.path.exists(self.dataset_filedir):
             raise errors.DatasetNotFoundError(self.dataset_filename)
 
-        # get dataset names
-        with h5py.File(self.dataset_filedir) as file_tmp:
-            datasets = file_tmp["datasets"]
-            self.dataset_names = sorted(list(map(str, datasets.keys())))
+        # get dataset names (this also builds the descriptor table used by each dataset)
+        self.dataset_names = sorted(backend.get_artiq_descriptors(self.dataset_filedir))
 
     def listContents(self, tagFilters):
         """
@@ -576,12 +921,14 @@ class VirtualFileSession(VirtualSession):
             # strip filename of extension
             filename_raw = filename_decode(self.dataset_filename.split('.')[0])
             # create dataset
-            dataset = Dataset(self, filename_raw, title=dataset_name, create=False, dataset_name=dataset_name)
+            dataset = Dataset(self, filename_raw, title=dataset_name, create=False, dataset_name=dataset_name,
+                              notify_interval=self.session_store.notify_interval,
+                              listener_index=self.session_store.listener_index)
             self.datasets[dataset_name] = dataset
 
         return dataset
 
-    def newDataset(self, title, independents, dependents, extended=False):
+    def newDataset(self, title, independents, dependents, extended=False, storage=None):
         raise errors.VirtualSessionError("newDataset")
 
     def updateTags(self, tags, sessions, datasets):
@@ -596,26 +943,137 @@ class Dataset(object):
     This object basically takes care of listeners and notifications.
     All the actual data or metadata access is proxied through to a
     backend object.
+
+    If threaded, hdf5 files are accessed on a FileWorker thread, and
+    all calls that access the file should be made using run.
+    Listeners are only modified in the reactor thread.
+
+    If metadata_interval is nonzero, parameters, comments and access times
+    are held in memory by the backend, and written to the file at most
+    metadata_interval seconds later (or when the file is closed), rather
+    than on every change.
+
+    Listening contexts are recorded in listener_index (usually the session
+    store's), so they can be removed when they expire.
+
+    Contexts in row_listeners are sent the row count of the dataset when
+    data is added, at most once every notify_interval seconds, so a fast
+    writer doesn't cause a notification (and a read) per add.
+
+    Contexts in row_subscribers have added rows pushed to them as they are
+    added, until they fall behind (see subscribeRows).
+
+    If a search_index is given, added parameters are also added to it.
+
+    If a write-ahead log (wal) is given, the creation of the dataset and added
+    rows, parameters and comments are appended to it; runLogged waits for them
+    to be synced to disk.
     """
 
-    def __init__(self, session, name, title=None, create=False, independents=[], dependents=[], extended=False, dataset_name=None):
+    def __init__(self, session, name, title=None, create=False, independents=[], dependents=[], extended=False,
+                 dataset_name=None, storage=None, write_buffer=None, metadata_interval=0, notify_interval=0,
+                 threaded=False, listener_index=None, search_index=None, wal=None, reactor=reactor):
         self.hub = session.hub
         self.name = name
+        self.search_index = search_index
+        self.wal = wal
+        self.session_path = list(session.path) if (search_index is not None or wal is not None) else None
         file_base = os.path.join(session.dir, filename_encode(name))
-        self.listeners = set()  # contexts that want to hear about added data
-        self.param_listeners = set()
-        self.comment_listeners = set()
-
+        listener_index = ListenerIndex() if listener_index is None else listener_index
+        self.listeners = ListenerSet(listener_index)  # contexts that want to hear about added data
+        self.param_listeners = ListenerSet(listener_index)
+        self.comment_listeners = ListenerSet(listener_index)
+        self.row_listeners = ListenerSet(listener_index)  # contexts that want coalesced row counts
+        self.row_subscribers = ListenerDict(listener_index)  # {context: RowSubscription}
+        self.notify_interval = notify_interval
+        self.reactor = reactor
+        # latest row count, pending row count notification, and time of the last one
+        self._rows = 0
+        self._rowsCall = None
+        self._rowsSent = None
+        worker = backend.FileWorker(name) if threaded else None
+
+        # the worker thread isn't started until the first call to run, so we can set up the file here
         if create:
             indep = [self.makeIndependent(i, extended) for i in independents]
             dep = [self.makeDependent(d, extended) for d in dependents]
-            self.data = backend.create_backend(file_base, title, indep, dep, extended)
-            self.save()
+            self.data = backend.create_backend(file_base, title, indep, dep, extended, storage, worker)
         else:
-            self.data = backend.open_backend(file_base, dataset_name)
+            self.data = backend.open_backend(file_base, dataset_name, worker)
             self.load()
+        # csv files don't use the worker
+        self.worker = getattr(getattr(self.data, '_file', None), 'worker', None)
+        if create:
+            # log the parsed variables and options, so the record has a fixed form (see wal.encode_record)
+            if extended:
+                independents = [(i.label, list(i.shape), i.datatype, i.unit) for i in indep]
+                dependents = [(d.label, d.legend, list(d.shape), d.datatype, d.unit) for d in dep]
+            else:
+                independents = [(i.label, i.unit) for i in indep]
+                dependents = [(d.label, d.legend, d.unit) for d in dep]
+            storage = [(str(name), str(value)) for name, value in dict(storage).items()] if storage else []
+            self._log('new', title, independents, dependents, extended, storage)
+
+        # buffer added rows (only supported by writable hdf5 datasets)
+        if write_buffer and hasattr(self.data, 'setWriteBuffer'):
+            self.data.setWriteBuffer(**write_buffer)
+        # buffer metadata changes
+        self.metadata_interval = metadata_interval if hasattr(self.data, 'setMetadataBuffer') else 0
+        if self.metadata_interval:
+            self.data.setMetadataBuffer(self.metadata_interval)
+
+        # time the access time was last updated
+        self._accessed = 0
+        if create:
+            self.save()
+        else:
             self.access()
 
+    def run(self, func, *args, **kwargs):
+        """
+        Call a function that accesses the file.
+            Runs on the worker thread if we have one, otherwise runs immediately.
+        Returns:
+            Deferred: fires with the result of the call.
+        """
+        if self.worker is None:
+            return defer.maybeDeferred(func, *args, **kwargs)
+        return self.worker.submit(func, *args, **kwargs)
+
+    def runLogged(self, func, *args):
+        """
+        Call a function that changes the dataset, like run, and wait for
+        the change to be synced to the write-ahead log (if there is one).
+        Returns:
+            Deferred: fires with the result of the call.
+        """
+        d = self.run(func, *args)
+        if self.wal is not None:
+            d.addCallback(lambda result: self.wal.sync().addCallback(lambda _: result))
+        return d
+
+    def _log(self, op, *args):
+        if self.wal is not None and self.wal.append(op, self.session_path, self.name, *args):
+            self._callInReactor(self.wal.commitSoon)
+
+    def _callInReactor(self, func, *args):
+        if self.worker is None:
+            func(*args)
+        else:
+            self.worker.callInReactor(func, *args)
+
+    def _notify(self, signal, attr):
+        """
+        Send a signal to all contexts in a listener set, then clear the set.
+        """
+        self._callInReactor(self._notifyListeners, signal, attr)
+
+    def _notifyListeners(self, signal, attr):
+        # the set is cleared rather than replaced, so the listener index stays valid
+        listeners = getattr(self, attr)
+        signal(None, set(listeners))
+        listeners.clear()
+
     def save(self):
         self.data.save()
 
@@ -626,12 +1084,24 @@ class Dataset(object):
         v = self.data.version
         return '.'.join(str(x) for x in v)
 
+    def _saveMetadata(self, saveNow=False):
+        """
+        Save metadata changes, unless they can be left in the backend's metadata buffer.
+        """
+        if saveNow or not self.metadata_interval:
+            self.save()
+
     def access(self):
         """
         Update time of last access for this dataset.
+            The access time is updated at most once every ACCESS_INTERVAL seconds.
         """
+        now = time()
+        if now - self._accessed < backend.ACCESS_INTERVAL:
+            return
+        self._accessed = now
         self.data.access()
-        self.save()
+        self._saveMetadata()
 
     def makeIndependent(self, label, extended):
         """
@@ -671,23 +1141,30 @@ class Dataset(object):
 
     def addParameter(self, name, data, saveNow=True):
         self.data.addParam(name, data)
-        if saveNow:
-            self.save()
+        self._log('params', [(name, data)])
+        self._saveMetadata(saveNow)
+        self._indexParameters([(name, data)])
 
         # notify all listening contexts
-        self.hub.onNewParameter(None, self.param_listeners)
-        self.param_listeners = set()
+        self._notify(self.hub.onNewParameter, 'param_listeners')
         return name
 
     def addParameters(self, params, saveNow=True):
         for name, data in params:
             self.data.addParam(name, data)
-        if saveNow:
-            self.save()
+        self._log('params', list(params))
+        self._saveMetadata(saveNow)
+        self._indexParameters(params)
 
         # notify all listening contexts
-        self.hub.onNewParameter(None, self.param_listeners)
-        self.param_listeners = set()
+        self._notify(self.hub.onNewParameter, 'param_listeners')
+
+    def _indexParameters(self, params):
+        if self.search_index is not None:
+            self._callInReactor(self._submitParameters, list(params))
+
+    def _submitParameters(self, params):
+        self.search_index.addParameters(self.session_path, self.name, params).addErrback(print)
 
     def getParameter(self, name, case_sensitive=True):
         return self.data.getParameter(name, case_sensitive)
@@ -695,17 +1172,180 @@ class Dataset(object):
     def getParamNames(self):
         return self.data.getParamNames()
 
+    def getParameters(self):
+        return tuple((name, self.data.getParameter(name)) for name in self.data.getParamNames())
+
+    def addArrays(self, arrays):
+        """
+        Add data given as a list of columns.
+        """
+        self.addData(np.core.records.fromarrays(arrays, dtype=self.data.dtype))
+
+    def addRecords(self, records):
+        """
+        Add data given as a list of rows.
+        """
+        self.addData(np.core.records.fromrecords(records, dtype=self.data.dtype))
+
     def addData(self, data):
-        # append the data to the file
+        # append the data to the file, logging the row it starts at so it isn't added twice on replay
+        start = self._rowCount() if self.wal is not None else None
         self.data.addData(data)
+        self._log('add', start, data)
 
         # notify all listening contexts
-        self.hub.onDataAvailable(None, self.listeners)
-        self.listeners = set()
+        # (the row listeners and subscribers are changed in the reactor thread, so they're checked there)
+        self._notify(self.hub.onDataAvailable, 'listeners')
+        rows = self._rowCount()
+        self._callInReactor(self._queueRows, rows)
+        self._callInReactor(self._pushRows, rows, data)
+
+    def _rowCount(self):
+        # len is cheap, while shape() reads the column metadata
+        if hasattr(self.data, 'shape'):
+            return len(self.data)
+        # csv datasets (an empty CsvNumpyData has a single empty row)
+        data = self.data.data
+        return len(data) if (len(data) and np.size(data[0])) else 0
+
+    def streamRows(self, context):
+        """
+        Start sending the row count of this dataset to a context.
+            The context is sent the current row count if the dataset isn't empty.
+        """
+        self._callInReactor(self._streamRows, context, self._rowCount())
+
+    def _streamRows(self, context, rows):
+        self.row_listeners.add(context)
+        if rows:
+            self.hub.onDataRows(rows, [context])
+
+    def stopStreamingRows(self, context):
+        """
+        Stop sending the row count or rows of this dataset to a context.
+            Must be called in the reactor thread.
+        """
+        self.row_listeners.discard(context)
+        self.row_subscribers.discard(context)
+
+    def subscribeRows(self, context, columns=None, max_batch=PUSH_BATCH_ROWS):
+        """
+        Push rows added to this dataset to a context, in the transposed format of getColumns.
+            Each add is sent to the context as a single hub.onRowsPushed message of
+            (start row, end row, columns). If a single add has more than max_batch rows,
+            or more than max_batch rows are pushed within notify_interval, the context
+            has fallen behind: it is sent (start row, end row, None) once, and then
+            nothing until it reads up to the end of the dataset (see keepStreaming).
+        Arguments:
+            context:                the context to push rows to.
+            columns     (list(int)): the column indices to push (all columns if None).
+            max_batch   (int): the max number of rows pushed per notify interval.
+        Returns:
+                        (int): the current row count; rows from here on are pushed.
+        """
+        num_columns = len(self.data.dtype)
+        if columns is None:
+            columns = range(num_columns)
+        for idx in columns:
+            if not (0 <= idx < num_columns):
+                raise errors.BadColumnError(idx, num_columns)
+        rows = self._rowCount()
+        self._callInReactor(self._subscribeRows, context, RowSubscription(list(columns), max_batch, rows))
+        return rows
+
+    def _subscribeRows(self, context, subscription):
+        self.row_subscribers[context] = subscription
+
+    def unsubscribeRows(self, context):
+        """
+        Stop pushing rows to a context.
+            Must be called in the reactor thread.
+        """
+        self.row_subscribers.discard(context)
+
+    def _pushRows(self, end, data):
+        if not self.row_subscribers:
+            return
+        # rows given as a plain array (one row per line) are pushed like any other add
+        if getattr(data, 'dtype', None) is None or not data.dtype.names:
+            data = np.core.records.fromarrays(np.atleast_2d(np.asarray(data)).T, dtype=self.data.dtype)
+        start = end - len(data)
+        now = self.reactor.seconds()
+        for context, sub in list(self.row_subscribers.items()):
+            if sub.behind:
+                continue
+            if (sub.window_start is None) or (now - sub.window_start >= self.notify_interval):
+                sub.window_start = now
+                sub.window_rows = 0
+            # fall back to notifying if rows were missed or the context can't keep up
+            if (start != sub.pos) or (sub.window_rows + len(data) > sub.max_batch):
+                sub.behind = True
+                self.hub.onRowsPushed((sub.pos, end, None), [context])
+                continue
+            sub.window_rows += len(data)
+            sub.pos = end
+            columns = []
+            for idx in sub.columns:
+                col = data[data.dtype.names[idx]]
+                # object columns hold strings, which are sent as lists
+                columns.append(col.tolist() if col.dtype == object else col)
+            self.hub.onRowsPushed((start, end, tuple(columns)), [context])
+
+    def _resumeRows(self, context, pos, more):
+        sub = self.row_subscribers.get(context)
+        if (sub is not None) and sub.behind and not more:
+            sub.behind = False
+            sub.pos = pos
+            sub.window_start = None
+
+    def _queueRows(self, rows):
+        """
+        Send the row count to row listeners, unless one was sent less than
+        notify_interval seconds ago, in which case the latest row count is
+        sent once the interval has elapsed.
+        """
+        self._rows = rows
+        if (self._rowsCall is not None) or not self.row_listeners:
+            return
+        delay = 0
+        if self._rowsSent is not None:
+            delay = self._rowsSent + self.notify_interval - self.reactor.seconds()
+        if delay > 0:
+            self._rowsCall = self.reactor.callLater(delay, self._sendRows)
+        else:
+            self._sendRows()
+
+    def _sendRows(self):
+        self._rowsCall = None
+        self._rowsSent = self.reactor.seconds()
+        if self.row_listeners:
+            self.hub.onDataRows(self._rows, set(self.row_listeners))
 
     def getData(self, limit, start, transpose=False, simpleOnly=False):
         return self.data.getData(limit, start, transpose, simpleOnly)
 
+    def getDecimated(self, start, stop, points):
+        """
+        Get a min/max reduction of the rows between start and stop (see backend.decimate_minmax).
+        """
+        if hasattr(self.data, 'getDecimated'):
+            return self.data.getDecimated(start, stop, points)
+        # other backends don't support partial reads, so we reduce all the rows at once
+        limit = None if stop is None else max(stop - start, 0)
+        data, _ = self.data.getData(limit, start, False, True)
+        values = np.asarray(data, dtype=np.float64).reshape(len(data), -1)
+        bucket_rows = max(-(-len(values) // max(points // 2, 1)), 1)
+        dependents = range(len(self.getIndependents()), values.shape[1])
+        return values[backend.decimate_minmax(values, bucket_rows, dependents)]
+
+    def getColumns(self, limit, start, columns):
+        """
+        Get up to limit rows of the given columns, as a tuple of column arrays.
+        """
+        if not hasattr(self.data, 'getDataTranspose'):
+            raise RuntimeError("Column selection is only supported for extended datasets")
+        return self.data.getDataTranspose(limit, start, columns)
+
     def keepStreaming(self, context, pos):
         # keepStreaming does something a bit odd and has a confusing name (ERJ)
         #
@@ -721,31 +1361,33 @@ class Dataset(object):
         # 
         # If a client reads, but not to the end of the dataset, it is immediately notified that
         # there is more data for it to read, and then removed from the set of notifiers.
-        if self.data.hasMore(pos):
-            if context in self.listeners:
-                self.listeners.remove(context)
-            self.hub.onDataAvailable(None, [context])
+        more = self.data.hasMore(pos)
+        self._callInReactor(self._keepStreaming, context, more, self.hub.onDataAvailable, 'listeners')
+        # contexts that fell behind resume having rows pushed once they have read all the rows
+        self._callInReactor(self._resumeRows, context, pos, more)
+
+    def _keepStreaming(self, context, more, signal, attr):
+        if more:
+            getattr(self, attr).discard(context)
+            signal(None, [context])
         else:
-            self.listeners.add(context)
+            getattr(self, attr).add(context)
 
     def addComment(self, user, comment):
+        pos = self.data.numComments() if self.wal is not None else None
         self.data.addComment(user, comment)
-        self.save()
+        self._log('comment', pos, user, comment)
+        self._saveMetadata()
 
         # notify all listening contexts
-        self.hub.onCommentsAvailable(None, self.comment_listeners)
-        self.comment_listeners = set()
+        self._notify(self.hub.onCommentsAvailable, 'comment_listeners')
 
     def getComments(self, limit, start):
         return self.data.getComments(limit, start)
 
     def keepStreamingComments(self, context, pos):
-        if pos < self.data.numComments():
-            if context in self.comment_listeners:
-                self.comment_listeners.remove(context)
-            self.hub.onCommentsAvailable(None, [context])
-        else:
-            self.comment_listeners.add(context)
+        self._callInReactor(self._keepStreaming, context, pos < self.data.numComments(),
+                            self.hub.onCommentsAvailable, 'comment_listeners')
 
     def shape(self):
         return self.data.shape()
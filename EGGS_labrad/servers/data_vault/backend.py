@@ -1,30 +1,66 @@
 """
 Contains all data file objects used by the server and utilities used to create/open them.
 """
+import io
 import os
 import h5py
+import mmap
+import queue
 import base64
 import datetime
+import threading
+import warnings
 import numpy as np
 
 from time import time
 from sys import maxsize
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 from . import errors, util
 from labrad import types as T
 from twisted.internet import reactor
+from twisted.python import failure
+from twisted.internet.defer import Deferred, gatherResults, maybeDeferred
 
 ## Data types for variable defintions
 Independent = namedtuple('Independent', ['label', 'shape', 'datatype', 'unit'])
 Dependent = namedtuple('Dependent', ['label', 'legend', 'shape', 'datatype', 'unit'])
+# variables of a dataset in an ARTIQ file (see get_artiq_descriptors)
+ARTIQDescriptor = namedtuple('ARTIQDescriptor', ['independents', 'dependents'])
 
 TIME_FORMAT = '%Y-%m-%d, %H:%M:%S'
 PRECISION = 12  # digits of precision to use when saving data
 DATA_FORMAT = '%%.%dG' % PRECISION
 FILE_TIMEOUT_SEC = 60  # how long to keep datafiles open if not accessed
+MAX_OPEN_FILES = 256  # max number of datafiles kept open at once (see FilePool)
+MAX_ARTIQ_TABLES = 256  # max number of ARTIQ files whose variables are cached (see get_artiq_descriptors)
 DATA_TIMEOUT = 300  # how long to keep data in memory if not accessed
 DATA_URL_PREFIX = 'data:application/labrad;base64,'
+CHUNK_BYTES = 64 * 1024  # target size of automatically sized hdf5 chunks
+CHUNK_BYTES_MAX = 1024 * 1024  # largest automatic chunk (the default hdf5 chunk cache size)
+CHUNKS_PER_DATASET = 1000  # number of chunks to aim for when the expected row count is known
+DECIMATE_BLOCK_ROWS = 1024 * 1024  # max number of rows read at once when decimating
+CONVERT_BLOCK_BYTES = 16 * 1024 * 1024  # max amount of csv text parsed at once when converting to hdf5
+METADATA_INTERVAL = 1.0  # max time buffered metadata changes are held in memory (see setMetadataBuffer)
+ACCESS_INTERVAL = 60  # min time between writes of a dataset's access time
+
+# default layout options for newly created hdf5 datasets
+STORAGE_OPTIONS = {
+    'chunk_rows': 0,            # rows per chunk (0 = size chunks automatically)
+    'compression': '',          # '' (none), 'gzip', or 'lzf'
+    'compression_level': 4,     # gzip compression level (0-9)
+    'shuffle': False,           # byte-shuffle filter, improves compression of numeric data
+    'expected_rows': 0,         # expected number of rows in the dataset (0 = unknown)
+    'growth': '',               # '' (resize on every add) or 'double' (grow capacity geometrically)
+    'layout': '',               # '' (one dataset of rows) or 'columnar' (one dataset per column)
+}
+
+# default write-behind buffering of added rows (see AppendableHDF5Data.setWriteBuffer)
+WRITE_BUFFER = {
+    'max_rows': 10000,          # max number of buffered rows (0 = no buffering)
+    'max_bytes': 1024 * 1024,   # max size of buffered rows, in bytes
+    'interval': 1.0,            # max time rows stay buffered, in seconds
+}
 # todo: break backend up into general stuff (e.g. selfclosingfile, helper functions) and file format implementations
 # todo: note somewhere that versioning uses semantic versioning
 # todo: document versions and differences
@@ -67,22 +103,430 @@ def labrad_urldecode(data_url):
                          "with prefix: {}".format(DATA_URL_PREFIX))
 
 
+def storage_options(options=None, defaults=None):
+    """
+    Create a complete, validated set of storage options for a new hdf5 dataset.
+    Arguments:
+        options     (dict/list((str, str))): the options to override. Values may be given
+                                                as strings (e.g. from a labrad *(ss) argument).
+        defaults    (dict): the options to start from. Uses STORAGE_OPTIONS if None.
+    Returns:
+                    (dict): the storage options.
+    """
+    storage = dict(STORAGE_OPTIONS if defaults is None else defaults)
+    if not options:
+        return storage
+
+    for name, value in dict(options).items():
+        if name not in STORAGE_OPTIONS:
+            raise errors.BadStorageOptionError(name)
+
+        # convert value to the type of the default
+        try:
+            if isinstance(STORAGE_OPTIONS[name], bool):
+                if isinstance(value, str):
+                    value = value.strip().lower() in ('1', 'true', 'yes', 'on')
+                value = bool(value)
+            elif isinstance(STORAGE_OPTIONS[name], int):
+                value = int(value)
+            else:
+                value = str(value).strip().lower()
+        except (TypeError, ValueError):
+            raise errors.BadStorageOptionError(name, value)
+
+        # check values
+        if (name == 'compression') and (value == 'none'):
+            value = ''
+        if (name == 'compression') and (value not in ('', 'gzip', 'lzf')):
+            raise errors.BadStorageOptionError(name, value)
+        elif (name == 'growth') and (value not in ('', 'double')):
+            raise errors.BadStorageOptionError(name, value)
+        elif (name == 'layout') and (value not in ('', 'columnar')):
+            raise errors.BadStorageOptionError(name, value)
+        elif (name == 'compression_level') and not (0 <= value <= 9):
+            raise errors.BadStorageOptionError(name, value)
+        elif (name in ('chunk_rows', 'expected_rows')) and (value < 0):
+            raise errors.BadStorageOptionError(name, value)
+        storage[name] = value
+
+    return storage
+
+
+def dataset_layout(dtype, storage=None, shape=()):
+    """
+    Get the h5py keyword arguments used to create an appendable dataset.
+        If chunk_rows isn't specified, chunks are sized to be about CHUNK_BYTES,
+        or larger if many rows are expected (up to CHUNK_BYTES_MAX).
+    Arguments:
+        dtype       (np.dtype): the row datatype of the dataset.
+        storage     (dict): the storage options (see storage_options).
+        shape       (tuple(int)): the shape of each row, for datasets of array columns.
+    Returns:
+                    (dict): keyword arguments for h5py.Group.create_dataset.
+    """
+    storage = storage_options(storage)
+    shape = tuple(shape)
+    itemsize = max(np.dtype(dtype).itemsize * int(np.prod(shape)), 1)
+
+    # get number of rows per chunk
+    chunk_rows = storage['chunk_rows']
+    if not chunk_rows:
+        chunk_rows = max(CHUNK_BYTES // itemsize, 1)
+        expected_rows = storage['expected_rows']
+        if expected_rows:
+            chunk_rows = max(chunk_rows, min(expected_rows // CHUNKS_PER_DATASET, CHUNK_BYTES_MAX // itemsize))
+            chunk_rows = max(min(chunk_rows, expected_rows), 1)
+
+    layout = {'maxshape': (None,) + shape, 'chunks': (chunk_rows,) + shape}
+    # set filters
+    if storage['compression'] == 'gzip':
+        layout['compression'] = 'gzip'
+        layout['compression_opts'] = storage['compression_level']
+    elif storage['compression'] == 'lzf':
+        layout['compression'] = 'lzf'
+    if storage['shuffle']:
+        layout['shuffle'] = True
+    return layout
+
+
+def decimate_minmax(values, bucket_rows, columns=None, endpoints=True):
+    """
+    Get the rows that hold the min and max of each column within buckets of rows.
+        Peaks and dips are kept no matter how much the data is reduced,
+        which makes this suitable for plotting.
+    Arguments:
+        values      (np.ndarray): 2-D array of data, one row per point.
+        bucket_rows (int): the number of rows per bucket.
+        columns     (list(int)): the columns to keep the extrema of (all columns if None).
+        endpoints   (bool): whether to always keep the first and last rows.
+    Returns:
+                    (np.ndarray): sorted indices of the rows to keep.
+    """
+    num_rows = len(values)
+    if num_rows <= 2 or bucket_rows <= 2:
+        return np.arange(num_rows)
+    columns = list(range(values.shape[1])) if columns is None else list(columns)
+    values = values[:, columns]
+
+    indices = [np.array([0, num_rows - 1] if endpoints else [], dtype=int)]
+    # full buckets are reduced together
+    num_buckets = num_rows // bucket_rows
+    if num_buckets:
+        buckets = values[:num_buckets * bucket_rows].reshape(num_buckets, bucket_rows, len(columns))
+        offsets = (np.arange(num_buckets) * bucket_rows)[:, np.newaxis]
+        indices.append((buckets.argmin(axis=1) + offsets).ravel())
+        indices.append((buckets.argmax(axis=1) + offsets).ravel())
+    # partial bucket at the end
+    if num_rows > num_buckets * bucket_rows:
+        remainder = values[num_buckets * bucket_rows:]
+        indices.append(remainder.argmin(axis=0) + num_buckets * bucket_rows)
+        indices.append(remainder.argmax(axis=0) + num_buckets * bucket_rows)
+    return np.unique(np.concatenate(indices))
+
+
+def to_float_rows(struct_data):
+    """
+    Convert a record array of scalar numeric columns to a 2-D array of floats.
+    """
+    columns = []
+    for name in struct_data.dtype.names:
+        datatype = struct_data.dtype[name]
+        if datatype.shape or (datatype.kind not in 'fiu'):
+            raise RuntimeError("Decimation is only supported for datasets of scalar, real columns")
+        columns.append(struct_data[name])
+    return np.column_stack(columns).astype(np.float64, copy=False)
+
+
+def fsync_file(filename):
+    """
+    Flush a file that is open elsewhere (e.g. by h5py) from the OS cache to disk.
+    """
+    fd = os.open(filename, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FileWorker(object):
+    """
+    Runs all I/O for a single file, in order, on a dedicated thread.
+
+    Calls are submitted from the reactor thread and return Deferreds that fire
+    in the reactor thread.  The thread is started on demand and stopped when
+    the file is closed, so there is one thread per open file.
+    """
+
+    def __init__(self, name='', reactor=reactor):
+        self.name = name
+        self.reactor = reactor
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._queue = None
+        self._thread = None
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) on the worker thread.
+        Returns:
+            Deferred: fires in the reactor thread with the result of the call.
+        """
+        d = Deferred()
+        with self._lock:
+            if self._queue is None:
+                # the new thread waits for any stopping thread so calls stay in order
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, args=(self._queue, self._thread),
+                                                name='FileWorker: {}'.format(self.name), daemon=True)
+                self._thread.start()
+            self._queue.put((d, func, args, kwargs))
+        return d
+
+    def _run(self, calls, previous_thread):
+        if previous_thread is not None:
+            previous_thread.join()
+        self._local.active = True
+        while True:
+            call = calls.get()
+            if call is None:
+                return
+            d, func, args, kwargs = call
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                self.reactor.callFromThread(d.errback, failure.Failure())
+            else:
+                self.reactor.callFromThread(d.callback, result)
+
+    def inThread(self):
+        """
+        Check whether we are running on the worker thread.
+        """
+        return getattr(self._local, 'active', False)
+
+    def callInReactor(self, func, *args):
+        """
+        Call func in the reactor thread.
+            Calls func immediately unless we are on the worker thread.
+        """
+        if self.inThread():
+            self.reactor.callFromThread(func, *args)
+        else:
+            func(*args)
+
+    def stop(self):
+        """
+        Stop the worker thread once all submitted calls have been run.
+        """
+        with self._lock:
+            if self._queue is not None:
+                self._queue.put(None)
+                self._queue = None
+
+    def drain(self, timeout=None):
+        """
+        Block until all submitted calls have been run.
+            Used on shutdown, when the reactor may not be running.
+        """
+        if self.inThread():
+            return
+        with self._lock:
+            thread = self._thread
+            if self._queue is not None:
+                self._queue.put(None)
+                self._queue = None
+        if thread is not None:
+            thread.join(timeout)
+
+
+class FilePool(object):
+    """
+    Keeps track of all open SelfClosingFiles using a reactor.
+
+    Files are closed once they haven't been accessed within their timeout,
+    using a single timer for all files that fires at the earliest deadline.
+    If more than max_open files are open, the least recently used files
+    are closed early (evicted); they are reopened on their next access.
+
+    The pool is only modified in the reactor thread. Files are closed on
+    their worker thread (if they have one), after checking again that
+    they haven't been accessed in the meantime.
+    """
+
+    def __init__(self, max_open=MAX_OPEN_FILES, reactor=reactor):
+        self.max_open = max_open
+        self.reactor = reactor
+        self._files = set()
+        # files that have been asked to close
+        self._closing = set()
+        # files opened or closed since the last sync (kept so closed files are synced too)
+        self._unsynced = set()
+        self._sweepCall = None
+        # counters are updated from worker threads
+        self._lock = threading.Lock()
+        self._counts = {'opens': 0, 'closes': 0, 'hits': 0, 'evictions': 0}
+
+    def stats(self):
+        """
+        Get the pool statistics.
+        Returns:
+                    (dict): the number of open files, max_open, and the number of
+                            opens, closes, hits (accesses to open files) and evictions.
+        """
+        with self._lock:
+            stats = dict(self._counts)
+        stats['open'] = len(self._files)
+        stats['max_open'] = self.max_open
+        return stats
+
+    def setMaxOpen(self, max_open):
+        """
+        Set the max number of open files, evicting files if there are too many open.
+        """
+        self.max_open = max_open
+        self._evict()
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def opened(self, fh):
+        """
+        Count a file opening. Can be called from any thread.
+        """
+        self._count('opens')
+        with self._lock:
+            self._unsynced.add(fh)
+        fh._callInReactor(self.add, fh)
+
+    def hit(self):
+        """
+        Count an access to an open file. Can be called from any thread.
+        """
+        self._count('hits')
+
+    def closed(self, fh):
+        """
+        Count a file closing. Can be called from any thread.
+        """
+        self._count('closes')
+        with self._lock:
+            self._unsynced.add(fh)
+        fh._callInReactor(self.remove, fh)
+
+    def add(self, fh):
+        """
+        Start keeping track of an open file.
+        """
+        self._files.add(fh)
+        self._evict(keep=fh)
+        self._schedule(fh._accessed + fh.timeout)
+
+    def remove(self, fh):
+        """
+        Stop keeping track of a closed file.
+        """
+        self._files.discard(fh)
+        self._closing.discard(fh)
+
+    def keep(self, fh):
+        """
+        Keep a file that was accessed while it was being closed.
+        """
+        self._closing.discard(fh)
+        if fh in self._files:
+            self._schedule(fh._accessed + fh.timeout)
+
+    def sync(self):
+        """
+        Save and sync to disk all open files, and all files opened or closed since the last sync.
+            Files whose datasets are no longer referenced are synced too, so every change
+            made before the call survives a crash (see SelfClosingFile.sync).
+        Returns:
+            Deferred: fires once all the files are synced, or fails if any of them couldn't be.
+        """
+        with self._lock:
+            files = self._files | self._unsynced
+            self._unsynced = set()
+        return gatherResults([fh.runSync() for fh in files], consumeErrors=True)
+
+    def _evict(self, keep=None):
+        """
+        Close the least recently used files until no more than max_open are open.
+        """
+        candidates = [fh for fh in self._files if (fh is not keep) and (fh not in self._closing)]
+        excess = len(self._files) - len(self._closing) - self.max_open
+        if excess <= 0:
+            return
+        for fh in sorted(candidates, key=lambda fh: fh._accessed)[:excess]:
+            self._closing.add(fh)
+            self._count('evictions')
+            fh._requestClose(force=True)
+
+    def _schedule(self, deadline):
+        """
+        Make sure the sweep runs no later than deadline.
+        """
+        delay = max(deadline - self.reactor.seconds(), 0)
+        if (self._sweepCall is None) or not self._sweepCall.active():
+            self._sweepCall = self.reactor.callLater(delay, self._sweep)
+        elif deadline < self._sweepCall.getTime():
+            self._sweepCall.reset(delay)
+
+    def _sweep(self):
+        """
+        Close all files that haven't been accessed within their timeout,
+        then schedule the next sweep.
+        """
+        now = self.reactor.seconds()
+        next_deadline = None
+        for fh in list(self._files - self._closing):
+            deadline = fh._accessed + fh.timeout
+            if deadline <= now:
+                self._closing.add(fh)
+                fh._requestClose()
+            elif (next_deadline is None) or (deadline < next_deadline):
+                next_deadline = deadline
+        if next_deadline is not None:
+            self._schedule(next_deadline)
+
+
+_file_pools = {}
+
+
+def get_file_pool(reactor=reactor):
+    """
+    Get the FilePool for files using a reactor.
+    """
+    if reactor not in _file_pools:
+        _file_pools[reactor] = FilePool(reactor=reactor)
+    return _file_pools[reactor]
+
+
 class SelfClosingFile(object):
     """
     A container for a file object that manages the underlying file handle.
 
     The file will be opened on demand when this container is called, then
     closed automatically if not accessed within a specified timeout.
+    Open files are tracked by a FilePool, which also limits the number of
+    files open at once.
+
+    If a FileWorker is given, all access to the file is expected to happen
+    on the worker thread, and timeouts close the file on the worker thread.
     """
 
     def __init__(self, opener=open, open_args=(), open_kw={},
-                 timeout=FILE_TIMEOUT_SEC, touch=True, reactor=reactor):
+                 timeout=FILE_TIMEOUT_SEC, touch=True, reactor=reactor, worker=None, pool=None):
         self.opener = opener
         self.open_args = open_args
         self.open_kw = open_kw
         self.timeout = timeout
         self.callbacks = []
+        self.sync_callbacks = []
         self.reactor = reactor
+        self.worker = worker
+        self.pool = get_file_pool(reactor) if pool is None else pool
         if touch:
             self.__call__()
 
@@ -92,25 +536,85 @@ class SelfClosingFile(object):
         Runs when an instance is called without arguments
         (e.g. e = Example, e())
         """
+        # record access time; the pool checks this before closing the file
+        self._accessed = self.reactor.seconds()
         # open the file if we don't already have one
         if not hasattr(self, '_file'):
             self._file = self.opener(*self.open_args, **self.open_kw)
-            # begin the countdown if called after exceeding the timeout
-            self._fileTimeoutCall = self.reactor.callLater(self.timeout, self._fileTimeout)
-        # otherwise, reset the timer
+            # begin the countdown
+            self.pool.opened(self)
         else:
-            self._fileTimeoutCall.reset(self.timeout)
+            self.pool.hit()
         return self._file
 
+    def _callInReactor(self, func, *args):
+        if self.worker is not None:
+            self.worker.callInReactor(func, *args)
+        else:
+            func(*args)
+
+    def _requestClose(self, force=False):
+        """
+        Close the file on the worker thread (if we have one).
+            Called by the pool when the file has timed out, or (with force) when evicted.
+        """
+        # errors are printed rather than raised, since the caller is usually closing other files too
+        if self.worker is not None:
+            self.worker.submit(self._checkTimeout, force).addErrback(print)
+        else:
+            try:
+                self._checkTimeout(force)
+            except Exception as e:
+                print('Error closing {}: {}'.format(self.open_args, e))
+
+    def _checkTimeout(self, force=False):
+        """
+        Close the file if it hasn't been accessed within the timeout,
+        otherwise give it back to the pool.
+        """
+        if not hasattr(self, '_file'):
+            return
+        if force or (self._accessed + self.timeout <= self.reactor.seconds()):
+            self._fileTimeout()
+        else:
+            self._callInReactor(self.pool.keep, self)
+
+    def callLater(self, delay, func, *args):
+        """
+        Call func after delay seconds.
+            Runs func on the worker thread if we have one.
+            Can be called from either the reactor or the worker thread.
+        """
+        if self.worker is not None:
+            self._callInReactor(self.reactor.callLater, delay, self.worker.submit, func, *args)
+        else:
+            self.reactor.callLater(delay, func, *args)
+
     def _fileTimeout(self):
         """
         Run all cleanup callbacks, close the file, and delete timeout functions.
         """
-        for callback in self.callbacks:
-            callback(self)
-        self._file.close()
-        del self._file
-        del self._fileTimeoutCall
+        # close the file even if a callback fails, so the handle isn't leaked
+        try:
+            for callback in self.callbacks:
+                callback(self)
+        finally:
+            self._file.close()
+            del self._file
+            self.pool.closed(self)
+            # stop the worker thread; it is restarted when the file is next used
+            if self.worker is not None:
+                self.worker.stop()
+
+    def close(self):
+        """
+        Close the file immediately (e.g. on shutdown).
+        Waits for any pending calls on the worker thread to finish first.
+        """
+        if self.worker is not None:
+            self.worker.drain()
+        if hasattr(self, '_file'):
+            self._fileTimeout()
 
     def size(self):
         return os.fstat(self().fileno()).st_size
@@ -121,8 +625,168 @@ class SelfClosingFile(object):
         """
         self.callbacks.append(callback)
 
+    def onSync(self, callback):
+        """
+        Calls callback before the file is synced to disk, whether or not it is open.
+        """
+        self.sync_callbacks.append(callback)
+
+    def sync(self):
+        """
+        Save buffered changes and sync the file to disk, without closing it.
+            Runs the sync callbacks, flushes the file if it is open, and fsyncs it.
+            Runs on the calling thread; use runSync to run it on the worker thread.
+        """
+        for callback in self.sync_callbacks:
+            callback(self)
+        if hasattr(self, '_file'):
+            self._file.flush()
+        filename = self.open_args[0]
+        # files opened read-only are never changed
+        if (self.open_args[1:2] != ('r',)) and os.path.exists(filename):
+            fsync_file(filename)
+        # don't keep a worker thread for a closed file (it is restarted when the file is next used)
+        if (self.worker is not None) and not hasattr(self, '_file'):
+            self.worker.stop()
+
+    def runSync(self):
+        """
+        Sync the file on the worker thread (if we have one).
+        Returns:
+            Deferred: fires once the file is synced.
+        """
+        if self.worker is not None:
+            return self.worker.submit(self.sync)
+        return maybeDeferred(self.sync)
+
 
 # INI & CSV FILES
+def parse_csv_rows(text, cols):
+    """
+    Parse complete lines of comma-separated floats into a 2-D array.
+        Lines are parsed in a single vectorized pass; if the lines don't hold
+        exactly cols values each (e.g. blank lines), they are parsed by np.loadtxt.
+    Arguments:
+        text        (bytes): the lines to parse.
+        cols        (int): the number of values per line.
+    Returns:
+                    (np.ndarray): array of shape (rows, cols).
+    """
+    text = text.replace(b'\r', b'').strip()
+    if not text:
+        return np.empty((0, cols))
+    with warnings.catch_warnings():
+        # np.fromstring stops at unparseable values with a DeprecationWarning
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(text.replace(b'\n', b',').decode('ascii'), sep=',')
+        except (DeprecationWarning, ValueError):
+            values = None
+    num_lines = text.count(b'\n') + 1
+    if (values is not None) and (values.size == num_lines * cols):
+        return values.reshape(num_lines, cols)
+    values = np.loadtxt(io.BytesIO(text), delimiter=',', ndmin=2)
+    if values.shape[1] != cols:
+        raise errors.BadDataError(cols, values.shape[1])
+    return values
+
+
+class RowBuffer(object):
+    """
+    A growable 2-D array of floats.
+
+    Rows are stored in a preallocated array whose capacity is doubled when
+    it fills up, so appending n rows one at a time takes O(n) copying
+    instead of the O(n^2) of repeatedly stacking arrays.
+    """
+
+    def __init__(self, cols, capacity=1024):
+        self.cols = cols
+        self._buffer = np.empty((max(capacity, 1), cols))
+        self._rows = 0
+
+    def __len__(self):
+        return self._rows
+
+    @property
+    def rows(self):
+        """
+        A view of the filled rows.
+            Appending never modifies rows that are already filled, so views
+            returned here remain valid.
+        """
+        return self._buffer[:self._rows]
+
+    def append(self, rows):
+        """
+        Append rows to the buffer.
+        Arguments:
+            rows        (np.ndarray): 2-D array of rows to append.
+        """
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, self.cols)
+        needed = self._rows + len(rows)
+        if needed > len(self._buffer):
+            capacity = len(self._buffer)
+            while capacity < needed:
+                capacity *= 2
+            buffer = np.empty((capacity, self.cols))
+            buffer[:self._rows] = self._buffer[:self._rows]
+            self._buffer = buffer
+        self._buffer[self._rows:needed] = rows
+        self._rows = needed
+
+
+class CsvRowReader(object):
+    """
+    Incrementally reads rows of floats from a csv file.
+
+    The reader remembers the byte offset of the first unread line. Each read
+    memory-maps the file and parses only the complete lines written past
+    that offset, so rows appended to the file (by us or by another process)
+    are parsed exactly once.
+    """
+
+    def __init__(self, filename, cols):
+        self.filename = filename
+        self.cols = cols
+        self.pos = 0
+
+    def read(self, max_bytes=None):
+        """
+        Parse the complete lines appended to the file since the last read.
+        Arguments:
+            max_bytes   (int): the max number of bytes to parse (None for no limit).
+                            At least one line is parsed, however long it is.
+        Returns:
+                        (np.ndarray): array of the new rows, of shape (rows, cols).
+        """
+        try:
+            with open(self.filename, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size <= self.pos:
+                    return np.empty((0, self.cols))
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    end = size
+                    if (max_bytes is not None) and (self.pos + max_bytes < size):
+                        end = mm.find(b'\n', self.pos + max_bytes) + 1 or size
+                    end = mm.rfind(b'\n', self.pos, end) + 1
+                    if end <= 0:
+                        return np.empty((0, self.cols))
+                    text = mm[self.pos:end]
+        except FileNotFoundError:
+            return np.empty((0, self.cols))
+        rows = parse_csv_rows(text, self.cols)
+        self.pos = end
+        return rows
+
+    def skip(self, pos):
+        """
+        Mark everything before byte offset pos as read (e.g. after writing rows that
+        are already in memory).
+        """
+        self.pos = pos
+
+
 class IniData(object):
     """
     Handles dataset metadata stored in INI files.
@@ -136,6 +800,12 @@ class IniData(object):
     INI file as well as accessors for all the metadata attributes.
     """
 
+    # metadata buffering is disabled until setMetadataBuffer is called
+    _metadata_interval = 0
+    _save_pending = False
+    # parameter name index, built on first use (see _paramIndex)
+    _param_index = None
+
     def load(self):
         S = util.DVSafeConfigParser()
         S.read(self.infofile)
@@ -191,6 +861,7 @@ class IniData(object):
 
         count = S.getint(gen, 'Parameters')
         self.parameters = [getPar(i) for i in range(count)]
+        self._param_index = None
 
         # get comments if they're there
         if S.has_section('Comments'):
@@ -205,6 +876,7 @@ class IniData(object):
             self.comments = []
 
     def save(self):
+        self._save_pending = False
         S = util.DVSafeConfigParser()
 
         sec = 'General'
@@ -254,6 +926,7 @@ class IniData(object):
         self.independents = indep
         self.dependents = dep
         self.parameters = []
+        self._param_index = None
         self.comments = []
         self.cols = len(indep) + len(dep)
 
@@ -261,8 +934,42 @@ class IniData(object):
     def dtype(self):
         return np.dtype(','.join(['f8'] * self.cols))
 
+    def setMetadataBuffer(self, interval=0.):
+        """
+        Configure buffering of metadata changes.
+            When buffering, the INI file is saved interval seconds after the first
+            change, or when the data file is closed. Otherwise, it is only saved by save.
+        Arguments:
+            interval    (float): the max time changes stay unsaved, in seconds (0 disables buffering).
+        """
+        if interval and not self._metadata_interval:
+            self._file.onClose(self._onMetadataClose)
+        self._metadata_interval = float(interval)
+
+    def _metadataChanged(self):
+        """
+        Schedule a save of the INI file if metadata is buffered.
+        """
+        if self._metadata_interval and not self._save_pending:
+            self._save_pending = True
+            self._file.callLater(self._metadata_interval, self._savePending)
+
+    def _savePending(self):
+        if self._save_pending:
+            self.save()
+
+    def _onMetadataClose(self, fh):
+        self._savePending()
+
+    def _onIniSync(self, fh):
+        # the INI file is written directly, rather than through a SelfClosingFile
+        self._savePending()
+        if os.path.exists(self.infofile):
+            fsync_file(self.infofile)
+
     def access(self):
         self.accessed = datetime.datetime.now()
+        self._metadataChanged()
 
     def getIndependents(self):
         return self.independents
@@ -284,21 +991,37 @@ class IniData(object):
         type_tag = '({})'.format(','.join(units))
         return type_tag
 
+    def _paramIndex(self):
+        """
+        Get the parameter index, {name: value}.
+            Also builds _param_lower, {lowercase name: name}, for case-insensitive lookups.
+        """
+        if self._param_index is None:
+            self._param_index = {}
+            self._param_lower = {}
+            for p in self.parameters:
+                self._indexParam(p['label'], p['data'])
+        return self._param_index
+
+    def _indexParam(self, name, data):
+        # the first parameter with a (lowercase) name wins, like a scan of the parameter list
+        self._param_index.setdefault(name, data)
+        self._param_lower.setdefault(name.lower(), name)
+
     def addParam(self, name, data):
-        for p in self.parameters:
-            if p['label'] == name:
-                raise errors.ParameterInUseError(name)
+        if name in self._paramIndex():
+            raise errors.ParameterInUseError(name)
         d = dict(label=name, data=data)
         self.parameters.append(d)
+        self._indexParam(name, data)
+        self._metadataChanged()
 
     def getParameter(self, name, case_sensitive=True):
-        for p in self.parameters:
-            if case_sensitive:
-                if p['label'] == name:
-                    return p['data']
-            else:
-                if p['label'].lower() == name.lower():
-                    return p['data']
+        index = self._paramIndex()
+        if not case_sensitive:
+            name = self._param_lower.get(name.lower(), name)
+        if name in index:
+            return index[name]
         raise errors.BadParameterError(name)
 
     def getParamNames(self):
@@ -306,6 +1029,7 @@ class IniData(object):
 
     def addComment(self, user, comment):
         self.comments.append((datetime.datetime.now(), user, comment))
+        self._metadataChanged()
 
     def getComments(self, limit, start):
         if limit is None:
@@ -336,6 +1060,7 @@ class CsvListData(IniData):
         self.timeout = data_timeout
         self.infofile = filename[:-4] + '.ini'
         self.reactor = reactor
+        self._file.onSync(self._onIniSync)
 
     @property
     def file(self):
@@ -352,21 +1077,19 @@ class CsvListData(IniData):
         The data is scheduled to be cleared from memory unless accessed."""
         if not hasattr(self, '_data'):
             self._data = []
-            self._datapos = 0
+            self._reader = CsvRowReader(self.filename, self.cols)
             self._timeout_call = self.reactor.callLater(self.timeout,
                                                         self._on_timeout)
         else:
             self._timeout_call.reset(DATA_TIMEOUT)
-        f = self.file
-        f.seek(self._datapos)
-        lines = f.readlines()
-        self._data.extend([float(n) for n in line.split(',')] for line in lines)
-        self._datapos = f.tell()
+        # make sure our own writes are on disk, then parse only the new lines
+        self.file.flush()
+        self._data.extend(self._reader.read().tolist())
         return self._data
 
     def _on_timeout(self):
         del self._data
-        del self._datapos
+        del self._reader
         del self._timeout_call
 
     def _saveData(self, data):
@@ -402,7 +1125,9 @@ class CsvNumpyData(CsvListData):
     """
     Data backed by a csv-formatted file.
 
-    Stores the entire contents of the file in memory as a list or numpy array
+    Rows are kept in memory in a growable numpy buffer (see RowBuffer). The file
+    is parsed incrementally: each access only parses lines appended since the
+    last one (see CsvRowReader), rather than reloading the whole file.
     """
 
     def __init__(self, filename, reactor=reactor):
@@ -410,50 +1135,39 @@ class CsvNumpyData(CsvListData):
         self._file = SelfClosingFile(open_args=(filename, 'a+'), reactor=reactor)
         self.infofile = filename[:-4] + '.ini'
         self.reactor = reactor
+        self._file.onSync(self._onIniSync)
 
     @property
     def file(self):
         return self._file()
 
-    def _get_data(self):
+    def _sync(self):
         """
-        Read data from file on demand.
+        Read data from file on demand, parsing only rows added since the last read.
         The data is scheduled to be cleared from memory unless accessed.
         """
         if not hasattr(self, '_data'):
-            try:
-                # if the file is empty, this line can barf in certain versions
-                # of numpy.  Clearly, if the file does not exist on disk, this
-                # will be the case.  Even if the file exists on disk, we must
-                # check its size
-                if self._file.size() > 0:
-                    self.file.seek(0)
-                    self._data = np.loadtxt(self.file, delimiter=',')
-                else:
-                    self._data = np.array([[]])
-                if len(self._data.shape) == 1:
-                    self._data.shape = (1, len(self._data))
-            except ValueError:
-                # no data saved yet
-                # this error is raised by numpy <=1.2
-                self._data = np.array([[]])
-            except IOError:
-                # no data saved yet
-                # this error is raised by numpy 1.3
-                self.file.seek(0)
-                self._data = np.array([[]])
+            self._data = RowBuffer(self.cols)
+            self._reader = CsvRowReader(self.filename, self.cols)
             self._timeout_call = self.reactor.callLater(DATA_TIMEOUT, self._on_timeout)
         else:
             self._timeout_call.reset(DATA_TIMEOUT)
+        rows = self._reader.read()
+        if len(rows):
+            self._data.append(rows)
         return self._data
 
-    def _set_data(self, data):
-        self._data = data
-
-    data = property(_get_data, _set_data)
+    @property
+    def data(self):
+        buffer = self._sync()
+        # empty datasets are represented by a single empty row
+        if not len(buffer):
+            return np.array([[]])
+        return buffer.rows
 
     def _on_timeout(self):
         del self._data
+        del self._reader
         del self._timeout_call
 
     def _saveData(self, data):
@@ -469,14 +1183,12 @@ class CsvNumpyData(CsvListData):
 
         # Ordinarily, we are using record arrays, but for numpy savetxt we want a 2-D array
         record_data = util.from_record_array(data)
-        # append data to in-memory data
-        if self.data.size > 0:
-            self.data = np.vstack((self.data, record_data))
-        else:
-            self.data = record_data
-
-        # append data to file
+        # parse any rows added by others first, so the rows stay in file order
+        buffer = self._sync()
+        # append data to file, then to the in-memory buffer without re-parsing it
         self._saveData(data)
+        buffer.append(record_data)
+        self._reader.skip(self._file.size())
 
     def getData(self, limit, start, transpose, simpleOnly):
         if transpose:
@@ -496,8 +1208,7 @@ class CsvNumpyData(CsvListData):
         if pos == 0:
             return os.path.getsize(self.filename) > 0
         else:
-            nrows = len(self.data) if self.data.size > 0 else 0
-            return pos < nrows
+            return pos < len(self._sync())
 
 
 # HDF DATA FILES
@@ -517,17 +1228,76 @@ class HDF5MetaData(object):
         ('Comment', h5py.special_dtype(vlen=str))
     ]
 
+    # metadata buffering is disabled until setMetadataBuffer is called
+    _metadata_interval = 0
+    _save_pending = False
+    # parameter name index, built on first use (see _paramIndex)
+    _param_names = None
+
     def load(self):
         """
-        Load and save do nothing because HDF5 metadata is accessed live.
+        Load does nothing because HDF5 metadata is accessed live.
         """
         pass
 
     def save(self):
         """
-        Load and save do nothing because HDF5 metadata is accessed live.
+        Write any buffered metadata changes to the file.
         """
-        pass
+        self._save_pending = False
+        if not self._metadata_interval:
+            return
+        attrs = self.dataset.attrs
+        for keyname, value in self._pending_params.items():
+            attrs[keyname] = value
+        if self._pending_comments:
+            new_comments = np.array(self._pending_comments, dtype=self.comment_type)
+            data = np.hstack((attrs['Comments'], new_comments))
+            attrs.create('Comments', data, dtype=self.comment_type)
+        if self._pending_access is not None:
+            attrs['Access Time'] = self._pending_access
+        self._pending_params = {}
+        self._pending_comments = []
+        self._pending_access = None
+
+    def setMetadataBuffer(self, interval=0.):
+        """
+        Configure buffering of metadata changes.
+            Buffered parameters, comments and access times are written to the file
+            together by save, interval seconds after the first buffered change,
+            or when the file is closed.
+        Arguments:
+            interval    (float): the max time changes stay buffered, in seconds (0 disables buffering).
+        """
+        self.save()
+        if interval and not self._metadata_interval:
+            self._pending_params = {}
+            self._pending_comments = []
+            self._pending_access = None
+            self._file.onClose(self._onMetadataClose)
+            self._file.onSync(self._onMetadataSync)
+        self._metadata_interval = float(interval)
+
+    def _metadataChanged(self):
+        """
+        Schedule a save of the buffered metadata changes.
+        """
+        if not self._save_pending:
+            self._save_pending = True
+            self._file.callLater(self._metadata_interval, self._savePending)
+
+    def _savePending(self):
+        # the file may have been closed (and the changes saved) in the meantime
+        if self._save_pending:
+            self.save()
+
+    def _onMetadataClose(self, fh):
+        self._savePending()
+
+    def _onMetadataSync(self, fh):
+        # changes were saved when the file was closed
+        if hasattr(fh, '_file'):
+            self._savePending()
 
     @property
     def dtype(self):
@@ -538,6 +1308,7 @@ class HDF5MetaData(object):
         Initializes the metadata for a newly created dataset.
         """
         t = time()
+        self._param_names = None
 
         attrs = self.dataset.attrs
         attrs['Title'] = title
@@ -562,7 +1333,11 @@ class HDF5MetaData(object):
             attrs[prefix + 'unit'] = d.unit
 
     def access(self):
-        self.dataset.attrs['Access Time'] = time()
+        if self._metadata_interval:
+            self._pending_access = time()
+            self._metadataChanged()
+        else:
+            self.dataset.attrs['Access Time'] = time()
 
     def getIndependents(self):
         attrs = self.dataset.attrs
@@ -637,26 +1412,57 @@ class HDF5MetaData(object):
         type_tag = '({})'.format(','.join(column_type))
         return type_tag
 
+    def _pendingParams(self):
+        return self._pending_params if self._metadata_interval else {}
+
+    def _paramIndex(self):
+        """
+        Get the names of all parameters, including buffered parameters, as a dict.
+            Also builds _param_lower, {lowercase name: name}, for case-insensitive
+            lookups, and _param_values, the cache of decoded parameter values.
+            Parameter values are only decoded the first time they're read.
+        """
+        if self._param_names is None:
+            self._param_names = {}
+            self._param_lower = {}
+            self._param_values = {}
+            for keyname in list(self.dataset.attrs) + list(self._pendingParams()):
+                if keyname.startswith('Param.'):
+                    self._indexParam(str(keyname[6:]))
+        return self._param_names
+
+    def _indexParam(self, name):
+        # the first parameter with a (lowercase) name wins, like a scan of the attributes
+        self._param_names.setdefault(name, None)
+        self._param_lower.setdefault(name.lower(), name)
+
     def addParam(self, name, data):
         keyname = 'Param.{}'.format(name)
-        if keyname in self.dataset.attrs:
+        if name in self._paramIndex():
             raise errors.ParameterInUseError(name)
         value = labrad_urlencode(data)
-        self.dataset.attrs[keyname] = value
+        if self._metadata_interval:
+            self._pending_params[keyname] = value
+            self._metadataChanged()
+        else:
+            self.dataset.attrs[keyname] = value
+        self._indexParam(name)
 
     def getParameter(self, name, case_sensitive=True):
         """
-        Get a parameter from the dataset.
+        Get a parameter from the dataset, including buffered parameters.
         """
-        keyname = 'Param.{}'.format(name)
-        if case_sensitive:
-            if keyname in self.dataset.attrs:
-                return labrad_urldecode(self.dataset.attrs[keyname])
-        else:
-            for k in self.dataset.attrs:
-                if k.lower() == keyname.lower():
-                    return labrad_urldecode(self.dataset.attrs[k])
-        raise errors.BadParameterError(name)
+        names = self._paramIndex()
+        if not case_sensitive:
+            name = self._param_lower.get(name.lower(), name)
+        if name not in names:
+            raise errors.BadParameterError(name)
+        if name not in self._param_values:
+            keyname = 'Param.{}'.format(name)
+            pending = self._pendingParams()
+            value = pending[keyname] if keyname in pending else self.dataset.attrs[keyname]
+            self._param_values[name] = labrad_urldecode(value)
+        return self._param_values[name]
 
     def getParamNames(self):
         """
@@ -665,13 +1471,17 @@ class HDF5MetaData(object):
         Parameter names in the HDF5 file are prefixed with 'Param.' to avoid
         conflicts with the other metadata.
         """
-        return [str(k[6:]) for k in self.dataset.attrs if k.startswith('Param.')]
+        return list(self._paramIndex())
 
     def addComment(self, user, comment):
         """
         Add a comment to the dataset.
         """
         t = time()
+        if self._metadata_interval:
+            self._pending_comments.append((t, user, comment))
+            self._metadataChanged()
+            return
         new_comment = np.array([(t, user, comment)], dtype=self.comment_type)
         old_comments = self.dataset.attrs['Comments']
         data = np.hstack((old_comments, new_comment))
@@ -681,6 +1491,9 @@ class HDF5MetaData(object):
         """
         Get comments in [(datetime, username, comment), ...] format.
         """
+        # readers should see buffered comments
+        if self._save_pending:
+            self.save()
         if limit is None:
             raw_comments = self.dataset.attrs['Comments'][start:]
         else:
@@ -689,10 +1502,230 @@ class HDF5MetaData(object):
         return comments, start + len(comments)
 
     def numComments(self):
+        if self._metadata_interval:
+            return len(self.dataset.attrs['Comments']) + len(self._pending_comments)
         return len(self.dataset.attrs['Comments'])
 
 
-class ExtendedHDF5Data(HDF5MetaData):
+class AppendableHDF5Data(HDF5MetaData):
+    """
+    Row bookkeeping for datasets stored in /DataVault.
+
+    By default, the dataset is resized on every add.  Datasets created with
+    the 'double' growth option instead grow their capacity geometrically and
+    keep the logical number of rows in the 'Rows' attribute.  The logical row
+    count is kept in memory and written to the file (and the unused capacity
+    trimmed) when the file is closed or trimmed; reads only see logical rows.
+
+    Added rows can also be held in a write-behind buffer (see setWriteBuffer),
+    which coalesces many small adds into a single write.
+    """
+
+    def _init_rows(self):
+        """
+        Set up row bookkeeping for an existing dataset.
+        """
+        self._rows = None
+        if 'DataVault' in self.file:
+            attrs = self.dataset.attrs
+            if 'Rows' in attrs:
+                self._rows = int(attrs['Rows'])
+        self._file.onClose(self._onFileClose)
+        self._file.onSync(self._onFileSync)
+
+        # write-behind buffer
+        self._buffer = []
+        self._buffer_rows = 0
+        self._buffer_bytes = 0
+        self._max_rows = 0
+        self._max_bytes = 0
+        self._interval = 0
+        self._flushPending = False
+
+    def setWriteBuffer(self, max_rows=0, max_bytes=0, interval=0.):
+        """
+        Configure write-behind buffering of added rows.
+            Buffered rows are written to the file in a single write once the buffer
+            is full, interval seconds after the first buffered row was added,
+            when data is read, or when the file is closed.
+        Arguments:
+            max_rows    (int): the max number of buffered rows (0 disables buffering).
+            max_bytes   (int): the max size of buffered rows, in bytes.
+            interval    (float): the max time rows stay buffered, in seconds.
+        """
+        self.flush()
+        self._max_rows = int(max_rows)
+        self._max_bytes = int(max_bytes)
+        self._interval = float(interval)
+
+    def _create_dataset(self, dtype, storage):
+        """
+        Create the /DataVault dataset with the layout given by the storage options.
+        """
+        storage = storage_options(storage)
+        dataset = self.file.create_dataset('DataVault', (0,), dtype=dtype, **dataset_layout(dtype, storage))
+        if storage['growth'] == 'double':
+            dataset.attrs['Rows'] = 0
+            self._rows = 0
+
+    def _appendRows(self, data):
+        """
+        Add rows to the write buffer, or write them directly if buffering is disabled.
+        """
+        if not self._max_rows:
+            self._writeRows(self.dataset, data)
+            return
+
+        # convert now so bad data raises errors on add, rather than on flush
+        if not hasattr(self, '_dtype'):
+            self._dtype = self.dtype
+        data = np.asarray(data).astype(self._dtype, copy=False)
+        self._buffer.append(data)
+        self._buffer_rows += len(data)
+        self._buffer_bytes += data.nbytes
+
+        if (self._buffer_rows >= self._max_rows) or (self._buffer_bytes >= self._max_bytes):
+            self.flush()
+        elif not self._flushPending:
+            self._flushPending = True
+            self._file.callLater(self._interval, self._flushTimeout)
+
+    def _flushTimeout(self):
+        self._flushPending = False
+        self.flush()
+
+    def flush(self):
+        """
+        Write all buffered rows to the file.
+        """
+        if self._buffer:
+            self._flushBuffer(self.dataset)
+
+    def _flushBuffer(self, dataset):
+        if not self._buffer:
+            return
+        data = self._buffer[0] if len(self._buffer) == 1 else np.concatenate(self._buffer)
+        self._writeRows(dataset, data)
+        self._buffer = []
+        self._buffer_rows = 0
+        self._buffer_bytes = 0
+
+    def _capacity(self, dataset):
+        return dataset.shape[0]
+
+    def _chunkRows(self, dataset):
+        return dataset.chunks[0]
+
+    def _resize(self, dataset, rows):
+        dataset.resize((rows,))
+
+    def _writeSlice(self, dataset, start, data):
+        dataset[start:start + len(data)] = data
+
+    def _writeRows(self, dataset, data):
+        """
+        Write rows to the end of the dataset, resizing it if necessary.
+        """
+        new_rows = len(data)
+        old_rows = self._capacity(dataset) if self._rows is None else self._rows
+        if self._rows is None:
+            self._resize(dataset, old_rows + new_rows)
+        else:
+            capacity = self._capacity(dataset)
+            if old_rows + new_rows > capacity:
+                # save row count before growing so unused rows are never mistaken for data
+                dataset.attrs['Rows'] = old_rows
+                self._resize(dataset, max(2 * capacity, old_rows + new_rows, self._chunkRows(dataset)))
+            self._rows = old_rows + new_rows
+        self._writeSlice(dataset, old_rows, data)
+
+    def _saveRows(self, dataset):
+        """
+        Write the logical row count and trim unused capacity.
+        """
+        if self._rows is None:
+            return
+        if self._capacity(dataset) != self._rows:
+            self._resize(dataset, self._rows)
+        if dataset.attrs['Rows'] != self._rows:
+            dataset.attrs['Rows'] = self._rows
+
+    def _onFileClose(self, fh):
+        # use the underlying file object directly since the file is being closed
+        if 'DataVault' in fh._file:
+            dataset = fh._file['DataVault']
+            self._flushBuffer(dataset)
+            self._saveRows(dataset)
+
+    def _onFileSync(self, fh):
+        # buffered rows were written when the file was closed
+        if hasattr(fh, '_file'):
+            self._onFileClose(fh)
+
+    def trim(self):
+        """
+        Save the row count to the file and release unused capacity.
+        """
+        self.flush()
+        self._saveRows(self.dataset)
+
+    def _rowRange(self, limit, start):
+        # readers should see buffered rows
+        self.flush()
+        stop = len(self) if limit is None else min(start + limit, len(self))
+        return start, max(stop, start)
+
+    def __len__(self):
+        if self._rows is None:
+            return self._capacity(self.dataset) + self._buffer_rows
+        return self._rows + self._buffer_rows
+
+    def hasMore(self, pos):
+        return pos < len(self)
+
+    def shape(self):
+        cols = len(self.getIndependents() + self.getDependents())
+        return (len(self), cols)
+
+    def getDecimated(self, start, stop, points):
+        """
+        Get a reduced set of rows between start and stop for plotting.
+            Rows are split into points // 2 buckets, and the rows holding the min
+            and max of each dependent variable in each bucket are returned.
+            Data is read and reduced in blocks, so the whole range is never held in memory.
+        Arguments:
+            start   (int): the first row.
+            stop    (int): the row after the last row (the end of the dataset if None).
+            points  (int): the target number of points per dependent variable.
+        Returns:
+                    (np.ndarray): 2-D array of the selected rows.
+        """
+        limit = None if stop is None else max(stop - start, 0)
+        start, stop = self._rowRange(limit, start)
+        num_rows = stop - start
+        bucket_rows = max(-(-num_rows // max(points // 2, 1)), 1)
+        # align blocks with buckets so that every bucket is reduced in one piece
+        block_rows = bucket_rows * max(DECIMATE_BLOCK_ROWS // bucket_rows, 1)
+        dependents = None
+        rows = []
+        for block_start in range(start, stop, block_rows):
+            struct_data, _ = self._getData(min(block_rows, stop - block_start), block_start)
+            values = to_float_rows(struct_data)
+            if dependents is None:
+                dependents = range(len(self.getIndependents()), values.shape[1])
+            indices = decimate_minmax(values, bucket_rows, dependents, endpoints=False)
+            # keep the first and last rows of the range, but not of each block
+            if block_start == start:
+                indices = np.union1d(indices, [0])
+            if block_start + len(values) == stop:
+                indices = np.union1d(indices, [len(values) - 1])
+            rows.append(values[indices])
+        if not rows:
+            return np.zeros((0, len(self.dtype)))
+        return np.concatenate(rows)
+
+
+class ExtendedHDF5Data(AppendableHDF5Data):
     """
     Dataset backed by HDF5 file.
 
@@ -705,10 +1738,20 @@ class ExtendedHDF5Data(HDF5MetaData):
         if 'Version' not in self.file.attrs:
             self.file.attrs['Version'] = np.asarray([3, 0, 0], dtype=np.int32)
         self.version = np.asarray(self.file.attrs['Version'], np.int32)
+        self._init_rows()
 
-    def initialize_info(self, title, indep, dep):
+    def initialize_info(self, title, indep, dep, storage=None):
         """
         Initialize the columns when creating a new dataset.
+        Storage holds the chunking/compression options (see storage_options).
+        """
+        self._create_dataset(self._makeDtype(indep, dep), storage)
+        HDF5MetaData.initialize_info(self, title, indep, dep)
+
+    @staticmethod
+    def _makeDtype(indep, dep):
+        """
+        Get the row datatype for the given columns.
         """
         dtype = []
         for idx, col in enumerate(indep + dep):
@@ -736,9 +1779,7 @@ class ExtendedHDF5Data(HDF5MetaData):
                 dtype.append((varname, shapestr + 'c16'))
             else:
                 raise RuntimeError("Invalid type tag {}".format(ttag))
-
-        self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,))
-        HDF5MetaData.initialize_info(self, title, indep, dep)
+        return dtype
 
     @property
     def file(self):
@@ -752,17 +1793,14 @@ class ExtendedHDF5Data(HDF5MetaData):
         """
         Adds one or more rows or data from a numpy struct array.
         """
-        new_rows = len(data)
-        old_rows = self.dataset.shape[0]
-        self.dataset.resize((old_rows + new_rows,))
-        self.dataset[old_rows:(old_rows + new_rows)] = data
+        self._appendRows(data)
 
     def getData(self, limit, start, transpose, simpleOnly):
         """
         Get up to limit rows from a dataset.
         """
         if simpleOnly:
-            datatype = self.dataset.dtype
+            datatype = self.dtype
             for idx in range(len(datatype)):
                 if datatype[idx] != np.float64:
                     raise errors.DataVersionMismatchError()
@@ -773,7 +1811,43 @@ class ExtendedHDF5Data(HDF5MetaData):
         row_data = [tuple(row) for row in data]
         return row_data, new_pos
 
-    def getDataTranspose(self, limit, start):
+    def _numColumns(self):
+        return len(self.dataset.dtype)
+
+    def _columnNames(self, columns=None):
+        """
+        Get the field names for the given column indices (all columns if None).
+        """
+        num_columns = self._numColumns()
+        if columns is None:
+            return ['f{}'.format(idx) for idx in range(num_columns)]
+        for idx in columns:
+            if not (0 <= idx < num_columns):
+                raise errors.BadColumnError(idx, num_columns)
+        return ['f{}'.format(idx) for idx in columns]
+
+    def _toList(self, col, datatype):
+        """
+        Convert a column of vlen strings to a list of strings.
+        """
+        # Strings are stored as hdf5 vlen objects.  Numpy can't do
+        # variable length strings, so they get encoded as object
+        # arrays by hdf5.  we don't know how to flatten object
+        # arrays so we special case vlen types here and convert
+        # them to lists.
+        base_type = h5py.check_dtype(vlen=datatype)
+        if not base_type or not issubclass(base_type, str):
+            raise RuntimeError(
+                "Found object type array, but not vlen str.  Not supported.  This shouldn't happen")
+        return [x.decode() if isinstance(x, bytes) else base_type(x) for x in col]
+
+    def getDataTranspose(self, limit, start, columns=None):
+        """
+        Get up to limit rows from a dataset as a tuple of columns.
+            Only the fields of the given column indices are read (all columns if None).
+        """
+        if columns is not None:
+            return self._getColumns(limit, start, self._columnNames(columns))
         struct_data, new_pos = self._getData(limit, start)
         columns = []
         for idx in range(len(struct_data.dtype)):
@@ -787,36 +1861,115 @@ class ExtendedHDF5Data(HDF5MetaData):
             # special dtype information, so we pull it directly from
             # self.dataset.dtype rather than the data returned by
             # _getData
-            if self.dataset.dtype[idx] == np.object:
-                base_type = h5py.check_dtype(vlen=self.dataset.dtype[idx])
-                if not base_type or not issubclass(base_type, str):
-                    raise RuntimeError(
-                        "Found object type array, but not vlen str.  Not supported.  This shouldn't happen")
-                col = [base_type(x) for x in col]
+            if self.dataset.dtype[idx] == object:
+                col = self._toList(col, self.dataset.dtype[idx])
             columns.append(col)
         columns = tuple(columns)
         return columns, new_pos
 
+    def _getColumns(self, limit, start, names):
+        """
+        Read only the given fields of the compound dataset.
+        """
+        start, stop = self._rowRange(limit, start)
+        dataset = self.dataset
+        # h5py returns a plain array for a single field, and a compound array for several
+        field_data = dataset[(slice(start, stop),) + tuple(names)]
+        columns = []
+        for name in names:
+            col = field_data if len(names) == 1 else field_data[name]
+            if dataset.dtype[name] == object:
+                col = self._toList(col, dataset.dtype[name])
+            columns.append(col)
+        return tuple(columns), stop
+
     def _getData(self, limit, start):
-        if limit is None:
-            struct_data = self.dataset[start:]
-        else:
-            struct_data = self.dataset[start:start + limit]
+        start, stop = self._rowRange(limit, start)
+        struct_data = self.dataset[start:stop]
         return struct_data, start + struct_data.shape[0]
 
-    def __len__(self):
-        return self.dataset.shape[0]
 
-    def hasMore(self, pos):
-        return pos < len(self)
+class ColumnarHDF5Data(ExtendedHDF5Data):
+    """
+    Extended dataset stored one column per HDF5 dataset.
 
-    def shape(self):
-        cols = len(self.getIndependents() + self.getDependents())
-        rows = self.dataset.shape[0]
-        return (rows, cols)
+    Columns are stored in /DataVault/f0, /DataVault/f1, ..., and the metadata
+    is stored in the attributes of the /DataVault group.  Reading a subset of
+    columns only touches those columns on disk, and transposed reads return the
+    column arrays directly, without going through a compound row array.
+    """
 
+    def __init__(self, fh):
+        self._file = fh
+        if 'Version' not in self.file.attrs:
+            self.file.attrs['Version'] = np.asarray([3, 1, 0], dtype=np.int32)
+        self.version = np.asarray(self.file.attrs['Version'], np.int32)
+        self._init_rows()
+
+    @property
+    def dtype(self):
+        group = self.dataset
+        return np.dtype([(name, group[name].dtype, group[name].shape[1:]) for name in self._columnNames()])
+
+    def _numColumns(self):
+        return len(self.dataset)
+
+    def _create_dataset(self, dtype, storage):
+        """
+        Create the /DataVault group, with one appendable dataset per column.
+        """
+        storage = storage_options(storage)
+        dtype = np.dtype(dtype)
+        group = self.file.create_group('DataVault')
+        for name in dtype.names:
+            base, shape = dtype[name].base, dtype[name].shape
+            group.create_dataset(name, (0,) + shape, dtype=base, **dataset_layout(base, storage, shape))
+        if storage['growth'] == 'double':
+            group.attrs['Rows'] = 0
+            self._rows = 0
+
+    def _capacity(self, group):
+        return group['f0'].shape[0]
+
+    def _chunkRows(self, group):
+        return group['f0'].chunks[0]
+
+    def _resize(self, group, rows):
+        for name in group:
+            group[name].resize(rows, axis=0)
+
+    def _writeSlice(self, group, start, data):
+        for name in data.dtype.names:
+            group[name][start:start + len(data)] = data[name]
+
+    def _getColumns(self, limit, start, names):
+        start, stop = self._rowRange(limit, start)
+        group = self.dataset
+        columns = []
+        for name in names:
+            dataset = group[name]
+            col = dataset[start:stop]
+            if dataset.dtype == object:
+                col = self._toList(col, dataset.dtype)
+            columns.append(col)
+        return tuple(columns), stop
+
+    def getDataTranspose(self, limit, start, columns=None):
+        """
+        Get up to limit rows from a dataset as a tuple of columns.
+            Only the given column indices are read (all columns if None).
+        """
+        return self._getColumns(limit, start, self._columnNames(columns))
+
+    def _getData(self, limit, start):
+        columns, new_pos = self._getColumns(limit, start, self._columnNames())
+        struct_data = np.empty(new_pos - start, dtype=self.dtype)
+        for name, col in zip(struct_data.dtype.names, columns):
+            struct_data[name] = col
+        return struct_data, new_pos
 
-class SimpleHDF5Data(HDF5MetaData):
+
+class SimpleHDF5Data(AppendableHDF5Data):
     """
     Basic dataset backed by HDF5 file.
 
@@ -830,12 +1983,13 @@ class SimpleHDF5Data(HDF5MetaData):
         if 'Version' not in self.file.attrs:
             self.file.attrs['Version'] = np.asarray([2, 0, 0], dtype=np.int32)
         self.version = np.asarray(self.file.attrs['Version'], dtype=np.int32)
+        self._init_rows()
 
-    def initialize_info(self, title, indep, dep):
+    def initialize_info(self, title, indep, dep, storage=None):
         ncol = len(indep) + len(dep)
         dtype = [('f{}'.format(idx), np.float64) for idx in range(ncol)]
         if 'DataVault' not in self.file:
-            self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,))
+            self._create_dataset(dtype, storage)
         HDF5MetaData.initialize_info(self, title, indep, dep)
 
     @property
@@ -850,17 +2004,9 @@ class SimpleHDF5Data(HDF5MetaData):
         """
         Adds one or more rows or data from a 2D array of floats.
         """
-        new_rows = data.shape[0]
-        old_rows = self.dataset.shape[0]
         # if data.shape[1] != len(self.dataset.dtype):
         #    raise errors.BadDataError(len(self.dataset.dtype), data.shape[1])
-
-        self.dataset.resize((old_rows + new_rows,))
-        # new_data = np.zeros((new_rows,), dtype=self.dataset.dtype)
-        # for col in range(data.shape[1]):
-        #    field = "f%d" % (col,)
-        #    new_data[field] = data[:,col]
-        self.dataset[old_rows:(old_rows + new_rows)] = data
+        self._appendRows(data)
 
     def getData(self, limit, start, transpose, simpleOnly):
         """
@@ -868,27 +2014,84 @@ class SimpleHDF5Data(HDF5MetaData):
         """
         if transpose:
             raise RuntimeError("Transpose specified for simple data format: not supported")
-        if limit is None:
-            struct_data = self.dataset[start:]
-        else:
-            struct_data = self.dataset[start:start + limit]
+        struct_data, new_pos = self._getData(limit, start)
         columns = []
         for idx in range(len(struct_data.dtype)):
             columns.append(struct_data['f{}'.format(idx)])
         data = np.column_stack(columns)
-        return data, start + data.shape[0]
+        return data, new_pos
 
-    def __len__(self):
-        return self.dataset.shape[0]
+    def _getData(self, limit, start):
+        start, stop = self._rowRange(limit, start)
+        struct_data = self.dataset[start:stop]
+        return struct_data, start + struct_data.shape[0]
 
-    def hasMore(self, pos):
-        return pos < len(self)
 
-    def shape(self):
-        # todo: maybe better way of doing this? isn't cols just self.dataset.shape[1]?
-        cols = len(self.getIndependents() + self.getDependents())
-        rows = self.dataset.shape[0]
-        return (rows, cols)
+def artiq_descriptor(shape):
+    """
+    Make the variables of an ARTIQ dataset from its shape.
+        ARTIQ datasets don't describe their columns, so the first column is taken to
+        be the independent variable and the others the dependent variables, all with
+        generic names. 1-D datasets have a single column.
+    Arguments:
+        shape       (tuple(int)): the shape of the dataset.
+    Returns:
+                    (ARTIQDescriptor): the independent and dependent variables.
+    """
+    num_columns = shape[1] if len(shape) > 1 else 1
+    independents = [Independent('Independent1.label', 1, 'v', 'arb.')]
+    dependents = [Dependent('Dependent{}.label'.format(idx), 'Dependent{}.legend'.format(idx), 1, 'v', 'arb.')
+                  for idx in range(num_columns - 1)]
+    return ARTIQDescriptor(independents, dependents)
+
+
+# {filename: (mtime, size, {dataset name: ARTIQDescriptor})}, least recently used first
+_artiq_tables = OrderedDict()
+_artiq_tables_lock = threading.Lock()
+
+
+def get_artiq_descriptors(filename, h5file=None):
+    """
+    Get the variables of all datasets in an ARTIQ file.
+        The table is built the first time a file is opened, and kept until the file changes,
+        so the datasets of a file with many datasets don't each have to be inspected again.
+        Only the tables of the MAX_ARTIQ_TABLES most recently used files are kept.
+    Arguments:
+        filename    (str): the path of the file.
+        h5file      (h5py.File): the open file, if it is open (otherwise it is opened read-only).
+    Returns:
+                    (dict): {dataset name: ARTIQDescriptor}.
+    """
+    stat = os.stat(filename)
+    # files are opened on their worker threads
+    with _artiq_tables_lock:
+        cached = _artiq_tables.get(filename)
+        if (cached is not None) and (cached[:2] == (stat.st_mtime, stat.st_size)):
+            _artiq_tables.move_to_end(filename)
+            return cached[2]
+    if h5file is None:
+        with h5py.File(filename, 'r') as h5file:
+            return get_artiq_descriptors(filename, h5file)
+    table = {str(name): artiq_descriptor(dataset.shape) for name, dataset in h5file['datasets'].items()}
+    with _artiq_tables_lock:
+        _artiq_tables[filename] = (stat.st_mtime, stat.st_size, table)
+        _artiq_tables.move_to_end(filename)
+        while len(_artiq_tables) > MAX_ARTIQ_TABLES:
+            _artiq_tables.popitem(last=False)
+    return table
+
+
+def read_artiq_rows(dataset, limit, start):
+    """
+    Read up to limit rows of an ARTIQ dataset as a 2-D array, in a single slice.
+    Returns:
+                    (array, int): the rows, and the position after the last row read.
+    """
+    stop = None if limit is None else start + limit
+    data = dataset[start:stop]
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+    return data, start + data.shape[0]
 
 
 class ARTIQHDF5Data(HDF5MetaData):
@@ -921,6 +2124,9 @@ class ARTIQHDF5Data(HDF5MetaData):
         if 'Comments' not in self.file.attrs:
             self.dataset.attrs['Comments'] = list()
 
+        # variables don't change, so they're only worked out once
+        self._descriptor = get_artiq_descriptors(fh.open_args[0], self.file)[self.dataset_name]
+
     @property
     def file(self):
         return self._file()
@@ -940,27 +2146,12 @@ class ARTIQHDF5Data(HDF5MetaData):
 
     def getIndependents(self):
         """
-        todo: justify
+        ARTIQ datasets don't name their columns; see artiq_descriptor.
         """
-        prefix = 'Independent{}.'.format(1)
-        label = prefix + 'label'
-        shape = 1
-        datatype = 'v'
-        unit = 'arb.'
-        return [Independent(label, shape, datatype, unit)]
+        return list(self._descriptor.independents)
 
     def getDependents(self):
-        rv = []
-        num_dependents = self.dataset.shape[1] - 1
-        for idx in range(num_dependents):
-            prefix = 'Dependent{}.'.format(idx)
-            label = prefix + 'label'
-            legend = prefix + 'legend'
-            shape = 1
-            datatype = 'v'
-            unit = 'arb.'
-            rv.append(Dependent(label, legend, shape, datatype, unit))
-        return rv
+        return list(self._descriptor.dependents)
 
     def getData(self, limit, start, transpose, simpleOnly):
         """
@@ -968,18 +2159,13 @@ class ARTIQHDF5Data(HDF5MetaData):
         """
         if transpose:
             raise RuntimeError("Transpose specified for simple data format: not supported")
-        struct_data = self.dataset[start:] if limit is None else self.dataset[start:start + limit]
-        columns = []
-        for idx in range(len(self.getIndependents() + self.getDependents())):
-            columns.append(struct_data[:, idx])
-        data = np.column_stack(columns)
-        return data, start + data.shape[0]
+        return read_artiq_rows(self.dataset, limit, start)
 
     def hasMore(self, pos):
         return pos < len(self)
 
     def shape(self):
-        cols = len(self.getIndependents() + self.getDependents())
+        cols = len(self._descriptor.independents) + len(self._descriptor.dependents)
         rows = self.dataset.shape[0]
         return (rows, cols)
 
@@ -993,8 +2179,8 @@ class MultipleHDF5Data(HDF5MetaData):
         self._file = fh
         self.dataset_name = dataset_name
 
-        # get specific dataset
-        dataset_group = self.file["datasets"][dataset_name]
+        # the variables come from the descriptor table of the file, which is shared by all its datasets
+        self._descriptor = get_artiq_descriptors(fh.open_args[0], self.file)[dataset_name]
 
         # set versioning (can't assign to file since we're read-only)
         self.version = np.asarray([2, 1, 0], dtype=np.int32)
@@ -1033,27 +2219,12 @@ class MultipleHDF5Data(HDF5MetaData):
 
     def getIndependents(self):
         """
-        todo: justify
+        ARTIQ datasets don't name their columns; see artiq_descriptor.
         """
-        prefix = 'Independent{}.'.format(1)
-        label = prefix + 'label'
-        shape = 1
-        datatype = 'v'
-        unit = 'arb.'
-        return [Independent(label, shape, datatype, unit)]
+        return list(self._descriptor.independents)
 
     def getDependents(self):
-        rv = []
-        num_dependents = self.dataset.shape[1] - 1
-        for idx in range(num_dependents):
-            prefix = 'Dependent{}.'.format(idx)
-            label = prefix + 'label'
-            legend = prefix + 'legend'
-            shape = 1
-            datatype = 'v'
-            unit = 'arb.'
-            rv.append(Dependent(label, legend, shape, datatype, unit))
-        return rv
+        return list(self._descriptor.dependents)
 
     def getData(self, limit, start, transpose, simpleOnly):
         """
@@ -1061,24 +2232,19 @@ class MultipleHDF5Data(HDF5MetaData):
         """
         if transpose:
             raise RuntimeError("Transpose specified for simple data format: not supported")
-        struct_data = self.dataset[start:] if limit is None else self.dataset[start:start + limit]
-        columns = []
-        for idx in range(len(self.getIndependents() + self.getDependents())):
-            columns.append(struct_data[:, idx])
-        data = np.column_stack(columns)
-        return data, start + data.shape[0]
+        return read_artiq_rows(self.dataset, limit, start)
 
     def hasMore(self, pos):
         return pos < len(self)
 
     def shape(self):
-        cols = len(self.getIndependents() + self.getDependents())
+        cols = len(self._descriptor.independents) + len(self._descriptor.dependents)
         rows = self.dataset.shape[0]
         return (rows, cols)
 
 
 # FILE BACKEND CREATION
-def open_hdf5_file(filename, dataset_name=None):
+def open_hdf5_file(filename, dataset_name=None, worker=None):
     """
     Factory for HDF5 files.
 
@@ -1089,11 +2255,11 @@ def open_hdf5_file(filename, dataset_name=None):
     # selection of a specific dataset name means we have multiple datasets in the file
     # and we have to use MultipleHDF5Data
     if dataset_name is not None:
-        fh = SelfClosingFile(h5py.File, open_args=(filename, 'r'))
+        fh = SelfClosingFile(h5py.File, open_args=(filename, 'r'), worker=worker)
         return MultipleHDF5Data(fh, dataset_name)
 
     # instantiate the file
-    fh = SelfClosingFile(h5py.File, open_args=(filename, 'a'))
+    fh = SelfClosingFile(h5py.File, open_args=(filename, 'a'), worker=worker)
 
     # accommodate artiq files
     if 'artiq_version' in fh().keys():
@@ -1104,30 +2270,97 @@ def open_hdf5_file(filename, dataset_name=None):
         version = fh().attrs['Version']
         if (version[0] == 2) and (version[1] == 0):
             return SimpleHDF5Data(fh)
+        elif (version[0] == 3) and (version[1] == 1):
+            return ColumnarHDF5Data(fh)
         elif version[0] == 3:
             return ExtendedHDF5Data(fh)
     except Exception as e:
         print('Error:', e)
 
 
-def create_backend(filename, title, indep, dep, extended):
+def create_backend(filename, title, indep, dep, extended, storage=None, worker=None):
     """
     Create a data object for a new dataset.
+    Storage holds the chunking/compression options for the dataset (see storage_options).
+    If a FileWorker is given, all subsequent access to the file must be made on its thread.
     """
+    storage = storage_options(storage)
     hdf5_file = filename + '.hdf5'
-    fh = SelfClosingFile(h5py.File, open_args=(hdf5_file, 'a'))
-    data = ExtendedHDF5Data(fh) if extended else SimpleHDF5Data(fh)
-    data.initialize_info(title, indep, dep)
+    fh = SelfClosingFile(h5py.File, open_args=(hdf5_file, 'a'), worker=worker)
+    # simple datasets always store rows
+    if extended and (storage['layout'] == 'columnar'):
+        data = ColumnarHDF5Data(fh)
+    elif extended:
+        data = ExtendedHDF5Data(fh)
+    else:
+        data = SimpleHDF5Data(fh)
+    data.initialize_info(title, indep, dep, storage)
     return data
 
 
-def open_backend(filename, dataset_name=None):
+def convert_csv_dataset(csv_file, storage=None, block_bytes=CONVERT_BLOCK_BYTES):
+    """
+    Convert a csv dataset (and its ini metadata) to a simple HDF5 dataset.
+        The title, variables, parameters, comments and timestamps are copied.
+        Data is copied in blocks of at most block_bytes of csv text, so files
+        of any size can be converted. The HDF5 file is written under a temporary
+        name and moved into place when complete; the csv and ini files are left as-is.
+    Arguments:
+        csv_file    (str): the path of the .csv file.
+        storage     (dict): the storage options of the new dataset (see storage_options).
+        block_bytes (int): the max amount of csv text parsed at once.
+    Returns:
+                    (str, int): the path of the new .hdf5 file, and the number of rows copied.
+    """
+    base = csv_file[:-4]
+    hdf5_file = base + '.hdf5'
+    if os.path.exists(hdf5_file):
+        raise errors.DatasetExistsError(hdf5_file)
+
+    # load metadata
+    info = IniData()
+    info.infofile = base + '.ini'
+    info.load()
+
+    tmp_file = hdf5_file + '.tmp'
+    fh = SelfClosingFile(h5py.File, open_args=(tmp_file, 'w'))
+    rows = 0
+    try:
+        data = SimpleHDF5Data(fh)
+        data.initialize_info(info.title, info.independents, info.dependents, storage)
+        reader = CsvRowReader(csv_file, info.cols)
+        while True:
+            block = reader.read(block_bytes)
+            if not len(block):
+                break
+            data.addData(np.ascontiguousarray(block).view(data.dtype)[:, 0])
+            rows += len(block)
+        for param in info.parameters:
+            data.addParam(param['label'], param['data'])
+        # keep the original timestamps
+        attrs = data.dataset.attrs
+        comments = [(t.timestamp(), user, comment) for (t, user, comment) in info.comments]
+        attrs.create('Comments', np.array(comments, dtype=data.comment_type), dtype=data.comment_type)
+        attrs['Creation Time'] = info.created.timestamp()
+        attrs['Access Time'] = info.accessed.timestamp()
+        attrs['Modification Time'] = info.modified.timestamp()
+    except Exception:
+        fh.close()
+        os.remove(tmp_file)
+        raise
+    fh.close()
+    os.replace(tmp_file, hdf5_file)
+    return hdf5_file, rows
+
+
+def open_backend(filename, dataset_name=None, worker=None):
     """
     Make a data object that manages in-memory and on-disk storage for a dataset.
 
     filename should be specified without a file extension. If there is an existing
     file in csv format, we create a backend of the appropriate type. If
     no file exists, we create a new backend to store data in binary form.
+    The FileWorker is only used for HDF5 files; csv files are read in the calling thread.
     """
     csv_file = filename + '.csv'
     hdf5_file = filename + '.hdf5'
@@ -1138,9 +2371,9 @@ def open_backend(filename, dataset_name=None):
         return CsvNumpyData(csv_file)
     # check to see whether the HDF5 file exists
     elif os.path.exists(hdf5_file):
-        return open_hdf5_file(hdf5_file, dataset_name)
+        return open_hdf5_file(hdf5_file, dataset_name, worker)
     elif os.path.exists(h5_file):
-        return open_hdf5_file(h5_file, dataset_name)
+        return open_hdf5_file(h5_file, dataset_name, worker)
     # return an error if the file doesn't exist
     # (though this shouldn't happen since we check several times)
     else:
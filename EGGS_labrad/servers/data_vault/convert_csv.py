@@ -0,0 +1,90 @@
+"""
+One-shot migration of legacy csv+ini datasets to HDF5.
+
+Walks a data vault directory tree and converts every .csv dataset that has an
+.ini metadata file (and no .hdf5 file of the same name) to a simple HDF5 dataset
+with the same name, using backend.convert_csv_dataset. The data vault opens .csv
+files in preference to .hdf5 files, so the original .csv and .ini files are
+renamed with a .bak suffix (or deleted with --delete) once a dataset is converted.
+Stop the data vault before running this.
+Run as a module, e.g. from the servers directory:
+    python -m data_vault.convert_csv [--dry-run] [--delete] [--compression gzip] datadir
+"""
+import os
+import sys
+import argparse
+
+from time import perf_counter
+
+from . import backend
+
+
+def find_csv_datasets(datadir):
+    """
+    Find the csv datasets that can be converted.
+    Arguments:
+        datadir     (str): the root of the data vault directory tree.
+    Returns:
+                    (list(str)): the paths of the .csv files.
+    """
+    datasets = []
+    for dirpath, dirnames, filenames in os.walk(datadir):
+        dirnames.sort()
+        filenames = set(filenames)
+        for filename in sorted(filenames):
+            base, ext = os.path.splitext(filename)
+            if ext != '.csv' or (base + '.ini') not in filenames:
+                continue
+            if (base + '.hdf5') in filenames:
+                print('skipping {}: {}.hdf5 already exists'.format(os.path.join(dirpath, filename), base))
+                continue
+            datasets.append(os.path.join(dirpath, filename))
+    return datasets
+
+
+def convert_all(datadir, delete=False, dry_run=False, storage=None):
+    """
+    Convert all csv datasets in a directory tree to HDF5.
+    Arguments:
+        datadir     (str): the root of the data vault directory tree.
+        delete      (bool): delete the csv and ini files instead of renaming them to .bak.
+        dry_run     (bool): only list the datasets that would be converted.
+        storage     (dict): the storage options of the new datasets (see backend.storage_options).
+    Returns:
+                    (int): the number of datasets that failed to convert.
+    """
+    failed = 0
+    for csv_file in find_csv_datasets(datadir):
+        if dry_run:
+            print('would convert {}'.format(csv_file))
+            continue
+        t_start = perf_counter()
+        try:
+            hdf5_file, rows = backend.convert_csv_dataset(csv_file, storage)
+        except Exception as e:
+            print('failed to convert {}: {}'.format(csv_file, e))
+            failed += 1
+            continue
+        for old_file in (csv_file, csv_file[:-4] + '.ini'):
+            if delete:
+                os.remove(old_file)
+            else:
+                os.replace(old_file, old_file + '.bak')
+        print('converted {} ({:d} rows, {:.2f} s)'.format(csv_file, rows, perf_counter() - t_start))
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert legacy csv+ini datasets to HDF5.')
+    parser.add_argument('datadir', help='root of the data vault directory tree')
+    parser.add_argument('--delete', action='store_true', help='delete the csv and ini files after converting')
+    parser.add_argument('--dry-run', action='store_true', help='only list the datasets that would be converted')
+    parser.add_argument('--compression', default='', help="compression of the new datasets ('', 'gzip' or 'lzf')")
+    args = parser.parse_args(argv)
+    storage = backend.storage_options({'compression': args.compression})
+    failed = convert_all(args.datadir, delete=args.delete, dry_run=args.dry_run, storage=storage)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -74,3 +74,34 @@ class VirtualSessionError(T.Error):
 
     def __init__(self, command):
         self.msg = "Invalid command: {}.".format(command)
+
+
+class BadStorageOptionError(T.Error):
+    code = 13
+
+    def __init__(self, name, value=None):
+        if value is None:
+            self.msg = "Unknown storage option '{0}'.".format(name)
+        else:
+            self.msg = "Invalid value for storage option '{0}': {1}.".format(name, value)
+
+
+class BadColumnError(T.Error):
+    code = 14
+
+    def __init__(self, column, num_columns):
+        self.msg = "Invalid column {0}: dataset has {1} columns.".format(column, num_columns)
+
+
+class DatasetExistsError(T.Error):
+    code = 15
+
+    def __init__(self, name):
+        self.msg = "Dataset '{0}' already exists!".format(name)
+
+
+class BadSearchError(T.Error):
+    code = 16
+
+    def __init__(self, reason):
+        self.msg = "Invalid search: {0}.".format(reason)
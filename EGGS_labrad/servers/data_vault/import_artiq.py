@@ -0,0 +1,139 @@
+"""
+Bulk import of an ARTIQ results tree into the data vault.
+
+Copies every .h5 file of an ARTIQ results tree (e.g. results/<date>/<hour>/<rid>-<experiment>.h5)
+into a data vault directory, keeping the directory structure, so the files can be browsed as
+data vault sessions (files with multiple datasets show up as virtual sessions).
+Files are checked, copied, and probed by a pool of processes; the kind and row count of each
+file are then written to the session index of its directory, so the data vault doesn't have to
+open thousands of files the first time the directories are listed.
+Files that already exist in the data vault are skipped, so an import can be run again to pick up new results.
+Run as a module, e.g. from the servers directory:
+    python -m data_vault.import_artiq [--processes N] [--dry-run] results_dir datadir [dest ...]
+"""
+import os
+import sys
+import h5py
+import shutil
+import argparse
+
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import SessionIndex, filename_encode, probe_datafile
+
+
+def find_artiq_files(results_dir, datadir, dest=()):
+    """
+    Find the ARTIQ files to import, and where to copy them to.
+    Arguments:
+        results_dir (str): the root of the ARTIQ results tree.
+        datadir     (str): the root of the data vault directory tree.
+        dest        (list(str)): the (unencoded) data vault directory to import into, relative to datadir.
+    Returns:
+                    (list(str, str)): the source and destination paths of each file.
+    """
+    files = []
+    for dirpath, dirnames, filenames in os.walk(results_dir):
+        dirnames.sort()
+        subdirs = os.path.relpath(dirpath, results_dir).split(os.sep)
+        subdirs = [filename_encode(name) for name in list(dest) + subdirs if name != '.']
+        for filename in sorted(filenames):
+            base, ext = os.path.splitext(filename)
+            if ext != '.h5':
+                continue
+            src = os.path.join(dirpath, filename)
+            dst = os.path.join(datadir, *subdirs, filename_encode(base) + ext)
+            if os.path.exists(dst):
+                print('skipping {}: {} already exists'.format(src, dst))
+                continue
+            files.append((src, dst))
+    return files
+
+
+def import_file(src, dst):
+    """
+    Copy an ARTIQ file into the data vault, and probe it.
+        Runs in a worker process.
+    Arguments:
+        src     (str): the path of the ARTIQ file.
+        dst     (str): the path to copy it to.
+    Returns:
+                (str, int): the kind of dataset and its number of rows (see probe_datafile),
+                                or None if the copied file couldn't be probed.
+    """
+    with h5py.File(src, 'r') as file_tmp:
+        if not len(file_tmp.get('datasets', ())):
+            raise ValueError('no datasets in file')
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    # copy to a temporary file first so an interrupted import can't leave a partial file
+    tmp_path = dst + '.tmp'
+    shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+    # files that can't be probed are left out of the index, so they're probed when they're listed
+    try:
+        return probe_datafile(dst)
+    except Exception:
+        return None
+
+
+def import_all(results_dir, datadir, dest=(), processes=None, dry_run=False):
+    """
+    Import all the ARTIQ files in a results tree into the data vault.
+    Arguments:
+        results_dir (str): the root of the ARTIQ results tree.
+        datadir     (str): the root of the data vault directory tree.
+        dest        (list(str)): the (unencoded) data vault directory to import into, relative to datadir.
+        processes   (int): the number of worker processes (defaults to the number of CPUs).
+        dry_run     (bool): only list the files that would be imported.
+    Returns:
+                    (int): the number of files that failed to import.
+    """
+    files = find_artiq_files(results_dir, datadir, dest)
+    if dry_run:
+        for src, dst in files:
+            print('would import {} to {}'.format(src, dst))
+        return 0
+
+    t_start = perf_counter()
+    failed = 0
+    indexes = {}
+    with ProcessPoolExecutor(processes) as pool:
+        futures = {pool.submit(import_file, src, dst): (src, dst) for src, dst in files}
+        for future in as_completed(futures):
+            src, dst = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print('failed to import {}: {}'.format(src, e))
+                failed += 1
+                continue
+            if result is None:
+                continue
+            kind, rows = result
+            # session indexes are only written from this process
+            directory = os.path.dirname(dst)
+            if directory not in indexes:
+                indexes[directory] = SessionIndex(directory)
+            indexes[directory].set(os.path.basename(dst), kind, rows, os.stat(dst))
+    for index in indexes.values():
+        index.save()
+    print('imported {:d} files into {:d} directories ({:d} failed, {:.2f} s)'.format(
+        len(files) - failed, len(indexes), failed, perf_counter() - t_start))
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import an ARTIQ results tree into the data vault.')
+    parser.add_argument('results_dir', help='root of the ARTIQ results tree')
+    parser.add_argument('datadir', help='root of the data vault directory tree')
+    parser.add_argument('dest', nargs='*', help='data vault directory to import into, relative to datadir')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--dry-run', action='store_true', help='only list the files that would be imported')
+    args = parser.parse_args(argv)
+    failed = import_all(args.results_dir, args.datadir, args.dest, processes=args.processes, dry_run=args.dry_run)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,385 @@
+"""
+Search index of the datasets in a data vault directory tree.
+
+Each data directory (e.g. .labrad) gets a SQLite database, search_index.db, holding
+the path, title, creation/modification time, row count, variable labels, scalar
+parameters and tags of every dataset in the tree, so datasets can be found
+without opening every directory and dataset.
+The index is built in the background when the server starts, only reading files
+that are new or have changed since they were last indexed, and is updated as
+datasets are created, parameters are added and tags are changed.
+"""
+import os
+import h5py
+import sqlite3
+import numpy as np
+
+from datetime import datetime
+from twisted.internet import reactor
+
+from . import backend, errors, util, filename_decode
+
+
+SEARCH_OPS = ('=', '!=', '<', '<=', '>', '>=')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    title TEXT,
+    created REAL,
+    modified REAL,
+    rows INTEGER,
+    variables TEXT,
+    mtime REAL,
+    size INTEGER,
+    UNIQUE (dir, name)
+);
+CREATE TABLE IF NOT EXISTS params (
+    dataset INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value,
+    unit TEXT
+);
+CREATE INDEX IF NOT EXISTS params_dataset ON params (dataset);
+CREATE INDEX IF NOT EXISTS params_name ON params (name, value);
+CREATE TABLE IF NOT EXISTS dataset_tags (
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dataset_tags_tag ON dataset_tags (tag);
+CREATE TABLE IF NOT EXISTS dir_tags (
+    parent TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dir_tags_tag ON dir_tags (tag);
+"""
+
+
+def scalar_param(value):
+    """
+    Get the value stored in the index for a parameter.
+    Arguments:
+        value:      the decoded parameter value.
+    Returns:
+                    (float or str, str): the value and its unit, or None if the parameter
+                                            isn't a real number or a string.
+    """
+    if isinstance(value, (bool, int, float, np.integer, np.floating)):
+        return float(value), ''
+    if isinstance(value, str):
+        return value, ''
+    unit = getattr(value, 'unit', None)
+    if unit is None:
+        return None
+    try:
+        return float(value[unit]), str(unit)
+    except Exception:
+        return None
+
+
+def read_dataset_info(filename):
+    """
+    Read the indexed metadata of a dataset file.
+    Arguments:
+        filename    (str): the path of the .hdf5, .h5, or .csv file.
+    Returns:
+                    (dict): the title, created and modified times, row count, variable labels
+                                and parameters [(name, value)] of the dataset, or None if
+                                the file isn't a single data vault dataset.
+    """
+    if filename.endswith('.csv'):
+        info = backend.IniData()
+        info.infofile = filename[:-4] + '.ini'
+        info.load()
+        with open(filename, 'rb') as f:
+            rows = sum(1 for _ in f)
+        return {
+            'title': info.title,
+            'created': info.created.timestamp(),
+            'modified': info.modified.timestamp(),
+            'rows': rows,
+            'variables': [i.label for i in info.independents] + [d.label for d in info.dependents],
+            'params': [(param['label'], param['data']) for param in info.parameters],
+        }
+
+    with h5py.File(filename, 'r') as file_tmp:
+        if 'DataVault' not in file_tmp:
+            return None
+        dataset = file_tmp['DataVault']
+        attrs = dataset.attrs
+        if 'Rows' in attrs:
+            rows = int(attrs['Rows'])
+        else:
+            rows = (dataset['f0'] if isinstance(dataset, h5py.Group) else dataset).shape[0]
+        variables = []
+        for prefix in ('Independent', 'Dependent'):
+            idx = 0
+            while '{}{}.label'.format(prefix, idx) in attrs:
+                variables.append(str(attrs['{}{}.label'.format(prefix, idx)]))
+                idx += 1
+        params = [(str(key[6:]), backend.labrad_urldecode(attrs[key])) for key in attrs if key.startswith('Param.')]
+        return {
+            'title': str(attrs['Title']),
+            'created': float(attrs['Creation Time']),
+            'modified': float(attrs['Modification Time']),
+            'rows': rows,
+            'variables': variables,
+            'params': params,
+        }
+
+
+def read_session_tags(directory):
+    """
+    Read the directory and dataset tags from a directory's session.ini file.
+    Returns:
+                    (dict, dict): the tags of subdirectories and of datasets, as {name: tags}.
+    """
+    S = util.DVSafeConfigParser()
+    S.read(os.path.join(directory, 'session.ini'))
+    if not S.has_section('Tags'):
+        return {}, {}
+    return eval(S.get('Tags', 'sessions', raw=True)), eval(S.get('Tags', 'datasets', raw=True))
+
+
+class SearchIndex(object):
+    """
+    SQLite index of the datasets in one data directory.
+
+    All database access happens on the index's own worker thread, in the order it
+    was submitted, so indexing never blocks the reactor. Updates return Deferreds
+    that fire once they have been written; search returns a Deferred that fires
+    with the matching datasets.
+    Directories are identified by their path below the data directory joined with
+    '/' (e.g. 'labrad/2024/05'), and datasets by their directory and name.
+    """
+
+    FILENAME = 'search_index.db'
+    VERSION = 1
+
+    def __init__(self, datadir, reactor=reactor):
+        self.datadir = datadir
+        self.root = os.path.basename(datadir)
+        self.path = os.path.join(datadir, self.FILENAME)
+        self.worker = backend.FileWorker('search index: {}'.format(self.root), reactor)
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            version = self._db.execute('PRAGMA user_version').fetchone()[0]
+            if version != self.VERSION:
+                # start over if the index was made by a different version
+                self._db.executescript('DROP TABLE IF EXISTS datasets; DROP TABLE IF EXISTS params; '
+                                       'DROP TABLE IF EXISTS dataset_tags; DROP TABLE IF EXISTS dir_tags;')
+                self._db.execute('PRAGMA user_version = {:d}'.format(self.VERSION))
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    def _run(self, func, *args):
+        """
+        Run func(db, *args) on the worker thread, in a transaction.
+        """
+        def call():
+            db = self._connect()
+            with db:
+                return func(db, *args)
+        return self.worker.submit(call)
+
+    def dirKey(self, path):
+        """
+        Get the directory key of a session path (e.g. ['', 'labrad', '2024']).
+        """
+        return '/'.join(path[1:])
+
+    def close(self):
+        """
+        Close the database once all submitted updates have been written.
+        """
+        def close():
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        self.worker.submit(close)
+        self.worker.stop()
+
+
+    # UPDATES
+    def build(self):
+        """
+        Bring the index up to date with the files on disk.
+            Only files that are new or have changed since they were indexed are read.
+        Returns:
+            Deferred: fires with the number of datasets (re)indexed.
+        """
+        return self._run(self._build)
+
+    def _build(self, db):
+        indexed = {(dir_key, name): (mtime, size) for dir_key, name, mtime, size in
+                   db.execute('SELECT dir, name, mtime, size FROM datasets')}
+        found = set()
+        count = 0
+        parent = os.path.dirname(self.datadir)
+        for dirpath, dirnames, filenames in os.walk(self.datadir):
+            dirnames.sort()
+            rel = os.path.relpath(dirpath, parent).replace(os.sep, '/')
+            dir_key = '/'.join(filename_decode(part) for part in rel.split('/'))
+            if 'session.ini' in filenames:
+                self._setTags(db, dir_key, *read_session_tags(dirpath))
+            for filename in sorted(filenames):
+                base, ext = os.path.splitext(filename)
+                if ext not in ('.hdf5', '.h5', '.csv'):
+                    continue
+                name = filename_decode(base)
+                found.add((dir_key, name))
+                stat = os.stat(os.path.join(dirpath, filename))
+                if indexed.get((dir_key, name)) == (stat.st_mtime, stat.st_size):
+                    continue
+                try:
+                    info = read_dataset_info(os.path.join(dirpath, filename))
+                except Exception as e:
+                    print('Error indexing {}: {}'.format(os.path.join(dirpath, filename), e))
+                    continue
+                if info is None:
+                    continue
+                self._addDataset(db, dir_key, name, info, stat.st_mtime, stat.st_size)
+                count += 1
+        # drop datasets that have been deleted
+        for dir_key, name in set(indexed) - found:
+            self._removeDataset(db, dir_key, name)
+        return count
+
+    def addDataset(self, path, name, title, variables):
+        """
+        Add a newly created dataset to the index.
+        """
+        now = datetime.now().timestamp()
+        info = {'title': title, 'created': now, 'modified': now, 'rows': 0, 'variables': variables, 'params': []}
+        # the file is read again on the next build, since it has changed since it was indexed
+        return self._run(self._addDataset, self.dirKey(path), name, info, None, None)
+
+    def _addDataset(self, db, dir_key, name, info, mtime, size):
+        self._removeDataset(db, dir_key, name)
+        cursor = db.execute('INSERT INTO datasets (dir, name, title, created, modified, rows, variables, mtime, size) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (dir_key, name, info['title'], info['created'], info['modified'], info['rows'],
+                             '\n'.join(info['variables']), mtime, size))
+        self._addParameters(db, cursor.lastrowid, info['params'])
+
+    def _removeDataset(self, db, dir_key, name):
+        row = db.execute('SELECT id FROM datasets WHERE dir = ? AND name = ?', (dir_key, name)).fetchone()
+        if row is not None:
+            db.execute('DELETE FROM params WHERE dataset = ?', row)
+            db.execute('DELETE FROM datasets WHERE id = ?', row)
+
+    def addParameters(self, path, name, params):
+        """
+        Add parameters [(name, value)] of a dataset to the index.
+            Parameters that aren't real numbers or strings aren't indexed.
+        """
+        return self._run(self._addDatasetParameters, self.dirKey(path), name, params)
+
+    def _addDatasetParameters(self, db, dir_key, name, params):
+        row = db.execute('SELECT id FROM datasets WHERE dir = ? AND name = ?', (dir_key, name)).fetchone()
+        if row is not None:
+            self._addParameters(db, row[0], params)
+
+    def _addParameters(self, db, dataset_id, params):
+        values = []
+        for param_name, value in params:
+            scalar = scalar_param(value)
+            if scalar is not None:
+                values.append((dataset_id, param_name) + scalar)
+        db.executemany('INSERT INTO params (dataset, name, value, unit) VALUES (?, ?, ?, ?)', values)
+
+    def setTags(self, path, session_tags, dataset_tags):
+        """
+        Replace the tags of the subdirectories and datasets of a directory.
+        Arguments:
+            path            (list(str)): the session path of the directory.
+            session_tags    (dict): the tags of subdirectories, as {name: tags}.
+            dataset_tags    (dict): the tags of datasets, as {name: tags}.
+        """
+        # copy the tags, since they can change before the update is run
+        session_tags = {key: list(val) for key, val in session_tags.items()}
+        dataset_tags = {key: list(val) for key, val in dataset_tags.items()}
+        return self._run(self._setTags, self.dirKey(path), session_tags, dataset_tags)
+
+    def _setTags(self, db, dir_key, session_tags, dataset_tags):
+        db.execute('DELETE FROM dir_tags WHERE parent = ?', (dir_key,))
+        db.execute('DELETE FROM dataset_tags WHERE dir = ?', (dir_key,))
+        db.executemany('INSERT INTO dir_tags (parent, dir, tag) VALUES (?, ?, ?)',
+                       [(dir_key, dir_key + '/' + name, tag)
+                        for name, tags in session_tags.items() if isinstance(name, str) for tag in tags])
+        db.executemany('INSERT INTO dataset_tags (dir, name, tag) VALUES (?, ?, ?)',
+                       [(dir_key, name, tag)
+                        for name, tags in dataset_tags.items() if isinstance(name, str) for tag in tags])
+
+
+    # SEARCH
+    def search(self, title='', tags=(), params=(), start=None, stop=None, variable=''):
+        """
+        Find datasets matching all of the given conditions.
+        Arguments:
+            title       (str): a substring of the title (case insensitive).
+            tags        (list(str)): tags the dataset, or a directory containing it, must have.
+                                        Tags starting with '-' must not be present.
+            params      (list(str, str, str)): (name, op, value) conditions on parameters, where op is
+                                        one of SEARCH_OPS. Values that can be converted to numbers
+                                        are compared as numbers, otherwise as strings.
+            start       (datetime): the earliest creation time.
+            stop        (datetime): the latest creation time.
+            variable    (str): a substring of a variable label (case insensitive).
+        Returns:
+            Deferred: fires with the matching datasets, as [(path, name)], sorted by path and name.
+        """
+        where = []
+        args = []
+        if title:
+            where.append("d.title LIKE ? ESCAPE '\\'")
+            args.append('%' + _escape(title) + '%')
+        if variable:
+            where.append("d.variables LIKE ? ESCAPE '\\'")
+            args.append('%' + _escape(variable) + '%')
+        if start is not None:
+            where.append('d.created >= ?')
+            args.append(start.timestamp())
+        if stop is not None:
+            where.append('d.created <= ?')
+            args.append(stop.timestamp())
+        for tag in tags:
+            condition = ('(EXISTS (SELECT 1 FROM dataset_tags t WHERE t.dir = d.dir AND t.name = d.name AND t.tag = ?)'
+                         " OR EXISTS (SELECT 1 FROM dir_tags t WHERE t.tag = ? AND"
+                         " (d.dir = t.dir OR substr(d.dir, 1, length(t.dir) + 1) = t.dir || '/')))")
+            if tag[:1] == '-':
+                tag = tag[1:]
+                condition = 'NOT ' + condition
+            where.append(condition)
+            args.extend([tag, tag])
+        for name, op, value in params:
+            if op not in SEARCH_OPS:
+                raise errors.BadSearchError("unknown operator '{}' for parameter '{}'".format(op, name))
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+            where.append('EXISTS (SELECT 1 FROM params p WHERE p.dataset = d.id AND p.name = ? AND p.value {} ?)'.format(op))
+            args.extend([name, value])
+        query = 'SELECT d.dir, d.name FROM datasets d'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY d.dir, d.name'
+
+        def search(db):
+            return [([''] + dir_key.split('/'), name) for dir_key, name in db.execute(query, args)]
+        return self._run(search)
+
+
+def _escape(text):
+    """
+    Escape the wildcards of a LIKE pattern.
+    """
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
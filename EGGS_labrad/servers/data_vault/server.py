@@ -1,12 +1,13 @@
 from __future__ import absolute_import
 
 from twisted.internet.task import LoopingCall
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.threads import deferToThread
+from twisted.internet.defer import inlineCallbacks, returnValue, gatherResults
 from labrad.server import LabradServer, Signal, setting
 
 import win32api
 import numpy as np
-from . import errors
+from . import backend, errors, PUSH_BATCH_ROWS
 from os import remove
 # todo: implement ability to delete things
 # todo: fix documentation
@@ -34,6 +35,8 @@ class DataVault(LabradServer):
         self.onDataAvailable = Signal(543619, 'signal: data available', '')
         self.onNewParameter = Signal(543620, 'signal: new parameter', '')
         self.onCommentsAvailable = Signal(543621, 'signal: comments available', '')
+        self.onDataRows = Signal(543623, 'signal: data rows', 'w')
+        self.onRowsPushed = Signal(543624, 'signal: rows pushed', '(ww?)')
 
     def initServer(self):
         # create root session
@@ -50,22 +53,19 @@ class DataVault(LabradServer):
         Save all datasets routinely.
         Prevents data from being corrupted due to unforeseen/uninterruptible events.
         """
-        # get all datasets across all sessions
-        all_sessions = list(self.session_store.get_all())
-        all_datasets = [session.datasets.values() for session in all_sessions]
-        # flatten list of datasets
-        all_containers = set([dataset.data for session_datasets in all_datasets for dataset in session_datasets])
+        # start new write-ahead log segments, so the older segments only hold changes that are saved below
+        rotations = {wal: wal.rotate() for wal in self.session_store.wal.values()}
 
-        # flush (i.e. save) all file data
-        for container in all_containers:
-            try:
-                # container is Data object (e.g. SimpleHDF5Data)
-                # container._file is SelfClosingFile
-                # container._file._file is actual data file object
-                if hasattr(container._file, '_file'):
-                    container._file._file.flush()
-            except Exception as e:
-                print(e)
+        # save and sync all files on their worker threads: the open files, and the files opened or
+        # closed since the last save (including those of datasets that are no longer referenced)
+        saves = backend.get_file_pool().sync()
+
+        # remove the old segments once everything has been synced
+        for wal, rotation in rotations.items():
+            d = gatherResults([rotation, saves])
+            d.addCallback(lambda results, wal=wal: wal.remove(results[0]))
+            d.addErrback(lambda failure, wal=wal: print('keeping write-ahead log segments of', wal.dir))
+        saves.addErrback(print)
 
     def _closeAllDatasets(self, signal):
         """
@@ -81,14 +81,30 @@ class DataVault(LabradServer):
         # close all the files
         for container in all_containers:
             datafile = container._file
-            # cancel the timeout poll loop if it exists
-            if hasattr(datafile, '_fileTimeoutCall'):
-                datafile._fileTimeoutCall.cancel()
-            # close the file
+            # wait for pending file i/o to finish; we may not be in the reactor thread
+            if getattr(datafile, 'worker', None) is not None:
+                datafile.worker.drain()
+            # write any buffered rows
             try:
-                datafile._fileTimeout()
+                if hasattr(container, 'flush'):
+                    container.flush()
             except Exception as e:
                 print(e)
+            # close the file and cancel the timeout poll loop
+            try:
+                datafile.close()
+            except Exception as e:
+                print(e)
+
+        # write pending search index updates
+        for search_index in self.session_store.search.values():
+            search_index.close()
+            search_index.worker.drain()
+
+        # write pending log records; the logs are replayed on the next start,
+        # since the files closed above aren't synced to disk
+        for wal in self.session_store.wal.values():
+            wal.close()
 
 
     # CONTEXT MANAGEMENT
@@ -109,18 +125,8 @@ class DataVault(LabradServer):
         """
         Stop sending any signals to this context.
         """
-        key = self.contextKey(c)
-
-        def removeFromList(ls):
-            if key in ls:
-                ls.remove(key)
-
-        for session in self.session_store.get_all():
-            removeFromList(session.listeners)
-            for dataset in session.datasets.values():
-                removeFromList(dataset.listeners)
-                removeFromList(dataset.param_listeners)
-                removeFromList(dataset.comment_listeners)
+        # only touches the listener sets the context was added to
+        self.session_store.listener_index.expire(self.contextKey(c))
 
 
     # GETTING CONTEXT OBJECTS
@@ -138,6 +144,15 @@ class DataVault(LabradServer):
             raise errors.NoDatasetError()
         return c['datasetObj']
 
+    def _streamRows(self, c, dataset):
+        """
+        Send row counts of a newly opened dataset (instead of the previous one) to a context.
+        """
+        key = self.contextKey(c)
+        if ('datasetObj' in c) and (c['datasetObj'] is not dataset):
+            c['datasetObj'].stopStreamingRows(key)
+        return dataset.run(dataset.streamRows, key)
+
 
     # GENERAL
     @setting(5, returns=['*s'])
@@ -158,13 +173,14 @@ class DataVault(LabradServer):
         tagFilters = [tagFilters] if isinstance(tagFilters, str) else tagFilters
 
         # get contents of session
+        # listing may open hdf5 files to check for multiple datasets, so do it in a thread
         sess = self.getSession(c)
-        dirs, datasets = sess.listContents(tagFilters)
+        dirs, datasets = yield deferToThread(sess.listContents, tagFilters)
 
         # parse tags
         if includeTags:
             dirs, datasets = sess.getTags(dirs, datasets)
-        return dirs, datasets
+        returnValue((dirs, datasets))
 
     @setting(7, path=['{get current directory}',
                       's{change into this directory}',
@@ -250,8 +266,9 @@ class DataVault(LabradServer):
     @setting(9, name='s',
              independents=['*s', '*(ss)'],
              dependents=['*s', '*(sss)'],
+             storage='*(ss)',
              returns='(*s{path}, s{name})')
-    def new(self, c, name, independents, dependents):
+    def new(self, c, name, independents, dependents, storage=None):
         """
         Create a new Dataset.
 
@@ -262,6 +279,9 @@ class DataVault(LabradServer):
         or 'label (legend) [units]'.  Label is meant to be an
         axis label that can be shared among traces, while legend is
         a legend entry that should be unique for each trace.
+        Storage is an optional list of (option, value) pairs that
+        override the server's default storage options for this
+        dataset (see 'storage defaults').
         Returns the path and name for this dataset.
         """
         # ensure valid filename
@@ -269,19 +289,21 @@ class DataVault(LabradServer):
             raise Exception("Error: invalid title (contains periods).")
 
         session = self.getSession(c)
-        dataset = session.newDataset(name or 'untitled', independents, dependents)
+        dataset = session.newDataset(name or 'untitled', independents, dependents, storage=storage)
+        yield self._streamRows(c, dataset)
         c['dataset'] = dataset.name  # not the same as name; has number prefixed
         c['datasetObj'] = dataset
         c['filepos'] = 0  # start at the beginning
         c['commentpos'] = 0
         c['writing'] = True
-        return c['path'], c['dataset']
+        returnValue((c['path'], c['dataset']))
 
     @setting(1009, name='s',
              independents='*(s*iss)',
              dependents='*(ss*iss)',
+             storage='*(ss)',
              returns=['*ss'])
-    def new_ex(self, c, name, independents, dependents):
+    def new_ex(self, c, name, independents, dependents, storage=None):
         """
         Create a new extended dataset.
 
@@ -308,19 +330,22 @@ class DataVault(LabradServer):
         code.  The name and parameters will be there, but no actual data.
 
         The legacy format requires each column be a scalar v[unit] type.
+
+        Storage is an optional list of (option, value) pairs; see new().
         """
         # ensure valid filename
         if "." in name:
             raise Exception("Error: invalid title (contains periods).")
 
         session = self.getSession(c)
-        dataset = session.newDataset(name, independents, dependents, extended=True)
+        dataset = session.newDataset(name, independents, dependents, extended=True, storage=storage)
+        yield self._streamRows(c, dataset)
         c['dataset'] = dataset.name  # not the same as name; has number prefixed
         c['datasetObj'] = dataset
         c['filepos'] = 0  # start at the beginning
         c['commentpos'] = 0
         c['writing'] = True
-        return c['path'], c['dataset']
+        returnValue((c['path'], c['dataset']))
 
     @setting(10, name=['s', 'w'], append='b', returns='(*s{path}, s{name})')
     def open(self, c, name, append=False):
@@ -332,15 +357,111 @@ class DataVault(LabradServer):
         """
         session = self.getSession(c)
         dataset = session.openDataset(name)
+        yield self._streamRows(c, dataset)
         c['dataset'] = dataset.name  # not the same as name; has number prefixed
         c['datasetObj'] = dataset
         c['filepos'] = 0
         c['commentpos'] = 0
         c['writing'] = append
         key = self.contextKey(c)
-        dataset.keepStreaming(key, 0)
-        dataset.keepStreamingComments(key, 0)
-        return c['path'], c['dataset']
+        yield dataset.run(dataset.keepStreaming, key, 0)
+        yield dataset.run(dataset.keepStreamingComments, key, 0)
+        returnValue((c['path'], c['dataset']))
+
+    @setting(1011, 'storage defaults', storage='*(ss)', returns='*(ss)')
+    def storage_defaults(self, c, storage=None):
+        """
+        Get or set the default storage options used when creating new datasets.
+
+        Options are given as (option, value) pairs:
+            chunk_rows:         rows per hdf5 chunk (0 = size chunks automatically).
+            compression:        '' (none), 'gzip', or 'lzf'.
+            compression_level:  gzip compression level (0-9).
+            shuffle:            whether to apply the byte-shuffle filter before compression.
+            expected_rows:      expected number of rows (used to size chunks; 0 = unknown).
+            growth:             '' (resize on every add) or 'double' (grow capacity geometrically).
+            layout:             '' (rows) or 'columnar' (one hdf5 dataset per column; ignored by new).
+        Options that aren't specified keep their current value.
+        Returns the current storage defaults.
+        """
+        if storage is not None:
+            self.session_store.storage = backend.storage_options(storage, self.session_store.storage)
+        return [(key, str(val)) for key, val in sorted(self.session_store.storage.items())]
+
+    @setting(1012, 'write buffer', write_buffer='*(sv)', returns='*(sv)')
+    def write_buffer(self, c, write_buffer=None):
+        """
+        Get or set write-behind buffering of added rows.
+
+        Rows added to a dataset are held in memory and written to the file
+        in a single write when the buffer is full, when the interval has
+        elapsed, when the dataset is read, or when the file is closed.
+        Buffered rows are visible to readers immediately.
+        Options are given as (option, value) pairs:
+            max_rows:   max number of buffered rows per dataset (0 = no buffering).
+            max_bytes:  max size of buffered rows per dataset, in bytes.
+            interval:   max time rows stay buffered, in seconds.
+        Options that aren't specified keep their current value.
+        Changes apply to all open datasets.
+        Returns the current buffer options.
+        """
+        if write_buffer is not None:
+            for key, val in write_buffer:
+                if key not in backend.WRITE_BUFFER:
+                    raise Exception("Error: unknown write buffer option: {}.".format(key))
+                self.session_store.write_buffer[key] = val
+            # apply to open datasets
+            for session in list(self.session_store.get_all()):
+                for dataset in list(session.datasets.values()):
+                    if hasattr(dataset.data, 'setWriteBuffer'):
+                        yield dataset.run(dataset.data.setWriteBuffer, **self.session_store.write_buffer)
+        return sorted(self.session_store.write_buffer.items())
+
+    @setting(1013, 'file pool', max_open='w', returns='*(sv)')
+    def file_pool(self, c, max_open=None):
+        """
+        Get statistics of the pool of open data files, and optionally set the
+        max number of files kept open at once.
+
+        Files are closed once they haven't been accessed for FILE_TIMEOUT_SEC.
+        If more than max_open files are open, the least recently used files
+        are closed early (evicted), and reopened when next accessed.
+        Returns (name, value) pairs of:
+            open:       number of files currently open.
+            max_open:   max number of files kept open at once.
+            opens:      number of times files have been opened.
+            closes:     number of times files have been closed.
+            hits:       number of accesses to files that were already open.
+            evictions:  number of files closed early to stay under max_open.
+        """
+        pool = backend.get_file_pool()
+        if max_open is not None:
+            pool.setMaxOpen(max_open)
+        return sorted(pool.stats().items())
+
+    @setting(1014, 'notify interval', interval='v', returns='v')
+    def notify_interval(self, c, interval=None):
+        """
+        Get or set the min time between 'signal: data rows' messages for each dataset, in seconds.
+
+        Clients connected to 'signal: data rows' are sent the row count of
+        their current dataset when it is opened, and when data is added to it.
+        Adds made less than interval seconds after the last message are
+        coalesced into a single message with the latest row count, so clients
+        can read the new rows in bulk. 0 sends a message for every add.
+        Clients connected to 'signal: data available' still get one message
+        for each call to get, regardless of the interval.
+        Changes apply to all open datasets.
+        Returns the current interval.
+        """
+        if interval is not None:
+            if interval < 0:
+                raise Exception("Error: notify interval must not be negative.")
+            self.session_store.notify_interval = interval
+            for session in list(self.session_store.get_all()):
+                for dataset in list(session.datasets.values()):
+                    dataset.notify_interval = interval
+        return self.session_store.notify_interval
 
     @setting(11, name=['s', 'w'], returns='b')
     def delete(self, c, name):
@@ -359,22 +480,8 @@ class DataVault(LabradServer):
         dataset = session.openDataset(name)
 
         # todo tmp remove
-        # get all datasets across all sessions
-        all_sessions = list(self.session_store.get_all())
-        all_datasets = [session.datasets.values() for session in all_sessions]
-        # flatten list of datasets
-        all_containers = set([dataset.data for session_datasets in all_datasets for dataset in session_datasets])
-
         # flush (i.e. save) all file data
-        for container in all_containers:
-            try:
-                # container is Data object (e.g. SimpleHDF5Data)
-                # container._file is SelfClosingFile
-                # container._file._file is actual data file object
-                if hasattr(container._file, '_file'):
-                    container._file._file.flush()
-            except Exception as e:
-                print(e)
+        self._saveAllDatasets()
         return False
 
 
@@ -390,7 +497,8 @@ class DataVault(LabradServer):
             (str)   :   dataset version.
         """
         dataset = self.getDataset(c)
-        return dataset.version()
+        version = yield dataset.run(dataset.version)
+        returnValue(version)
 
     @setting(20, data=['*v: add one row of data',
                        '*2v: add multiple rows of data'],
@@ -409,8 +517,7 @@ class DataVault(LabradServer):
         data = np.atleast_2d(np.asarray(data))
         # fromarrays is faster than fromrecords, and when we have a simple 2-D array
         # we can just transpose the array.
-        rec_data = np.core.records.fromarrays(data.T, dtype=dataset.data.dtype)
-        dataset.addData(rec_data)
+        yield dataset.runLogged(dataset.addArrays, data.T)
 
     @setting(1020, data='?', returns='')
     def add_ex(self, c, data):
@@ -428,7 +535,7 @@ class DataVault(LabradServer):
         if not c['writing']:
             raise errors.ReadOnlyError()
         list_data = [tuple(row) for row in data]
-        dataset.addData(np.core.records.fromrecords(list_data, dtype=dataset.data.dtype))
+        yield dataset.runLogged(dataset.addRecords, list_data)
 
     @setting(2020, data='?', returns='')
     def add_ex_t(self, c, data):
@@ -442,7 +549,7 @@ class DataVault(LabradServer):
         dataset = self.getDataset(c)
         if not c['writing']:
             raise errors.ReadOnlyError()
-        dataset.addData(np.core.records.fromarrays(data, dtype=dataset.data.dtype))
+        yield dataset.runLogged(dataset.addArrays, data)
 
     @setting(21, limit='w', startOver='b', returns='*2v')
     def get(self, c, limit=None, startOver=False):
@@ -457,10 +564,27 @@ class DataVault(LabradServer):
         """
         dataset = self.getDataset(c)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], simpleOnly=True)
+        data, c['filepos'] = yield dataset.run(dataset.getData, limit, c['filepos'], simpleOnly=True)
         key = self.contextKey(c)
-        dataset.keepStreaming(key, c['filepos'])
-        return data
+        yield dataset.run(dataset.keepStreaming, key, c['filepos'])
+        returnValue(data)
+
+    @setting(22, points='w', start='w', stop='w', returns='*2v')
+    def get_decimated(self, c, points, start=0, stop=None):
+        """
+        Get a reduced version of the current dataset for plotting.
+
+        The rows from start up to (but not including) stop are split into
+        points/2 buckets, and only the rows holding the minimum and maximum
+        of each dependent variable in each bucket are returned, so peaks
+        are never lost.  The first and last rows are always included.
+        Stop defaults to the end of the dataset.  Only datasets of scalar,
+        real columns are supported.  Unlike get, this does not change the
+        current position in the dataset.
+        """
+        dataset = self.getDataset(c)
+        data = yield dataset.run(dataset.getDecimated, start, stop, points)
+        returnValue(data)
 
     @setting(1021, limit='w', startOver='b', returns='?')
     def get_ex(self, c, limit=None, startOver=False):
@@ -474,10 +598,10 @@ class DataVault(LabradServer):
         """
         dataset = self.getDataset(c)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], transpose=False)
+        data, c['filepos'] = yield dataset.run(dataset.getData, limit, c['filepos'], transpose=False)
         ctx = self.contextKey(c)
-        dataset.keepStreaming(ctx, c['filepos'])
-        return data
+        yield dataset.run(dataset.keepStreaming, ctx, c['filepos'])
+        returnValue(data)
 
     @setting(2021, limit='w', startOver='b', returns='?')
     def get_ex_t(self, c, limit=None, startOver=False):
@@ -493,10 +617,56 @@ class DataVault(LabradServer):
         """
         dataset = self.getDataset(c)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], transpose=True)
+        data, c['filepos'] = yield dataset.run(dataset.getData, limit, c['filepos'], transpose=True)
         ctx = self.contextKey(c)
-        dataset.keepStreaming(ctx, c['filepos'])
-        return data
+        yield dataset.run(dataset.keepStreaming, ctx, c['filepos'])
+        returnValue(data)
+
+    @setting(2022, columns='*w', limit='w', startOver='b', returns='?')
+    def get_ex_t_columns(self, c, columns, limit=None, startOver=False):
+        """
+        Get the given columns of the current dataset in the transposed extended format.
+
+        Columns is a list of column indices (independents first, then dependents).
+        Data is returned as a cluster of lists, one per requested column, in
+        the same format as get_ex_t.  Shares its position in the dataset with
+        get, get_ex, and get_ex_t.  Datasets created with the 'columnar' layout
+        only read the requested columns from disk.
+        """
+        dataset = self.getDataset(c)
+        c['filepos'] = 0 if startOver else c['filepos']
+        data, c['filepos'] = yield dataset.run(dataset.getColumns, limit, c['filepos'], columns)
+        ctx = self.contextKey(c)
+        yield dataset.run(dataset.keepStreaming, ctx, c['filepos'])
+        returnValue(data)
+
+    @setting(2023, 'subscribe rows', columns='*w', max_batch='w', returns='w')
+    def subscribe_rows(self, c, columns=None, max_batch=None):
+        """
+        Push rows added to the current dataset to this context in 'signal: rows pushed'.
+
+        Each add is sent as a message of (start, end, data), where start and
+        end are the row indices of the added rows, and data holds the given
+        columns (all columns by default) in the same format as get_ex_t_columns.
+        If the client falls behind (more than max_batch rows are added in one
+        'notify interval'), it is sent a single (start, end, None) message,
+        and no more rows are pushed until it has read up to the end of the
+        dataset using get, get_ex, get_ex_t or get_ex_t_columns.
+        Rows stop being pushed when this context opens another dataset.
+        Returns the current row count; rows added from here on are pushed.
+        """
+        dataset = self.getDataset(c)
+        max_batch = PUSH_BATCH_ROWS if max_batch is None else max_batch
+        rows = yield dataset.run(dataset.subscribeRows, self.contextKey(c), columns or None, max_batch)
+        returnValue(rows)
+
+    @setting(2024, 'unsubscribe rows', returns='')
+    def unsubscribe_rows(self, c):
+        """
+        Stop pushing rows of the current dataset to this context.
+        """
+        dataset = self.getDataset(c)
+        dataset.unsubscribeRows(self.contextKey(c))
 
 
     # VARIABLES
@@ -511,9 +681,11 @@ class DataVault(LabradServer):
         traces, while legend is unique to each trace.
         """
         ds = self.getDataset(c)
-        ind = [(i.label, i.unit) for i in ds.getIndependents()]
-        dep = [(d.label, d.legend, d.unit) for d in ds.getDependents()]
-        return ind, dep
+        ind = yield ds.run(ds.getIndependents)
+        dep = yield ds.run(ds.getDependents)
+        ind = [(i.label, i.unit) for i in ind]
+        dep = [(d.label, d.legend, d.unit) for d in dep]
+        returnValue((ind, dep))
 
     @setting(101, returns=('*(s*iss), *(ss*iss)'))
     def variables_ex(self, c):
@@ -528,9 +700,9 @@ class DataVault(LabradServer):
         See new_ex for descriptions of these items.
         """
         ds = self.getDataset(c)
-        ind = ds.getIndependents()
-        dep = ds.getDependents()
-        return ind, dep
+        ind = yield ds.run(ds.getIndependents)
+        dep = yield ds.run(ds.getDependents)
+        returnValue((ind, dep))
 
     @setting(102, returns='s')
     def row_type(self, c):
@@ -539,7 +711,8 @@ class DataVault(LabradServer):
         This is mostly only useful with the extended format.
         """
         ds = self.getDataset(c)
-        return ds.getRowType()
+        result = yield ds.run(ds.getRowType)
+        returnValue(result)
 
     @setting(103, returns='s')
     def transpose_type(self, c):
@@ -548,7 +721,8 @@ class DataVault(LabradServer):
         add_ex_t and get_ex_t.
         """
         ds = self.getDataset(c)
-        return ds.getTransposeType()
+        result = yield ds.run(ds.getTransposeType)
+        returnValue(result)
 
     @setting(104, returns='(i, i)')
     def shape(self, c):
@@ -556,7 +730,8 @@ class DataVault(LabradServer):
         Returns the shape of the dataset.
         """
         ds = self.getDataset(c)
-        return ds.shape()
+        result = yield ds.run(ds.shape)
+        returnValue(result)
 
 
     # METADATA
@@ -568,7 +743,8 @@ class DataVault(LabradServer):
         dataset = self.getDataset(c)
         key = self.contextKey(c)
         dataset.param_listeners.add(key)  # send a message when new parameters are added
-        return dataset.getParamNames()
+        names = yield dataset.run(dataset.getParamNames)
+        returnValue(names)
 
     @setting(121, name='s', returns='')
     def add_parameter(self, c, name, data):
@@ -576,7 +752,8 @@ class DataVault(LabradServer):
         Add a new parameter to the current dataset.
         """
         dataset = self.getDataset(c)
-        dataset.addParameter(name, data)
+        # parameters are saved together by the dataset's metadata buffer
+        yield dataset.runLogged(dataset.addParameter, name, data, False)
 
     @setting(124, 'add parameters', params='?{((s?)(s?)...)}', returns='')
     def add_parameters(self, c, params):
@@ -584,7 +761,7 @@ class DataVault(LabradServer):
         Add a new parameter to the current dataset.
         """
         dataset = self.getDataset(c)
-        dataset.addParameters(params)
+        yield dataset.runLogged(dataset.addParameters, params)
 
     @setting(126, 'get name', returns='s')
     def get_name(self, c):
@@ -601,7 +778,8 @@ class DataVault(LabradServer):
         Get the value of a parameter.
         """
         dataset = self.getDataset(c)
-        return dataset.getParameter(name, case_sensitive)
+        value = yield dataset.run(dataset.getParameter, name, case_sensitive)
+        returnValue(value)
 
     @setting(123, 'get parameters')
     def get_parameters(self, c):
@@ -613,12 +791,11 @@ class DataVault(LabradServer):
         are not allowed).
         """
         dataset = self.getDataset(c)
-        names = dataset.getParamNames()
-        params = tuple((name, dataset.getParameter(name)) for name in names)
+        params = yield dataset.run(dataset.getParameters)
         key = self.contextKey(c)
         dataset.param_listeners.add(key)  # send a message when new parameters are added
         if len(params):
-            return params
+            returnValue(params)
 
     @setting(200, 'add comment', comment=['s'], user=['s'], returns=[''])
     def add_comment(self, c, comment, user='anonymous'):
@@ -626,7 +803,7 @@ class DataVault(LabradServer):
         Add a comment to the current dataset.
         """
         dataset = self.getDataset(c)
-        return dataset.addComment(user, comment)
+        yield dataset.runLogged(dataset.addComment, user, comment)
 
     @setting(201, 'get comments', limit=['w'], startOver=['b'],
              returns=['*(t, s{user}, s{comment})'])
@@ -636,10 +813,10 @@ class DataVault(LabradServer):
         """
         dataset = self.getDataset(c)
         c['commentpos'] = 0 if startOver else c['commentpos']
-        comments, c['commentpos'] = dataset.getComments(limit, c['commentpos'])
+        comments, c['commentpos'] = yield dataset.run(dataset.getComments, limit, c['commentpos'])
         key = self.contextKey(c)
-        dataset.keepStreamingComments(key, c['commentpos'])
-        return comments
+        yield dataset.run(dataset.keepStreamingComments, key, c['commentpos'])
+        returnValue(comments)
 
     @setting(300, 'update tags', tags=['s', '*s'],
              dirs=['s', '*s'], datasets=['s', '*s'],
@@ -680,6 +857,36 @@ class DataVault(LabradServer):
             datasets = [datasets]
         return sess.getTags(dirs, datasets)
 
+    @setting(302, 'search', title='s', tags=['s', '*s'], params='*(sss)', start='t', stop='t', variable='s',
+             returns='*(*s{path}, s{name})')
+    def search(self, c, title='', tags=[], params=[], start=None, stop=None, variable=''):
+        """
+        Find datasets in all data directories, using the search index.
+
+        Returns the (path, name) of all datasets matching all of the given conditions:
+            title:      a substring of the dataset title (case insensitive).
+            tags:       tags the dataset, or a directory containing it, must have.
+                        Tags starting with '-' must not be present.
+            params:     (name, op, value) conditions on scalar parameters, where op
+                        is one of =, !=, <, <=, >, >=.  Values that are numbers are
+                        compared as numbers (in the units the parameter was saved
+                        with), otherwise as strings.
+            start/stop: the range of creation times.
+            variable:   a substring of a variable label (case insensitive).
+        The index is built when the server starts and updated as datasets are
+        created, parameters are added and tags are changed, so row counts are
+        those when the server started (or 0 for new datasets).
+        """
+        if not self.session_store.search:
+            raise errors.BadSearchError('the search index is disabled')
+        if isinstance(tags, str):
+            tags = [tags]
+        results = []
+        for root in sorted(self.session_store.search):
+            matches = yield self.session_store.search[root].search(title, tags, params, start, stop, variable)
+            results.extend(matches)
+        returnValue(results)
+
 
 class DataVaultMultiHead(DataVault):
     """
@@ -0,0 +1,96 @@
+"""
+Benchmark reading extended datasets stored in the row and columnar layouts.
+
+Compares get_ex (rows as a list of tuples) and get_ex_t (a tuple of column
+arrays) on the default row layout against get_ex_t on the columnar layout,
+and reading a single column with get_ex_t_columns on both layouts.
+Times are split into the backend read and flattening the result for labrad.
+Run from the servers directory:
+    python -m data_vault.test.bench_get_columns [rows]
+"""
+import os
+import sys
+import h5py
+import tempfile
+import numpy as np
+
+from time import perf_counter
+from labrad import types as T
+from twisted.internet import task
+
+from data_vault import backend
+
+
+_INDEPENDENTS = [backend.Independent(label='Time', shape=(1,), datatype='v', unit='s')]
+_DEPENDENTS = [
+    backend.Dependent(label='Voltage', legend='Ch{}'.format(idx), shape=(1,), datatype='v', unit='V')
+    for idx in range(3)
+]
+
+# name, storage layout, read function
+READS = [
+    ('get_ex (rows)', '', lambda data: data.getData(None, 0, False, False)),
+    ('get_ex_t (rows)', '', lambda data: data.getData(None, 0, True, False)),
+    ('get_ex_t (columnar)', 'columnar', lambda data: data.getData(None, 0, True, False)),
+    ('1 column (rows)', '', lambda data: data.getDataTranspose(None, 0, [2])),
+    ('1 column (columnar)', 'columnar', lambda data: data.getDataTranspose(None, 0, [2])),
+]
+
+
+def make_dataset(filename, layout, rows):
+    """
+    Create an extended dataset with the given layout.
+    """
+    clock = task.Clock()
+    fh = backend.SelfClosingFile(h5py.File, open_args=(filename, 'a'), reactor=clock)
+    if layout == 'columnar':
+        data = backend.ColumnarHDF5Data(fh)
+    else:
+        data = backend.ExtendedHDF5Data(fh)
+    data.initialize_info('Benchmark', _INDEPENDENTS, _DEPENDENTS, {'layout': layout})
+    rec_data = np.zeros((rows,), dtype=data.dtype)
+    rec_data['f0'] = np.arange(rows) * 1e-3
+    for idx in range(1, len(rec_data.dtype)):
+        rec_data['f{}'.format(idx)] = np.random.normal(0, 1, rows)
+    data.addData(rec_data)
+    fh._fileTimeout()
+    return filename
+
+
+def run_read(filename, read):
+    """
+    Read a dataset from a freshly opened file.
+    Returns:
+        (float, float): time taken to read the data, and to flatten it, in seconds.
+    """
+    data = backend.open_hdf5_file(filename)
+    try:
+        t_start = perf_counter()
+        result, _ = read(data)
+        t_read = perf_counter()
+        T.flatten(result)
+        t_flatten = perf_counter()
+        return t_read - t_start, t_flatten - t_read
+    finally:
+        data._file._fileTimeout()
+
+
+def main(rows=200000):
+    files = {}
+    try:
+        for layout in ('', 'columnar'):
+            files[layout] = make_dataset(tempfile.mktemp(prefix='dvbench', suffix='.hdf5'), layout, rows)
+
+        print('{:d} rows, {:d} columns\n'.format(rows, len(_INDEPENDENTS) + len(_DEPENDENTS)))
+        print('{:<24s}{:>12s}{:>12s}{:>14s}'.format('read', 'read (s)', 'flatten (s)', 'rows/s'))
+        for name, layout, read in READS:
+            t_read, t_flatten = run_read(files[layout], read)
+            print('{:<24s}{:>12.3f}{:>12.3f}{:>14.0f}'.format(name, t_read, t_flatten, rows / (t_read + t_flatten)))
+    finally:
+        for filename in files.values():
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,70 @@
+"""
+Microbenchmark of single-row appends to hdf5 datasets.
+
+Compares resizing the dataset on every add against growing its capacity
+geometrically (the 'double' growth storage option), and against coalescing
+adds in the write-behind buffer.
+Run from the servers directory:
+    python -m data_vault.test.bench_hdf5_append [rows]
+"""
+import os
+import sys
+import h5py
+import tempfile
+import numpy as np
+
+from time import perf_counter
+from twisted.internet import task
+
+from data_vault import backend
+
+
+_INDEPENDENTS = [backend.Independent(label='Time', shape=(1,), datatype='v', unit='s')]
+_DEPENDENTS = [backend.Dependent(label='Frequency', legend='Wavemeter', shape=(1,), datatype='v', unit='THz')]
+
+# name, storage options, write buffer options
+MODES = [
+    ('resize per add', {'growth': ''}, None),
+    ('capacity doubling', {'growth': 'double'}, None),
+    ('write buffer', {'growth': ''}, backend.WRITE_BUFFER),
+    ('write buffer + doubling', {'growth': 'double'}, backend.WRITE_BUFFER),
+]
+
+
+def run_mode(storage, write_buffer, rows):
+    """
+    Append rows one at a time to a new dataset.
+    Returns:
+        (float): rows appended per second.
+    """
+    filename = tempfile.mktemp(prefix='dvbench', suffix='.hdf5')
+    clock = task.Clock()
+    dtype = [('f0', np.float64), ('f1', np.float64)]
+    row_data = [np.rec.array([(idx * 0.1, 384.23 + 1e-6 * idx)], dtype=dtype) for idx in range(rows)]
+    try:
+        fh = backend.SelfClosingFile(h5py.File, open_args=(filename, 'a'), reactor=clock)
+        data = backend.SimpleHDF5Data(fh)
+        data.initialize_info('Benchmark', _INDEPENDENTS, _DEPENDENTS, storage)
+        if write_buffer:
+            data.setWriteBuffer(**write_buffer)
+
+        t_start = perf_counter()
+        for row in row_data:
+            data.addData(row)
+        fh._fileTimeout()
+        elapsed = perf_counter() - t_start
+        return rows / elapsed
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def main(rows=20000):
+    print('{:d} single-row adds\n'.format(rows))
+    print('{:<24s}{:>12s}'.format('mode', 'rows/s'))
+    for name, storage, write_buffer in MODES:
+        print('{:<24s}{:>12.0f}'.format(name, run_mode(storage, write_buffer, rows)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,88 @@
+"""
+Benchmark append throughput and file size of different hdf5 dataset layouts.
+
+Compares the legacy layout (h5py auto-chunking, no filters) against the
+chunked/compressed layouts created using the data vault storage options.
+Run from the servers directory:
+    python -m data_vault.test.bench_hdf5_layout [rows] [rows_per_add]
+"""
+import os
+import sys
+import h5py
+import tempfile
+import numpy as np
+
+from time import perf_counter
+from twisted.internet import task
+
+from data_vault import backend
+
+
+_INDEPENDENTS = [backend.Independent(label='Time', shape=(1,), datatype='v', unit='s')]
+_DEPENDENTS = [
+    backend.Dependent(label='Frequency', legend='Trace', shape=(1,), datatype='v', unit='Hz'),
+    backend.Dependent(label='Power', legend='Trace', shape=(1,), datatype='v', unit='dBm'),
+]
+
+# name, storage options (None = legacy layout)
+LAYOUTS = [
+    ('legacy (auto chunks)', None),
+    ('chunked', {}),
+    ('chunked + lzf', {'compression': 'lzf'}),
+    ('chunked + gzip', {'compression': 'gzip'}),
+    ('chunked + shuffle + gzip', {'compression': 'gzip', 'shuffle': True}),
+]
+
+
+def _make_rows(num_rows):
+    """
+    Create data resembling a long-term trace log.
+    """
+    dtype = [('f0', np.float64), ('f1', np.float64), ('f2', np.float64)]
+    rows = np.zeros((num_rows,), dtype=dtype)
+    rows['f0'] = np.arange(num_rows) * 0.5
+    rows['f1'] = 1.5e6 + np.round(np.random.normal(0, 10, num_rows), 1)
+    rows['f2'] = np.round(-40 + np.random.normal(0, 0.5, num_rows), 3)
+    return rows
+
+
+def run_layout(storage, rows, rows_per_add):
+    """
+    Append rows to a new dataset with the given layout.
+    Returns:
+        (float, int): rows appended per second, and the final file size in bytes.
+    """
+    filename = tempfile.mktemp(prefix='dvbench', suffix='.hdf5')
+    clock = task.Clock()
+    try:
+        fh = backend.SelfClosingFile(h5py.File, open_args=(filename, 'a'), reactor=clock)
+        data = backend.SimpleHDF5Data(fh)
+        if storage is None:
+            # SimpleHDF5Data keeps an existing /DataVault dataset, so we can create the legacy layout ourselves
+            fh().create_dataset('DataVault', (0,), dtype=rows.dtype, maxshape=(None,))
+        data.initialize_info('Benchmark', _INDEPENDENTS, _DEPENDENTS, storage)
+
+        t_start = perf_counter()
+        for idx in range(0, len(rows), rows_per_add):
+            data.addData(rows[idx:idx + rows_per_add])
+        fh().flush()
+        elapsed = perf_counter() - t_start
+
+        fh._fileTimeout()
+        return len(rows) / elapsed, os.path.getsize(filename)
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def main(rows=100000, rows_per_add=100):
+    data = _make_rows(rows)
+    print('{:d} rows, {:d} rows per add\n'.format(rows, rows_per_add))
+    print('{:<28s}{:>14s}{:>14s}{:>12s}'.format('layout', 'rows/s', 'size (kB)', 'bytes/row'))
+    for name, storage in LAYOUTS:
+        rate, size = run_layout(storage, data, rows_per_add)
+        print('{:<28s}{:>14.0f}{:>14.1f}{:>12.2f}'.format(name, rate, size / 1024., size / rows))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,76 @@
+"""
+Benchmark of dataset setup: creating a dataset and adding parameters to it.
+
+Compares saving metadata after every parameter (no metadata buffer) against
+holding parameters in the metadata buffer until the file is closed, and
+against adding all parameters with a single add_parameters call.
+Times include creating the dataset and closing its file.
+Run from the servers directory:
+    python -m data_vault.test.bench_metadata [datasets] [parameters]
+"""
+import sys
+import shutil
+import tempfile
+
+from time import perf_counter
+
+from data_vault import Dataset, backend
+
+
+class _Hub(object):
+    """Hub that ignores all signals."""
+
+    def onNewParameter(self, *args):
+        pass
+
+
+class _Session(object):
+
+    def __init__(self, directory):
+        self.hub = _Hub()
+        self.dir = directory
+
+
+# name, metadata interval, whether to add all parameters in one call
+MODES = [
+    ('save per parameter', 0, False),
+    ('metadata buffer', backend.METADATA_INTERVAL, False),
+    ('add_parameters', backend.METADATA_INTERVAL, True),
+]
+
+
+def run_mode(metadata_interval, batch, datasets, parameters):
+    """
+    Create datasets and add parameters to them one at a time, or all at once.
+    Returns:
+        (float): datasets set up per second.
+    """
+    session = _Session(tempfile.mkdtemp(prefix='dvbench'))
+    params = [('Parameter {:d}'.format(idx), float(idx)) for idx in range(parameters)]
+    try:
+        t_start = perf_counter()
+        for idx in range(datasets):
+            dataset = Dataset(session, 'Benchmark {:d}'.format(idx), title='Benchmark', create=True,
+                              independents=['Time [s]'], dependents=['Voltage (Ch0) [V]'],
+                              metadata_interval=metadata_interval)
+            if batch:
+                dataset.addParameters(params)
+            else:
+                for name, value in params:
+                    dataset.addParameter(name, value, saveNow=False)
+            dataset.data._file.close()
+        elapsed = perf_counter() - t_start
+        return datasets / elapsed
+    finally:
+        shutil.rmtree(session.dir, ignore_errors=True)
+
+
+def main(datasets=100, parameters=50):
+    print('{:d} datasets, {:d} parameters each\n'.format(datasets, parameters))
+    print('{:<24s}{:>14s}'.format('mode', 'datasets/s'))
+    for name, metadata_interval, batch in MODES:
+        print('{:<24s}{:>14.1f}'.format(name, run_mode(metadata_interval, batch, datasets, parameters)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,389 @@
+"""
+Benchmark and load-test suite for the data vault.
+
+Drives SessionStore, Dataset and the DataVault settings in the same process,
+with no LabRAD manager: LocalManager stands in for the manager, and counts the
+signal messages the server sends instead of delivering them. Covers single-row
+and 10k-row adds, get and get_ex_t, dir on a directory with many files,
+parameter-heavy datasets, and concurrent readers.
+Each result is a (benchmark, metric, value, unit) record, along with whether
+higher or lower values are better. Results are printed as a table, and can be
+written as JSON with --output. With --compare, results are checked against a
+JSON file from an earlier run, and the suite exits with status 1 if any result
+got worse by more than --tolerance (a fraction).
+Run from the servers directory:
+    python -m data_vault.test.bench_suite [--quick] [--output results.json] [--compare baseline.json]
+"""
+import os
+import h5py
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+
+from time import perf_counter
+from labrad.server import Signal
+from twisted.internet import defer, task
+
+from data_vault import SessionStore
+from data_vault.server import DataVault
+
+
+# benchmark sizes: full, quick
+SIZES = {
+    'single_rows': (20000, 2000),
+    'block_rows': 10000,
+    'blocks': (20, 5),
+    'read_rows': (200000, 20000),
+    'read_repeats': (5, 3),
+    'dir_files': (10000, 1000),
+    'params': (1000, 200),
+    'readers': (16, 4),
+    'reader_rows': (100000, 10000),
+}
+
+
+class LocalManager(object):
+    """
+    Stand-in for the LabRAD manager.
+
+    Signals of a server attached to the manager send their messages here,
+    where they are counted instead of being delivered.
+    """
+
+    def __init__(self):
+        # signals send their messages using parent._cxn
+        self._cxn = self
+        self.messages = 0
+
+    def attach(self, server):
+        for signal in vars(server).values():
+            if isinstance(signal, Signal):
+                signal.parent = self
+
+    def connect(self, server, c, target='bench'):
+        """
+        Connect a context to all the signals of a server.
+        """
+        for signal in vars(server).values():
+            if isinstance(signal, Signal):
+                signal.connect(c.ID, target, signal.ID)
+
+    def sendMessage(self, target, records, context):
+        self.messages += len(records)
+
+
+class BenchContext(dict):
+    """
+    Request context, as passed to settings.
+    """
+
+    def __init__(self, ID):
+        dict.__init__(self)
+        self.ID = ID
+
+
+class Bench(object):
+    """
+    A data vault server in a new data directory, driven through its settings.
+    """
+
+    def __init__(self, threaded=True):
+        self.parent = tempfile.mkdtemp(prefix='dvbench')
+        self.root = 'bench'
+        self.store = SessionStore(os.path.join(self.parent, self.root), hub=None, threaded=threaded)
+        self.server = DataVault(self.store)
+        self.store.hub = self.server
+        self.manager = LocalManager()
+        self.manager.attach(self.server)
+        self._contexts = 0
+
+    def context(self):
+        """
+        Make a new context in the root of the data directory, connected to all signals.
+        """
+        self._contexts += 1
+        c = BenchContext((1, self._contexts))
+        self.server.initContext(c)
+        self.manager.connect(self.server, c)
+        self.call('cd', c, self.root, True)
+        return c
+
+    def call(self, name, c, *args, **kwargs):
+        """
+        Call a setting.
+        Returns:
+            Deferred: fires with the result of the setting.
+        """
+        return defer.maybeDeferred(getattr(self.server, name), c, *args, **kwargs)
+
+    def close(self):
+        self.server._closeAllDatasets(None)
+        shutil.rmtree(self.parent, ignore_errors=True)
+
+
+def _result(benchmark, metric, value, unit, better='higher'):
+    return {'benchmark': benchmark, 'metric': metric, 'value': value, 'unit': unit, 'better': better}
+
+
+def _rows(count, offset=0):
+    t = np.arange(offset, offset + count, dtype=np.float64)
+    return np.column_stack((t * 0.001, np.sin(t), np.cos(t)))
+
+
+_SIMPLE = (['Time [s]'], ['Signal (PMT) [counts]', 'Signal (Reference) [counts]'])
+_EXTENDED = ([('Time', [1], 'v', 's')],
+             [('Signal', 'PMT', [1], 'v', 'counts'), ('Signal', 'Reference', [1], 'v', 'counts')])
+
+
+@defer.inlineCallbacks
+def bench_add(bench, sizes):
+    """
+    Adding single rows, and blocks of 10k rows, to simple datasets.
+    """
+    c = bench.context()
+    single = _rows(sizes['single_rows'])
+    yield bench.call('new', c, 'single', *_SIMPLE)
+    t_start = perf_counter()
+    for row in single:
+        yield bench.call('add', c, row)
+    single_rate = len(single) / (perf_counter() - t_start)
+
+    blocks = [_rows(sizes['block_rows'], idx * sizes['block_rows']) for idx in range(sizes['blocks'])]
+    yield bench.call('new', c, 'blocks', *_SIMPLE)
+    t_start = perf_counter()
+    for block in blocks:
+        yield bench.call('add', c, block)
+    block_rate = sizes['block_rows'] * len(blocks) / (perf_counter() - t_start)
+    defer.returnValue([
+        _result('add', '1-row adds', single_rate, 'rows/s'),
+        _result('add', '{:d}-row adds'.format(sizes['block_rows']), block_rate, 'rows/s'),
+    ])
+
+
+@defer.inlineCallbacks
+def bench_read(bench, sizes):
+    """
+    Reading a whole dataset with get (simple) and get_ex_t (extended).
+    """
+    c = bench.context()
+    rows = _rows(sizes['read_rows'])
+    yield bench.call('new', c, 'get', *_SIMPLE)
+    yield bench.call('add', c, rows)
+    t_start = perf_counter()
+    for _ in range(sizes['read_repeats']):
+        data = yield bench.call('get', c, None, True)
+        assert len(data) == len(rows)
+    get_rate = len(rows) * sizes['read_repeats'] / (perf_counter() - t_start)
+
+    yield bench.call('new_ex', c, 'get_ex_t', *_EXTENDED)
+    yield bench.call('add_ex_t', c, tuple(rows.T))
+    t_start = perf_counter()
+    for _ in range(sizes['read_repeats']):
+        data = yield bench.call('get_ex_t', c, None, True)
+        assert len(data[0]) == len(rows)
+    get_ex_t_rate = len(rows) * sizes['read_repeats'] / (perf_counter() - t_start)
+    defer.returnValue([
+        _result('read', 'get', get_rate, 'rows/s'),
+        _result('read', 'get_ex_t', get_ex_t_rate, 'rows/s'),
+    ])
+
+
+@defer.inlineCallbacks
+def bench_dir(bench, sizes):
+    """
+    Listing a directory with many datasets, the first time (when every file is
+    opened to build the directory index) and again.
+    """
+    c = bench.context()
+    yield bench.call('new', c, 'template', *_SIMPLE)
+    yield bench.call('add', c, _rows(10))
+    template = bench.server.getDataset(c)
+    yield template.run(template.data._file.close)
+
+    # copy the dataset file into a new directory
+    yield bench.call('mkdir', c, 'many')
+    directory = os.path.join(bench.parent, bench.root, 'many')
+    for idx in range(sizes['dir_files']):
+        shutil.copyfile(template.data._file.open_args[0], os.path.join(directory, '{:05d} - copy.hdf5'.format(idx)))
+    yield bench.call('cd', c, 'many')
+
+    results = []
+    for metric in ('first dir', 'dir'):
+        t_start = perf_counter()
+        _, datasets = yield bench.call('dir', c)
+        elapsed = perf_counter() - t_start
+        assert len(datasets) == sizes['dir_files']
+        results.append(_result('dir', '{} ({:d} files)'.format(metric, sizes['dir_files']), elapsed * 1e3, 'ms',
+                               better='lower'))
+    defer.returnValue(results)
+
+
+@defer.inlineCallbacks
+def bench_params(bench, sizes):
+    """
+    Adding parameters one at a time and all at once, and reading them back.
+    """
+    c = bench.context()
+    params = [('Parameter {:d}'.format(idx), float(idx)) for idx in range(sizes['params'])]
+    yield bench.call('new', c, 'params', *_SIMPLE)
+    t_start = perf_counter()
+    for name, value in params:
+        yield bench.call('add_parameter', c, name, value)
+    add_rate = len(params) / (perf_counter() - t_start)
+
+    yield bench.call('new', c, 'params batch', *_SIMPLE)
+    t_start = perf_counter()
+    yield bench.call('add_parameters', c, params)
+    batch_rate = len(params) / (perf_counter() - t_start)
+
+    t_start = perf_counter()
+    for name, _ in params:
+        yield bench.call('get_parameter', c, name)
+    get_rate = len(params) / (perf_counter() - t_start)
+
+    t_start = perf_counter()
+    values = yield bench.call('get_parameters', c)
+    assert len(values) == len(params)
+    get_all_rate = len(params) / (perf_counter() - t_start)
+    defer.returnValue([
+        _result('params', 'add_parameter', add_rate, 'params/s'),
+        _result('params', 'add_parameters', batch_rate, 'params/s'),
+        _result('params', 'get_parameter', get_rate, 'params/s'),
+        _result('params', 'get_parameters', get_all_rate, 'params/s'),
+    ])
+
+
+@defer.inlineCallbacks
+def bench_readers(bench, sizes):
+    """
+    Concurrent readers of one dataset, each reading the whole dataset, while a
+    writer adds rows to another dataset.
+    """
+    writer = bench.context()
+    yield bench.call('new', writer, 'readers', *_SIMPLE)
+    yield bench.call('add', writer, _rows(sizes['reader_rows']))
+    _, name = yield bench.call('new', writer, 'writer', *_SIMPLE)
+    readers = [bench.context() for _ in range(sizes['readers'])]
+    for c in readers:
+        yield bench.call('open', c, '00001 - readers')
+
+    latencies = []
+
+    @defer.inlineCallbacks
+    def read(c):
+        t_start = perf_counter()
+        data = yield bench.call('get', c, None, True)
+        latencies.append(perf_counter() - t_start)
+        assert len(data) == sizes['reader_rows']
+
+    @defer.inlineCallbacks
+    def write():
+        for idx in range(100):
+            yield bench.call('add', writer, _rows(10, idx * 10))
+
+    t_start = perf_counter()
+    yield defer.gatherResults([read(c) for c in readers] + [write()])
+    elapsed = perf_counter() - t_start
+    defer.returnValue([
+        _result('readers', '{:d} readers'.format(len(readers)), len(readers) * sizes['reader_rows'] / elapsed, 'rows/s'),
+        _result('readers', '{:d} readers, mean latency'.format(len(readers)), np.mean(latencies) * 1e3, 'ms',
+                better='lower'),
+    ])
+
+
+BENCHMARKS = [
+    ('add', bench_add),
+    ('read', bench_read),
+    ('dir', bench_dir),
+    ('params', bench_params),
+    ('readers', bench_readers),
+]
+
+
+def compare(results, baseline, tolerance):
+    """
+    Find results that got worse than in an earlier run.
+    Arguments:
+        results     (list(dict)): the results of this run.
+        baseline    (list(dict)): the results of an earlier run.
+        tolerance   (float): the fraction a result may get worse by.
+    Returns:
+                    (list(str)): a description of each regression.
+    """
+    old_values = {(old['benchmark'], old['metric']): old['value'] for old in baseline}
+    regressions = []
+    for new in results:
+        old = old_values.get((new['benchmark'], new['metric']))
+        if old is None:
+            continue
+        if new['better'] == 'higher':
+            worse = new['value'] < old * (1 - tolerance)
+        else:
+            worse = new['value'] > old * (1 + tolerance)
+        if worse:
+            regressions.append('{} / {}: {:.4g} {} (was {:.4g})'.format(
+                new['benchmark'], new['metric'], new['value'], new['unit'], old))
+    return regressions
+
+
+@defer.inlineCallbacks
+def run(reactor, args):
+    sizes = {key: (val[1] if args.quick else val[0]) if isinstance(val, tuple) else val
+             for key, val in SIZES.items()}
+    results = []
+    for name, benchmark in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        bench = Bench(threaded=not args.unthreaded)
+        try:
+            bench_results = yield benchmark(bench, sizes)
+        finally:
+            bench.close()
+        for result in bench_results:
+            print('{:<10s}{:<32s}{:>14.1f} {}'.format(result['benchmark'], result['metric'],
+                                                     result['value'], result['unit']))
+        results.extend(bench_results)
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'h5py': h5py.__version__,
+            'platform': platform.platform(),
+            'quick': args.quick,
+            'threaded': not args.unthreaded,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('regression: ' + regression)
+        if regressions:
+            raise SystemExit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the data vault.')
+    parser.add_argument('--quick', action='store_true', help='use smaller sizes')
+    parser.add_argument('--unthreaded', action='store_true', help='access files in the reactor thread')
+    parser.add_argument('--only', nargs='*', choices=[name for name, _ in BENCHMARKS], help='benchmarks to run')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare the results to this JSON file from an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='fraction a result may get worse by')
+    args = parser.parse_args(argv)
+    # exits with status 1 if there are regressions
+    task.react(run, (args,))
+
+
+if __name__ == '__main__':
+    main()
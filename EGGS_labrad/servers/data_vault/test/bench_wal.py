@@ -0,0 +1,88 @@
+"""
+Benchmark of the cost of the write-ahead log per added row.
+
+Each writer adds rows to its own dataset in a loop, waiting for each add to
+finish as the add setting does: without a log, an add finishes once the rows
+are in the dataset's write buffer; with a log, it also waits for the group
+commit that syncs its record to disk. With several writers, records are
+synced together, so the cost of each fsync is shared.
+Run from the servers directory:
+    python -m data_vault.test.bench_wal [adds] [rows per add]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+import numpy as np
+
+from time import perf_counter
+from twisted.internet import defer, task
+
+from data_vault import SessionStore
+
+
+class _Hub(object):
+    """Hub that ignores all signals."""
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+# name, whether to log, number of writers
+MODES = [
+    ('no log', False, 1),
+    ('log', True, 1),
+    ('no log, 8 writers', False, 8),
+    ('log, 8 writers', True, 8),
+]
+
+
+@defer.inlineCallbacks
+def write(dataset, adds, rows):
+    columns = np.random.rand(2, rows)
+    for _ in range(adds):
+        yield dataset.runLogged(dataset.addArrays, columns)
+
+
+@defer.inlineCallbacks
+def run_mode(log, writers, adds, rows):
+    """
+    Add rows to datasets from several writers at once.
+    Returns:
+        (float, float, int): rows added per second, microseconds per row, and the number of log fsyncs.
+    """
+    datadir = tempfile.mkdtemp(prefix='dvbench')
+    store = SessionStore(datadir, _Hub(), threaded=True, wal=log)
+    try:
+        session = store.get(['', os.path.basename(datadir)])
+        datasets = [session.newDataset('Benchmark', ['Time [s]'], ['Voltage (Ch0) [V]']) for _ in range(writers)]
+        t_start = perf_counter()
+        yield defer.gatherResults([write(dataset, adds, rows) for dataset in datasets])
+        elapsed = perf_counter() - t_start
+        for dataset in datasets:
+            dataset.data._file.close()
+        commits = sum(wal.commits for wal in store.wal.values())
+        for wal in store.wal.values():
+            wal.close()
+        total = writers * adds * rows
+        defer.returnValue((total / elapsed, 1e6 * elapsed / total, commits))
+    finally:
+        shutil.rmtree(datadir, ignore_errors=True)
+
+
+@defer.inlineCallbacks
+def run(reactor, adds, rows):
+    print('{:d} adds of {:d} rows per writer\n'.format(adds, rows))
+    print('{:<20s}{:>14s}{:>12s}{:>10s}'.format('mode', 'rows/s', 'us/row', 'fsyncs'))
+    for name, log, writers in MODES:
+        rate, cost, commits = yield run_mode(log, writers, adds, rows)
+        print('{:<20s}{:>14.0f}{:>12.2f}{:>10d}'.format(name, rate, cost, commits))
+
+
+def main(adds=1000, rows=1):
+    task.react(run, (adds, rows))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -3,12 +3,16 @@ import h5py
 import numpy as np
 import os
 import pytest
+import queue
 import random
 import string
 import time
 import tempfile
+import threading
 import unittest
 
+from unittest import mock
+
 from labrad import types as T
 from labrad import units as U
 
@@ -70,6 +74,66 @@ class UtilityMethodsTest(_TestCase):
             ValueError, backend.labrad_urldecode, url_string)
 
 
+class StorageOptionsTest(_TestCase):
+    def test_default_options(self):
+        self.assertEqual(backend.STORAGE_OPTIONS, backend.storage_options())
+
+    def test_string_values_are_converted(self):
+        storage = backend.storage_options(
+            [('chunk_rows', '512'), ('compression', 'GZIP'), ('shuffle', 'true')])
+        self.assertEqual(512, storage['chunk_rows'])
+        self.assertEqual('gzip', storage['compression'])
+        self.assertTrue(storage['shuffle'])
+
+    def test_options_override_defaults(self):
+        defaults = backend.storage_options({'compression': 'lzf'})
+        storage = backend.storage_options({'chunk_rows': 10}, defaults)
+        self.assertEqual('lzf', storage['compression'])
+        self.assertEqual(10, storage['chunk_rows'])
+
+    def test_bad_options(self):
+        self.assertRaises(errors.BadStorageOptionError,
+                          backend.storage_options, {'foo': '1'})
+        self.assertRaises(errors.BadStorageOptionError,
+                          backend.storage_options, {'compression': 'zip'})
+        self.assertRaises(errors.BadStorageOptionError,
+                          backend.storage_options, {'chunk_rows': 'many'})
+
+    def test_automatic_chunk_size(self):
+        dtype = [('f0', '<f8'), ('f1', '<f8')]
+        layout = backend.dataset_layout(dtype)
+        self.assertEqual((backend.CHUNK_BYTES // 16,), layout['chunks'])
+        self.assertEqual((None,), layout['maxshape'])
+        self.assertNotIn('compression', layout)
+        # few expected rows should give small chunks
+        layout = backend.dataset_layout(dtype, {'expected_rows': 100})
+        self.assertEqual((100,), layout['chunks'])
+        # many expected rows should give larger chunks
+        layout = backend.dataset_layout(dtype, {'expected_rows': 10 ** 8})
+        self.assertEqual((backend.CHUNK_BYTES_MAX // 16,), layout['chunks'])
+
+
+class DecimateTest(_TestCase):
+    def test_keeps_extrema_of_each_bucket(self):
+        values = np.zeros((10, 3))
+        values[:, 0] = np.arange(10)
+        values[2, 1] = 5
+        values[3, 2] = -5
+        values[8, 2] = 7
+        indices = backend.decimate_minmax(values, 5, columns=[1, 2])
+        self.assertEqual([0, 2, 3, 5, 8, 9], list(indices))
+
+    def test_partial_bucket(self):
+        values = np.arange(7, dtype=float).reshape(7, 1)
+        values[5] = 10
+        indices = backend.decimate_minmax(values, 4)
+        self.assertEqual([0, 3, 4, 5, 6], list(indices))
+
+    def test_small_buckets_keep_all_rows(self):
+        values = np.arange(8, dtype=float).reshape(4, 2)
+        self.assertEqual([0, 1, 2, 3], list(backend.decimate_minmax(values, 2)))
+
+
 class _MockFile(object):
     def __init__(self):
         self.is_open = True
@@ -77,6 +141,9 @@ class _MockFile(object):
     def close(self):
         self.is_open = False
 
+    def flush(self):
+        pass
+
 
 class _MockFileOpener(object):
     def __init__(self):
@@ -135,6 +202,229 @@ class SelfClosingFileTest(_TestCase):
                         msg='Registered callback not called!')
 
 
+class FilePoolTest(_TestCase):
+    """Tests for the FilePool."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pool = backend.FilePool(max_open=2, reactor=self.clock)
+        self.openers = []
+        self.files = []
+        for idx in range(3):
+            opener = _MockFileOpener()
+            self.openers.append(opener)
+            self.files.append(backend.SelfClosingFile(opener=opener, timeout=10, touch=False,
+                                                      reactor=self.clock, pool=self.pool))
+
+    def _open(self, idx):
+        self.clock.advance(1)
+        self.files[idx]()
+
+    def test_evicts_least_recently_used(self):
+        self._open(0)
+        self._open(1)
+        self._open(0)
+        self._open(2)
+        self.assertTrue(self.openers[0].file.is_open)
+        self.assertFalse(self.openers[1].file.is_open, msg='Least recently used file not evicted')
+        self.assertTrue(self.openers[2].file.is_open)
+        self.assertEqual({'open': 2, 'max_open': 2, 'opens': 3, 'closes': 1, 'hits': 1, 'evictions': 1},
+                         self.pool.stats())
+
+        # evicted files are reopened on access
+        self._open(1)
+        self.assertTrue(self.openers[1].file.is_open)
+        self.assertFalse(self.openers[0].file.is_open)
+        self.assertEqual(4, self.pool.stats()['opens'])
+
+    def test_one_timer_for_all_files(self):
+        for idx in range(2):
+            self._open(idx)
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        # each file closes once its own timeout has elapsed
+        self.clock.advance(9)
+        self.assertFalse(self.openers[0].file.is_open)
+        self.assertTrue(self.openers[1].file.is_open)
+        self.clock.advance(1)
+        self.assertFalse(self.openers[1].file.is_open)
+        self.assertEqual(0, len(self.clock.getDelayedCalls()))
+        self.assertEqual(0, self.pool.stats()['open'])
+
+    def test_failed_close_still_closes_file(self):
+        def onClose(fh):
+            raise ValueError('bad close')
+
+        self.files[0].onClose(onClose)
+        for idx in range(3):
+            self._open(idx)
+        self.assertFalse(self.openers[0].file.is_open)
+        self.assertTrue(self.openers[2].file.is_open)
+        self.assertEqual(2, self.pool.stats()['open'])
+
+    def test_set_max_open(self):
+        for idx in range(3):
+            self._open(idx)
+        self.pool.setMaxOpen(1)
+        self.assertEqual([False, False, True], [opener.file.is_open for opener in self.openers])
+
+    def test_sync_open_and_closed_files(self):
+        synced = []
+        filenames = []
+        for idx, fh in enumerate(self.files):
+            filename = _unique_filename(suffix='.csv')
+            open(filename, 'w').close()
+            filenames.append(filename)
+            fh.open_args = (filename, 'a+')
+            fh.onSync(lambda fh, idx=idx: synced.append(idx))
+        try:
+            self._open(0)
+            self._open(1)
+            self.files[0].close()
+            # files closed since the last sync are synced too, but files never opened aren't
+            self.pool.sync()
+            self.assertEqual([0, 1], sorted(synced))
+            del synced[:]
+            self.pool.sync()
+            self.assertEqual([1], synced)
+        finally:
+            for filename in filenames:
+                _remove_file_if_exists(filename)
+
+
+class _ThreadedClock(task.Clock):
+    """Clock that queues calls made from other threads until runPending is called."""
+
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.pending = queue.Queue()
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.pending.put((f, args, kwargs))
+
+    def runPending(self):
+        while not self.pending.empty():
+            f, args, kwargs = self.pending.get()
+            f(*args, **kwargs)
+
+
+class FileWorkerTest(_TestCase):
+    """Tests for the FileWorker."""
+
+    def setUp(self):
+        self.clock = _ThreadedClock()
+        self.worker = backend.FileWorker('test', reactor=self.clock)
+
+    def test_calls_run_in_order_on_worker_thread(self):
+        calls = []
+
+        def call(idx):
+            calls.append((idx, threading.current_thread(), self.worker.inThread()))
+            return idx
+
+        results = []
+        for idx in range(100):
+            self.worker.submit(call, idx).addCallback(results.append)
+        self.worker.drain()
+        self.clock.runPending()
+        self.assertEqual([idx for idx, _, _ in calls], list(range(100)))
+        self.assertTrue(all(thread is not threading.current_thread() for _, thread, _ in calls))
+        self.assertTrue(all(in_thread for _, _, in_thread in calls))
+        self.assertFalse(self.worker.inThread())
+        self.assertEqual(results, list(range(100)))
+
+    def test_errors_are_returned(self):
+        def call():
+            raise ValueError('bad call')
+
+        failures = []
+        self.worker.submit(call).addErrback(failures.append)
+        self.worker.drain()
+        self.clock.runPending()
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(failures[0].check(ValueError))
+
+    def test_order_is_kept_after_restart(self):
+        calls = []
+        for idx in range(50):
+            self.worker.submit(time.sleep, 0.0001)
+            self.worker.submit(calls.append, idx)
+            if idx % 10 == 0:
+                self.worker.stop()
+        self.worker.drain()
+        self.assertEqual(calls, list(range(50)))
+
+
+class ThreadedSelfClosingFileTest(_TestCase):
+    """Tests for the SelfClosingFile with a FileWorker."""
+
+    def setUp(self):
+        self.close_timeout_sec = 1
+        self.opener = _MockFileOpener()
+        self.clock = _ThreadedClock()
+        self.worker = backend.FileWorker('test', reactor=self.clock)
+        self.file = backend.SelfClosingFile(opener=self.opener,
+                                            timeout=self.close_timeout_sec,
+                                            reactor=self.clock,
+                                            worker=self.worker)
+
+    def _advance(self, seconds):
+        self.clock.advance(seconds)
+        self.worker.drain()
+        self.clock.runPending()
+
+    def test_closes_file_after_timeout(self):
+        self._advance(self.close_timeout_sec)
+        self.assertFalse(self.opener.file.is_open,
+                         msg='File not closed after timeout')
+
+    def test_access_delays_timeout(self):
+        self._advance(0.5 * self.close_timeout_sec)
+        self.worker.submit(self.file)
+        self.worker.drain()
+        self._advance(0.5 * self.close_timeout_sec)
+        self.assertTrue(self.opener.file.is_open,
+                        msg='File closed before timeout since last access')
+        self._advance(0.5 * self.close_timeout_sec)
+        self.assertFalse(self.opener.file.is_open,
+                         msg='File not closed after timeout')
+
+    def test_close_waits_for_pending_calls(self):
+        calls = []
+        self.worker.submit(time.sleep, 0.01)
+        self.worker.submit(calls.append, 1)
+        self.file.close()
+        self.assertEqual(calls, [1])
+        self.assertFalse(self.opener.file.is_open)
+
+
+class CsvParsingTest(_TestCase):
+    def test_parse_csv_rows(self):
+        text = b'1, 2.5E+03, NAN\r\n-INF, 5, 6\r\n'
+        rows = backend.parse_csv_rows(text, 3)
+        self.assertEqual((2, 3), rows.shape)
+        self.assertEqual([1, 2500], list(rows[0, :2]))
+        self.assertTrue(np.isnan(rows[0, 2]))
+        self.assertEqual([-np.inf, 5, 6], list(rows[1]))
+
+    def test_parse_csv_rows_with_blank_lines(self):
+        rows = backend.parse_csv_rows(b'1, 2\r\n\r\n3, 4\r\n', 2)
+        self.assert_arrays_equal([[1, 2], [3, 4]], rows)
+
+    def test_parse_csv_rows_wrong_number_of_columns(self):
+        self.assertRaises(errors.BadDataError, backend.parse_csv_rows, b'1, 2\r\n3, 4\r\n', 3)
+
+    def test_row_buffer_grows(self):
+        buffer = backend.RowBuffer(2, capacity=2)
+        buffer.append([[0, 1]])
+        first = buffer.rows
+        for idx in range(1, 10):
+            buffer.append([[2 * idx, 2 * idx + 1]])
+        self.assertEqual(10, len(buffer))
+        self.assert_arrays_equal(np.arange(20).reshape(10, 2), buffer.rows)
+        # views of earlier rows are unaffected by growth
+        self.assert_arrays_equal([[0, 1]], first)
+
+
 # Dependent and Independent variables used for testing IniData and HDF5MetaData.
 _INDEPENDENTS = [
     backend.Independent(
@@ -219,6 +509,18 @@ class _MetadataTest(_TestCase):
             data.addParam,
             'Param1', param)
 
+    def test_add_param_after_lookup(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        data.addParam('Param1', 1)
+        self.assertEqual(data.getParameter('PARAM1', case_sensitive=False), 1)
+        self.assertRaises(errors.BadParameterError, data.getParameter, 'Param2')
+        # parameters added after the first lookup are found
+        data.addParam('Param2', 2)
+        self.assertEqual(data.getParamNames(), ['Param1', 'Param2'])
+        self.assertEqual(data.getParameter('Param2'), 2)
+        self.assertEqual(data.getParameter('param2', case_sensitive=False), 2)
+
     def test_add_comment(self):
         data = self.get_data()
         data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
@@ -422,6 +724,16 @@ class HDF5MetaDataTest(_MetadataTest):
         data.dataset = _MockDataset()
         return data
 
+    def test_parameters_decoded_once(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        data.addParam('Param1', (1, 'a'))
+        with mock.patch.object(backend, 'labrad_urldecode', wraps=backend.labrad_urldecode) as decode:
+            for _ in range(3):
+                self.assertEqual(data.getParameter('Param1'), (1, 'a'))
+                self.assertEqual(data.getParameter('param1', case_sensitive=False), (1, 'a'))
+            self.assertEqual(1, decode.call_count)
+
 
 class _BackendDataTestCase(_TestCase):
     def assert_data_in_backend(self, backend_data, expected_data):
@@ -600,6 +912,94 @@ class CsvNumpyDataTest(_BackendDataTest):
         self.assertRaises(
             errors.BadDataError, self.data.addData, [(1, 2, 3, 4)])
 
+    def test_read_rows_appended_by_others(self):
+        data = np.recarray((1,), dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        data[0] = (1, 2, 3)
+        self.data.addData(data)
+        self.assert_arrays_equal([[1, 2, 3]], self.data.data)
+
+        # rows are only read once their line is complete
+        with open(self.filename, 'ab') as f:
+            f.write(b'4,5,6\r\n7,8')
+        self.assert_arrays_equal([[1, 2, 3], [4, 5, 6]], self.data.data)
+        with open(self.filename, 'ab') as f:
+            f.write(b',9\r\n')
+        self.assert_arrays_equal([[1, 2, 3], [4, 5, 6], [7, 8, 9]], self.data.data)
+
+        data[0] = (10, 11, 12)
+        self.data.addData(data)
+        read_data, pos = self.data.getData(None, 2, False, None)
+        self.assert_arrays_equal([[7, 8, 9], [10, 11, 12]], read_data)
+        self.assertEqual(4, pos)
+        self.assertFalse(self.data.hasMore(4))
+
+    def test_metadata_buffer(self):
+        self.data.setMetadataBuffer(1.0)
+        self.data.addParam('Param1', 1.5)
+        self.assertFalse(os.path.exists(self.data.infofile))
+        self.clock.advance(1.0)
+        self.assertTrue(os.path.exists(self.data.infofile))
+
+    def test_reload_after_data_timeout(self):
+        data = np.recarray((2,), dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        data[0] = (1, 2, 3)
+        data[1] = (4, 5, 6)
+        self.data.addData(data)
+        self.clock.advance(backend.DATA_TIMEOUT + 1)
+        self.assertFalse(hasattr(self.data, '_data'))
+        self.assert_arrays_equal([[1, 2, 3], [4, 5, 6]], self.data.data)
+
+
+class ConvertCsvDatasetTest(_BackendDataTestCase):
+
+    def setUp(self):
+        self.filename = _unique_filename(suffix='.csv')
+        self.clock = task.Clock()
+        self.data = backend.CsvNumpyData(self.filename, reactor=self.clock)
+        self.data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+
+    def tearDown(self):
+        for ext in ('.csv', '.ini', '.hdf5', '.hdf5.tmp'):
+            _remove_file_if_exists(self.filename[:-4] + ext)
+
+    def test_convert(self):
+        rows = np.recarray((100,), dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        rows['f0'] = np.arange(100)
+        rows['f1'] = np.arange(100) * 0.5
+        rows['f2'] = -np.arange(100)
+        self.data.addData(rows)
+        self.data.addParam('Foo', 1.5)
+        self.data.addComment('user', 'a comment')
+        self.data.created = datetime.datetime(2012, 9, 21, 3, 14, 15)
+        self.data.save()
+        self.data._file.close()
+
+        # use small blocks to test converting in blocks
+        hdf5_file, num_rows = backend.convert_csv_dataset(self.filename, block_bytes=100)
+        self.assertEqual(self.filename[:-4] + '.hdf5', hdf5_file)
+        self.assertEqual(100, num_rows)
+        self.assertFalse(os.path.exists(hdf5_file + '.tmp'))
+
+        data = backend.open_hdf5_file(hdf5_file)
+        try:
+            self.assertEqual('FooTitle', data.dataset.attrs['Title'])
+            self.assertEqual(['FirstVariable', 'SecondVariable'], [i.label for i in data.getIndependents()])
+            self.assertEqual(['OnlyDependent'], [d.legend for d in data.getDependents()])
+            self.assertEqual(1.5, data.getParameter('Foo'))
+            comments, _ = data.getComments(None, 0)
+            self.assertEqual(1, len(comments))
+            self.assertEqual(self.data.comments[0][0].replace(microsecond=0), comments[0][0])
+            self.assertEqual(self.data.created.timestamp(), data.dataset.attrs['Creation Time'])
+            read_data, _ = data.getData(None, 0, False, None)
+            self.assert_arrays_equal(np.column_stack([rows['f0'], rows['f1'], rows['f2']]), read_data)
+        finally:
+            data._file.close()
+
+    def test_convert_existing_hdf5_file(self):
+        self.data.save()
+        open(self.filename[:-4] + '.hdf5', 'w').close()
+        self.assertRaises(errors.DatasetExistsError, backend.convert_csv_dataset, self.filename)
+
 
 class ExtendedHDF5DataTest(_BackendDataTest):
 
@@ -772,6 +1172,106 @@ class ExtendedHDF5DataTest(_BackendDataTest):
         added_data, _ = data.getData(None, 0, False, None)
         self.assertEqual(added_data[0][0], "{'a': 0}")
 
+    def test_initialize_storage_layout(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        storage = {'chunk_rows': 256, 'compression': 'gzip', 'shuffle': True}
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS, storage)
+        self.assertEqual((256,), data.dataset.chunks)
+        self.assertEqual('gzip', data.dataset.compression)
+        self.assertTrue(data.dataset.shuffle)
+
+        data_to_add = np.recarray(
+            (1000,),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        data_to_add['f0'] = np.arange(1000)
+        data.addData(data_to_add)
+        read_data, next_pos = data.getData(None, 0, True, None)
+        self.assertEqual(1000, next_pos)
+        self.assert_arrays_equal(read_data[0], np.arange(1000))
+
+    def test_add_data_with_capacity_doubling(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        storage = {'chunk_rows': 4, 'growth': 'double'}
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS, storage)
+        dtype = [('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')]
+        for idx in range(5):
+            row = np.recarray((1,), dtype=dtype)
+            row[0] = (idx, 2 * idx, 3 * idx)
+            data.addData(row)
+
+        # capacity grows geometrically, but only the added rows are visible
+        self.assertEqual(8, data.dataset.shape[0])
+        self.assertEqual(5, len(data))
+        self.assertEqual((5, 3), data.shape())
+        self.assertTrue(data.hasMore(4))
+        self.assertFalse(data.hasMore(5))
+        read_data, next_pos = data.getData(None, 0, True, None)
+        self.assertEqual(5, next_pos)
+        self.assert_arrays_equal(read_data[0], np.arange(5))
+        read_data, next_pos = data.getData(10, 3, True, None)
+        self.assertEqual(5, next_pos)
+        self.assert_arrays_equal(read_data[0], [3, 4])
+
+        # closing the file trims the unused capacity
+        data._file._fileTimeout()
+        reopened = self.get_backend_data(name)
+        self.assertEqual(5, reopened.dataset.shape[0])
+        self.assertEqual(5, len(reopened))
+        self.assertEqual(5, reopened.dataset.attrs['Rows'])
+
+    def test_write_buffer(self):
+        self.data.setWriteBuffer(max_rows=3, max_bytes=1024, interval=1.)
+        dtype = [('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')]
+        rows = np.recarray((3,), dtype=dtype)
+        rows['f0'] = [1, 4, 7]
+        rows['f1'] = [2, 5, 8]
+        rows['f2'] = [3, 6, 9]
+
+        # buffered rows are counted but not yet written
+        self.data.addData(rows[:1])
+        self.data.addData(rows[1:2])
+        self.assertEqual(0, self.data.dataset.shape[0])
+        self.assertEqual(2, len(self.data))
+        self.assertTrue(self.data.hasMore(1))
+        # reading flushes the buffer
+        self.assert_data_in_backend(self.data, [[1, 2, 3], [4, 5, 6]])
+        self.assertEqual(2, self.data.dataset.shape[0])
+
+        # the buffer is flushed after the interval
+        self.data.addData(rows[2:])
+        self.assertEqual(2, self.data.dataset.shape[0])
+        self.clock.advance(1)
+        self.assertEqual(3, self.data.dataset.shape[0])
+
+        # the buffer is flushed once full
+        self.data.addData(rows)
+        self.assertEqual(6, self.data.dataset.shape[0])
+
+        # closing the file flushes the buffer
+        self.data.addData(rows[:1])
+        self.data._file._fileTimeout()
+        reopened = self.get_backend_data(self.filename)
+        self.assertEqual(7, len(reopened))
+
+    def test_get_columns(self):
+        data_to_add = np.recarray(
+            (3,),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        data_to_add['f0'] = [1, 4, 7]
+        data_to_add['f1'] = [2, 5, 8]
+        data_to_add['f2'] = [3, 6, 9]
+        self.data.addData(data_to_add)
+
+        actual, next_pos = self.data.getDataTranspose(None, 1, [2])
+        self.assertEqual(3, next_pos)
+        self.assert_arrays_equal(actual, [[6, 9]])
+        actual, next_pos = self.data.getDataTranspose(2, 0, [2, 0])
+        self.assertEqual(2, next_pos)
+        self.assert_arrays_equal(actual, [[3, 6], [1, 4]])
+        self.assertRaises(errors.BadColumnError, self.data.getDataTranspose, None, 0, [3])
+
     def test_add_string_array_column(self):
         name = _unique_filename()
         data = self.get_backend_data(name)
@@ -788,6 +1288,91 @@ class ExtendedHDF5DataTest(_BackendDataTest):
             [])
 
 
+class ColumnarHDF5DataTest(_BackendDataTest):
+
+    def setUp(self):
+        self.filename = _unique_filename(suffix='.hdf5')
+        self.files_to_remove = []
+        self.clock = task.Clock()
+        self.data = self.get_backend_data(self.filename)
+        # Initialize the metadata.
+        self.data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+
+    def tearDown(self):
+        for name in self.files_to_remove:
+            _remove_file_if_exists(name)
+
+    def get_backend_data(self, filename):
+        self.files_to_remove.append(filename)
+        fh = backend.SelfClosingFile(
+            h5py.File, open_args=(filename, 'a'), reactor=self.clock)
+        return backend.ColumnarHDF5Data(fh)
+
+    def _add_rows(self, data, num_rows):
+        rows = np.recarray((num_rows,), dtype=data.dtype)
+        rows['f0'] = np.arange(num_rows)
+        rows['f1'] = 2 * np.arange(num_rows)
+        rows['f2'] = 3 * np.arange(num_rows)
+        data.addData(rows)
+
+    def test_initialize_columns(self):
+        self.assertEqual(['f0', 'f1', 'f2'], sorted(self.data.dataset.keys()))
+        self.assertEqual('FooTitle', self.data.dataset.attrs['Title'])
+        self.assertEqual([3, 1, 0], list(self.data.version))
+        self.assertEqual(_INDEPENDENTS, self.data.getIndependents())
+
+    def test_get_data_transpose(self):
+        self._add_rows(self.data, 4)
+        self.assert_data_in_backend(self.data, [[0, 0, 0], [1, 2, 3], [2, 4, 6], [3, 6, 9]])
+        actual, next_pos = self.data.getData(None, 0, True, None)
+        self.assertEqual(4, next_pos)
+        self.assert_arrays_equal(actual, [[0, 1, 2, 3], [0, 2, 4, 6], [0, 3, 6, 9]])
+
+    def test_get_columns(self):
+        self._add_rows(self.data, 4)
+        actual, next_pos = self.data.getDataTranspose(2, 1, [2, 0])
+        self.assertEqual(3, next_pos)
+        self.assert_arrays_equal(actual, [[3, 6], [1, 2]])
+        self.assertRaises(errors.BadColumnError, self.data.getDataTranspose, None, 0, [3])
+
+    def test_extended_columns(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        independent = backend.Independent(label='Time', shape=(1,), datatype='t', unit='')
+        dependents = [
+            backend.Dependent(label='Trace', legend='', shape=(2,), datatype='v', unit='V'),
+            backend.Dependent(label='Note', legend='', shape=(1,), datatype='s', unit=''),
+        ]
+        data.initialize_info('Foo', [independent], dependents, {'chunk_rows': 8})
+        self.assertEqual((8, 2), data.dataset['f1'].chunks)
+        rows = np.recarray((2,), dtype=data.dtype)
+        rows[0] = (1, [1., 2.], 'a')
+        rows[1] = (2, [3., 4.], 'bb')
+        data.addData(rows)
+        (times, notes), _ = data.getDataTranspose(None, 0, [0, 2])
+        self.assert_arrays_equal(times, [1, 2])
+        self.assertEqual(['a', 'bb'], notes)
+        read_data, _ = data.getData(None, 0, False, None)
+        self.assert_arrays_equal(read_data[1][1], [3., 4.])
+
+    def test_capacity_doubling_and_reopen(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS, {'chunk_rows': 4, 'growth': 'double'})
+        for _ in range(5):
+            self._add_rows(data, 1)
+        self.assertEqual(8, data.dataset['f0'].shape[0])
+        self.assertEqual(5, len(data))
+
+        # closing the file trims the unused capacity of every column
+        data._file._fileTimeout()
+        reopened = backend.open_hdf5_file(name)
+        self.assertIsInstance(reopened, backend.ColumnarHDF5Data)
+        self.assertEqual([5, 5, 5], [reopened.dataset[col].shape[0] for col in ('f0', 'f1', 'f2')])
+        self.assertEqual(5, len(reopened))
+        reopened._file._fileTimeout()
+
+
 class SimpleHDF5DataTest(_BackendDataTest):
 
     def setUp(self):
@@ -813,6 +1398,146 @@ class SimpleHDF5DataTest(_BackendDataTest):
         self.assertEqual(read_data.dtype, np.dtype(float))
         self.assertEqual(read_data.size, 0)
 
+    def test_metadata_buffer(self):
+        self.data.setMetadataBuffer(1.0)
+        self.data.addParam('Param1', 1.5)
+        self.data.addComment('foo user', 'bar comment')
+        self.data.access()
+        # buffered changes are visible, but not yet in the file
+        self.assertEqual(['Param1'], self.data.getParamNames())
+        self.assertEqual(1.5, self.data.getParameter('param1', case_sensitive=False))
+        self.assertRaises(errors.ParameterInUseError, self.data.addParam, 'Param1', 2.5)
+        self.assertEqual(1, self.data.numComments())
+        self.assertNotIn('Param.Param1', self.data.dataset.attrs)
+        self.assertEqual(0, len(self.data.dataset.attrs['Comments']))
+
+        # changes are saved together once the interval has elapsed
+        self.clock.advance(1.0)
+        self.assertIn('Param.Param1', self.data.dataset.attrs)
+        self.assertEqual(1, len(self.data.dataset.attrs['Comments']))
+        self.assertEqual(['Param1'], self.data.getParamNames())
+
+    def test_metadata_buffer_saved_on_close(self):
+        self.data.setMetadataBuffer(10.0)
+        self.data.addParam('Param1', 1.5)
+        self.data._file._fileTimeout()
+
+        data = backend.open_hdf5_file(self.filename)
+        try:
+            self.assertEqual(1.5, data.getParameter('Param1'))
+        finally:
+            data._file.close()
+
+    def test_get_decimated(self):
+        rows = np.recarray((1000,), dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        rows['f0'] = np.arange(1000)
+        rows['f1'] = 0
+        rows['f2'] = np.sin(np.arange(1000) / 50.)
+        rows['f2'][537] = 100
+        rows['f2'][123] = -100
+        self.data.addData(rows)
+
+        decimated = self.data.getDecimated(0, None, 20)
+        self.assertLessEqual(len(decimated), 22)
+        self.assertEqual(0, decimated[0, 0])
+        self.assertEqual(999, decimated[-1, 0])
+        self.assertIn(537, decimated[:, 0])
+        self.assertIn(123, decimated[:, 0])
+        self.assertEqual(100, decimated[:, 2].max())
+
+        # reading in blocks gives the same result
+        with mock.patch.object(backend, 'DECIMATE_BLOCK_ROWS', 300):
+            self.assert_arrays_equal(decimated, self.data.getDecimated(0, None, 20))
+
+        # row ranges
+        decimated = self.data.getDecimated(500, 600, 10)
+        self.assertEqual(500, decimated[0, 0])
+        self.assertEqual(599, decimated[-1, 0])
+        self.assertIn(537, decimated[:, 0])
+        self.assertNotIn(123, decimated[:, 0])
+        # ranges with fewer rows than points are returned in full
+        self.assertEqual(10, len(self.data.getDecimated(990, 1500, 20)))
+
+
+class ARTIQDataTest(_TestCase):
+
+    def setUp(self):
+        self.filename = _unique_filename(suffix='.h5')
+
+    def tearDown(self):
+        backend._artiq_tables.pop(self.filename, None)
+        _remove_file_if_exists(self.filename)
+
+    def _write_file(self, **datasets):
+        with h5py.File(self.filename, 'w') as f:
+            f['artiq_version'] = '7.0'
+            for name, data in datasets.items():
+                f['datasets/' + name] = data
+
+    def test_descriptor_table(self):
+        self._write_file(scan=np.arange(12.).reshape(4, 3), counts=np.arange(5.))
+        table = backend.get_artiq_descriptors(self.filename)
+        self.assertEqual(['counts', 'scan'], sorted(table))
+        self.assertEqual(1, len(table['scan'].independents))
+        self.assertEqual(2, len(table['scan'].dependents))
+        self.assertEqual(0, len(table['counts'].dependents))
+        # the table is only rebuilt when the file changes
+        self.assertIs(table, backend.get_artiq_descriptors(self.filename))
+        self._write_file(scan=np.arange(8.).reshape(4, 2))
+        os.utime(self.filename, (0, 0))
+        table = backend.get_artiq_descriptors(self.filename)
+        self.assertEqual(['scan'], list(table))
+        self.assertEqual(1, len(table['scan'].dependents))
+
+    def test_descriptor_table_eviction(self):
+        self._write_file(scan=np.arange(12.).reshape(4, 3))
+        other = _unique_filename(suffix='.h5')
+        try:
+            with h5py.File(other, 'w') as f:
+                f['datasets/counts'] = np.arange(5.)
+            with mock.patch.object(backend, 'MAX_ARTIQ_TABLES', 1):
+                table = backend.get_artiq_descriptors(self.filename)
+                self.assertIn(self.filename, backend._artiq_tables)
+                # only the most recently used tables are kept
+                backend.get_artiq_descriptors(other)
+                self.assertNotIn(self.filename, backend._artiq_tables)
+                self.assertIsNot(table, backend.get_artiq_descriptors(self.filename))
+                self.assertNotIn(other, backend._artiq_tables)
+        finally:
+            backend._artiq_tables.pop(other, None)
+            _remove_file_if_exists(other)
+
+    def test_single_dataset(self):
+        self._write_file(scan=np.arange(12.).reshape(4, 3))
+        data = backend.open_hdf5_file(self.filename)
+        try:
+            self.assertIsInstance(data, backend.ARTIQHDF5Data)
+            self.assertEqual((4, 3), data.shape())
+            self.assertEqual(2, len(data.getDependents()))
+            rows, pos = data.getData(2, 1, False, None)
+            self.assert_arrays_equal(np.arange(3., 9.).reshape(2, 3), rows)
+            self.assertEqual(3, pos)
+        finally:
+            data._file.close()
+
+    def test_multiple_datasets(self):
+        self._write_file(scan=np.arange(12.).reshape(4, 3), counts=np.arange(5.))
+        scan = backend.open_hdf5_file(self.filename, dataset_name='scan')
+        counts = backend.open_hdf5_file(self.filename, dataset_name='counts')
+        try:
+            # datasets of the same file share its descriptor table
+            self.assertIs(scan._descriptor, backend.get_artiq_descriptors(self.filename)['scan'])
+            self.assertEqual((4, 3), scan.shape())
+            self.assert_arrays_equal(np.arange(12.).reshape(4, 3), scan.getData(None, 0, False, None)[0])
+            # 1-D datasets are read as a single column
+            self.assertEqual((5, 1), counts.shape())
+            rows, pos = counts.getData(None, 3, False, None)
+            self.assert_arrays_equal([[3.], [4.]], rows)
+            self.assertEqual(5, pos)
+        finally:
+            scan._file.close()
+            counts._file.close()
+
 
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
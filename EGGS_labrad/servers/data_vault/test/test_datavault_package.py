@@ -1,3 +1,4 @@
+import h5py
 import mock
 import numpy as np
 import os
@@ -9,6 +10,7 @@ from labrad import types
 
 from twisted.internet import task
 
+import datavault
 from datavault import Session, Dataset, SessionStore
 
 
@@ -259,6 +261,130 @@ class SessionTest(_DatavaultTestCase):
         self.assertEqual([(session, ['tag'])], session_tags)
         self.assertEqual([(dataset, ['tag'])], dataset_tags)
 
+    def _write_artiq_file(self, session, name, num_datasets):
+        filename = os.path.join(session.dir, name + '.h5')
+        with h5py.File(filename, 'w') as f:
+            for idx in range(num_datasets):
+                f.create_dataset('datasets/data{}'.format(idx), data=np.zeros((5, 2)))
+        return filename
+
+    def test_list_contents_uses_index(self):
+        session = self._get_session()
+        dataset = session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        self._write_artiq_file(session, 'single', 1)
+        multiple = self._write_artiq_file(session, 'multiple', 2)
+
+        with mock.patch.object(datavault, 'probe_datafile', wraps=datavault.probe_datafile) as probe:
+            dirs, datasets = session.listContents([])
+            self.assertEqual(['multiple.h5'], dirs)
+            self.assertEqual(['00001 - Foo', 'single'], datasets)
+            # the dataset we have open isn't probed
+            self.assertEqual(2, probe.call_count)
+
+            # unchanged files aren't probed again
+            self.assertEqual((dirs, datasets), session.listContents([]))
+            self.assertEqual(2, probe.call_count)
+
+            # the index is saved, so a new session only probes the dataset it doesn't have open
+            dataset.data._file._fileTimeout()
+            session2 = self._get_session()
+            self.assertEqual((dirs, datasets), session2.listContents([]))
+            self.assertEqual(3, probe.call_count)
+            self.assertEqual(5, session2.index.entries['single.h5']['rows'])
+
+            # modified files are probed again
+            self._write_artiq_file(session, 'multiple', 1)
+            os.utime(multiple, (0, 0))
+            dirs, datasets = session2.listContents([])
+            self.assertEqual([], dirs)
+            self.assertEqual(['00001 - Foo', 'multiple', 'single'], datasets)
+            self.assertEqual(4, probe.call_count)
+
+        # deleted files are removed from the index
+        os.remove(multiple)
+        session2.listContents([])
+        self.assertNotIn('multiple.h5', session2.index.entries)
+
+    def test_list_contents_retries_failed_probe(self):
+        session = self._get_session()
+        self._write_artiq_file(session, 'multiple', 2)
+
+        # a file that can't be opened isn't indexed
+        with mock.patch.object(datavault, 'probe_datafile', side_effect=OSError('file is locked')):
+            dirs, datasets = session.listContents([])
+        self.assertEqual([], dirs)
+        self.assertEqual(['multiple'], datasets)
+        self.assertNotIn('multiple.h5', session.index.entries)
+
+        # so it's probed again on the next listing, even though it hasn't changed
+        dirs, datasets = session.listContents([])
+        self.assertEqual(['multiple.h5'], dirs)
+        self.assertEqual([], datasets)
+        self.assertEqual('multiple', session.index.entries['multiple.h5']['kind'])
+
+
+class ListenerIndexTest(_DatavaultTestCase):
+
+    def setUp(self):
+        self.datadir = _unique_dir()
+        self.hub = mock.MagicMock()
+        self.store = SessionStore(self.datadir, self.hub)
+
+    def tearDown(self):
+        _empty_and_remove_dir(self.datadir)
+
+    def test_expire_many_contexts(self):
+        session = self.store.get(['', os.path.basename(self.datadir)])
+        datasets = [session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS) for _ in range(500)]
+        index = self.store.listener_index
+
+        # each context listens to the session, and to the data, parameters and comments of one dataset
+        keys = [(1, idx) for idx in range(1000)]
+        for idx, key in enumerate(keys):
+            dataset = datasets[idx % len(datasets)]
+            session.listeners.add(key)
+            dataset.keepStreaming(key, 0)
+            dataset.keepStreamingComments(key, 0)
+            dataset.param_listeners.add(key)
+        self.assertEqual(1000, len(index))
+        self.assertEqual(1000, len(session.listeners))
+        self.assertEqual({keys[0], keys[500]}, datasets[0].listeners)
+
+        # contexts are removed from their sets only
+        for key in keys[:500]:
+            index.expire(key)
+        self.assertEqual(set(keys[500:]), session.listeners)
+        for idx, dataset in enumerate(datasets):
+            for listeners in (dataset.listeners, dataset.param_listeners, dataset.comment_listeners):
+                self.assertEqual({keys[idx + 500]}, listeners)
+
+        for key in keys[500:]:
+            index.expire(key)
+        self.assertEqual(0, len(index))
+        self.assertEqual(set(), session.listeners)
+        for dataset in datasets:
+            self.assertEqual(set(), dataset.listeners | dataset.param_listeners | dataset.comment_listeners)
+
+    def test_expire_subscription(self):
+        session = self.store.get(['', os.path.basename(self.datadir)])
+        dataset = session.newDataset('foo', ['x [s]'], ['y (bar) [V]'])
+        dataset.subscribeRows('foo')
+        self.assertIn('foo', dataset.row_subscribers)
+        self.store.listener_index.expire('foo')
+        self.assertNotIn('foo', dataset.row_subscribers)
+
+    def test_expire_after_notify(self):
+        session = self.store.get(['', os.path.basename(self.datadir)])
+        dataset = session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        dataset.listeners.add('foo')
+        dataset.addData(np.array([[0, 1, 2]]))
+        self.hub.onDataAvailable.assert_called_with(None, {'foo'})
+        self.assertEqual(set(), dataset.listeners)
+
+        dataset.listeners.add('foo')
+        self.store.listener_index.expire('foo')
+        self.assertEqual(set(), dataset.listeners)
+
 
 class DatasetTest(_DatavaultTestCase):
     _EXT_INDEPENDENTS = [('t', [1], 'v', 'ns'), ('x', [2, 2], 'c', 'V')]
@@ -473,6 +599,40 @@ class DatasetTest(_DatavaultTestCase):
         self.assertEqual('data 2', dataset.getParameter('param 2'))
         self.assertEqual('data 3', dataset.getParameter('param 3'))
 
+    def test_buffered_metadata_saved_with_add_parameters(self):
+        dataset = Dataset(
+            self.session,
+            "Foo Name",
+            title=self._TITLE,
+            create=True,
+            independents=self._INDEPENDENTS,
+            dependents=self._DEPENDENTS,
+            metadata_interval=10.0)
+
+        with mock.patch.object(dataset.data, 'save', wraps=dataset.data.save) as save:
+            dataset.addParameter('param 1', 'data 1', saveNow=False)
+            dataset.addComment('user', 'comment')
+            self.assertEqual(0, save.call_count)
+            dataset.addParameters([('param 2', 'data 2'), ('param 3', 'data 3')])
+            self.assertEqual(1, save.call_count)
+        self.assertIn('Param.param 1', dataset.data.dataset.attrs)
+        self.assertIn('Param.param 3', dataset.data.dataset.attrs)
+        self.assertEqual(1, len(dataset.data.dataset.attrs['Comments']))
+
+    def test_access_time_throttled(self):
+        dataset = Dataset(
+            self.session,
+            "Foo Name",
+            title=self._TITLE,
+            create=True,
+            independents=self._INDEPENDENTS,
+            dependents=self._DEPENDENTS)
+
+        with mock.patch.object(dataset.data, 'access') as access:
+            dataset.access()
+            dataset.access()
+            self.assertEqual(1, access.call_count)
+
     def test_add_comment(self):
         dataset = Dataset(
             self.session,
@@ -518,6 +678,166 @@ class DatasetTest(_DatavaultTestCase):
         # Trigger the listener again.
         self.hub.onDataAvailable.assert_called_with(None, set([listener]))
 
+    def test_row_notifications_coalesced(self):
+        clock = task.Clock()
+        dataset = Dataset(
+            self.session,
+            "Foo Name",
+            title=self._TITLE,
+            create=True,
+            independents=self._INDEPENDENTS,
+            dependents=self._DEPENDENTS,
+            notify_interval=0.02,
+            reactor=clock)
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+
+        dataset.streamRows('listener')
+        self.hub.onDataRows.assert_not_called()
+        # the first add is sent immediately
+        dataset.addData(data)
+        self.hub.onDataRows.assert_called_once_with(1, set(['listener']))
+        self.hub.reset_mock()
+        # adds within the interval are sent together, with the latest row count
+        for _ in range(10):
+            clock.advance(0.001)
+            dataset.addData(data)
+        self.hub.onDataRows.assert_not_called()
+        clock.advance(0.02)
+        self.hub.onDataRows.assert_called_once_with(11, set(['listener']))
+        # the old signal is sent for every add
+        self.assertEqual(10, self.hub.onDataAvailable.call_count)
+
+        # a context that starts streaming is sent the current row count
+        self.hub.reset_mock()
+        dataset.streamRows('other')
+        self.hub.onDataRows.assert_called_once_with(11, ['other'])
+        dataset.stopStreamingRows('listener')
+        clock.advance(1)
+        dataset.addData(data)
+        self.hub.onDataRows.assert_called_with(12, set(['other']))
+
+    def test_row_notifications_without_interval(self):
+        clock = task.Clock()
+        dataset = Dataset(
+            self.session,
+            "Foo Name",
+            title=self._TITLE,
+            create=True,
+            independents=self._INDEPENDENTS,
+            dependents=self._DEPENDENTS,
+            reactor=clock)
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+
+        dataset.streamRows('listener')
+        for _ in range(3):
+            dataset.addData(data)
+        self.assertEqual(3, self.hub.onDataRows.call_count)
+        self.hub.onDataRows.assert_called_with(3, set(['listener']))
+        self.assertEqual([], clock.getDelayedCalls())
+
+    def test_subscribe_rows(self):
+        clock = task.Clock()
+        dataset = Dataset(
+            self.session,
+            "Foo Name",
+            title=self._TITLE,
+            create=True,
+            independents=self._INDEPENDENTS,
+            dependents=self._DEPENDENTS,
+            notify_interval=0.02,
+            reactor=clock)
+        data = self._get_records_simple([(1, 2, 3), (4, 5, 6)], dataset.data.dtype)
+        dataset.addData(data)
+
+        self.assertEqual(2, dataset.subscribeRows('listener', [2, 0], max_batch=4))
+        dataset.addData(data)
+        msg, contexts = self.hub.onRowsPushed.call_args[0]
+        self.assertEqual(['listener'], contexts)
+        self.assertEqual((2, 4), msg[:2])
+        self.assertArrayEqual([[3, 6], [1, 4]], msg[2])
+
+        # more than max_batch rows in one interval: notify only
+        dataset.addData(data)
+        self.assertEqual((4, 6), self.hub.onRowsPushed.call_args[0][0][:2])
+        dataset.addData(data)
+        self.hub.onRowsPushed.assert_called_with((6, 8, None), ['listener'])
+        self.hub.reset_mock()
+        clock.advance(1)
+        dataset.addData(data)
+        self.hub.onRowsPushed.assert_not_called()
+
+        # pushing resumes once the context has read all the rows
+        dataset.keepStreaming('listener', 10)
+        dataset.addData(data)
+        self.assertEqual((10, 12), self.hub.onRowsPushed.call_args[0][0][:2])
+
+        dataset.unsubscribeRows('listener')
+        self.hub.reset_mock()
+        dataset.addData(data)
+        self.hub.onRowsPushed.assert_not_called()
+
+    def test_subscribe_rows_plain_array(self):
+        dataset = Dataset(
+            self.session,
+            "Foo Name",
+            title=self._TITLE,
+            create=True,
+            independents=self._INDEPENDENTS,
+            dependents=self._DEPENDENTS)
+        dataset.subscribeRows('listener', [1])
+
+        # rows added as lists of values (e.g. by csv list datasets) are pushed as columns too
+        dataset._pushRows(2, [[1., 2., 3.], [4., 5., 6.]])
+        msg, contexts = self.hub.onRowsPushed.call_args[0]
+        self.assertEqual(['listener'], contexts)
+        self.assertEqual((0, 2), msg[:2])
+        self.assertArrayEqual([[2, 5]], msg[2])
+        # a single row
+        dataset._pushRows(3, [7., 8., 9.])
+        msg, contexts = self.hub.onRowsPushed.call_args[0]
+        self.assertEqual((2, 3), msg[:2])
+        self.assertArrayEqual([[8]], msg[2])
+
+    def test_row_notifications_checked_in_reactor(self):
+        clock = task.Clock()
+        dataset = Dataset(
+            self.session,
+            "Foo Name",
+            title=self._TITLE,
+            create=True,
+            independents=self._INDEPENDENTS,
+            dependents=self._DEPENDENTS,
+            reactor=clock)
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        # calls from the worker thread are run later, by the reactor
+        calls = []
+        dataset.worker = mock.Mock()
+        dataset.worker.callInReactor.side_effect = lambda func, *args: calls.append((func, args))
+
+        dataset.addData(data)
+        # contexts that start listening before the reactor gets to the add still hear about it
+        dataset._streamRows('listener', 0)
+        dataset._subscribeRows('subscriber', datavault.RowSubscription([0], 10, 0))
+        for func, args in calls:
+            func(*args)
+        self.hub.onDataRows.assert_called_once_with(1, set(['listener']))
+        msg, contexts = self.hub.onRowsPushed.call_args[0]
+        self.assertEqual(['subscriber'], contexts)
+        self.assertEqual((0, 1), msg[:2])
+        self.assertArrayEqual([[1]], msg[2])
+
+    def test_subscribe_rows_bad_column(self):
+        dataset = Dataset(
+            self.session,
+            "Foo Name",
+            title=self._TITLE,
+            create=True,
+            independents=self._INDEPENDENTS,
+            dependents=self._DEPENDENTS)
+        with self.assertRaises(datavault.errors.BadColumnError):
+            dataset.subscribeRows('listener', [3])
+        self.assertEqual(0, len(dataset.row_subscribers))
+
 
 if __name__ == '__main__':
     pytest.main(['-v', '-s', __file__])
@@ -0,0 +1,132 @@
+import datetime
+import mock
+import os
+import pytest
+import queue
+import shutil
+import tempfile
+import unittest
+
+from labrad import units as U
+
+from twisted.internet import task
+
+from datavault import SessionStore, errors, search
+
+
+class _ThreadedClock(task.Clock):
+    """Clock that queues calls made from other threads until runPending is called."""
+
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.pending = queue.Queue()
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.pending.put((f, args, kwargs))
+
+    def runPending(self):
+        while not self.pending.empty():
+            f, args, kwargs = self.pending.get()
+            f(*args, **kwargs)
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp(prefix='dvtest')
+        self.root = os.path.basename(self.datadir)
+        self.store = SessionStore(self.datadir, mock.MagicMock())
+        self.clock = _ThreadedClock()
+        self.index = search.SearchIndex(self.datadir, reactor=self.clock)
+
+    def tearDown(self):
+        self.index.close()
+        self.index.worker.drain()
+        shutil.rmtree(self.datadir)
+
+    def _wait(self, d):
+        """
+        Wait for a call to the index to finish, and return its result.
+        """
+        results = []
+        d.addBoth(results.append)
+        self.index.worker.stop()
+        self.index.worker.drain()
+        self.clock.runPending()
+        if hasattr(results[0], 'raiseException'):
+            results[0].raiseException()
+        return results[0]
+
+    def _search(self, **kwargs):
+        return [(path[2:], name) for path, name in self._wait(self.index.search(**kwargs))]
+
+    def _newDataset(self, session, title, params=(), dependents=('Signal (PMT) [counts]',)):
+        dataset = session.newDataset(title, ['Time [s]'], list(dependents))
+        dataset.addParameters(params)
+        # write buffered metadata so the file can be indexed
+        dataset.data._file.close()
+        return dataset
+
+    def _makeTree(self):
+        session = self.store.get(['', self.root])
+        rga = self.store.get(['', self.root, 'rga'])
+        self._newDataset(session, 'Scan', [('Voltage', U.Value(5.0, 'V')), ('Ion', 'Ca')])
+        self._newDataset(rga, 'RGA Scan', [('Voltage', U.Value(1.5, 'V')), ('Mass', 40)],
+                         dependents=['Pressure (RGA) [Torr]'])
+        self._newDataset(rga, 'RGA Scan', [('Voltage', U.Value(2.5, 'V')), ('Mass', 44)],
+                         dependents=['Pressure (RGA) [Torr]'])
+        session.updateTags(['vacuum'], ['rga'], [])
+        rga.updateTags(['trash'], [], ['00002 - RGA Scan'])
+
+    def test_build(self):
+        self._makeTree()
+        self.assertEqual(3, self._wait(self.index.build()))
+
+        everything = [([], '00001 - Scan'), (['rga'], '00001 - RGA Scan'), (['rga'], '00002 - RGA Scan')]
+        self.assertEqual(everything, self._search())
+        self.assertEqual(everything[1:], self._search(title='rga'))
+        self.assertEqual(everything[1:], self._search(variable='pressure'))
+        # directory tags apply to the datasets in them
+        self.assertEqual(everything[1:], self._search(tags=['vacuum']))
+        self.assertEqual(everything[:2], self._search(tags=['-trash']))
+        self.assertEqual(everything[2:], self._search(params=[('Voltage', '>', '2'), ('Mass', '=', '44')]))
+        self.assertEqual(everything[:1], self._search(params=[('Ion', '=', 'Ca')]))
+        self.assertEqual([], self._search(params=[('Ion', '=', 'Sr')]))
+        tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+        self.assertEqual(everything, self._search(stop=tomorrow))
+        self.assertEqual([], self._search(start=tomorrow))
+
+        # unchanged files aren't read again
+        self.assertEqual(0, self._wait(self.index.build()))
+        os.remove(os.path.join(self.datadir, '00001 - Scan.hdf5'))
+        self.assertEqual(0, self._wait(self.index.build()))
+        self.assertEqual(everything[1:], self._search())
+
+    def test_updates(self):
+        path = ['', self.root, 'rga']
+        self._wait(self.index.addDataset(path, '00001 - RGA Scan', 'RGA Scan', ['Time', 'Pressure']))
+        self._wait(self.index.addParameters(path, '00001 - RGA Scan', [('Mass', 40), ('Trace', [1, 2])]))
+        self._wait(self.index.setTags(['', self.root], {'rga': {'vacuum'}}, {}))
+        self.assertEqual([(['rga'], '00001 - RGA Scan')], self._search(tags=['vacuum'], params=[('Mass', '<', '41')]))
+        # only scalar parameters are indexed
+        self.assertEqual([], self._search(params=[('Trace', '=', '1')]))
+        self._wait(self.index.setTags(['', self.root], {}, {}))
+        self.assertEqual([], self._search(tags=['vacuum']))
+
+    def test_session_updates(self):
+        self.store.search[self.root] = self.index
+        session = self.store.get(['', self.root])
+        dataset = session.newDataset('Wavemeter', ['Time [s]'], ['Frequency (397) [THz]'])
+        dataset.addParameter('Channel', 3)
+        session.updateTags(['good'], [], [dataset.name])
+        self.assertEqual([([], dataset.name)],
+                         self._search(title='wavemeter', variable='frequency', tags=['good'],
+                                      params=[('Channel', '=', '3')]))
+
+    def test_bad_operator(self):
+        with self.assertRaises(errors.BadSearchError):
+            self.index.search(params=[('Mass', '~', '40')])
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', '-s', __file__])
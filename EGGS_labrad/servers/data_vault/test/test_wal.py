@@ -0,0 +1,206 @@
+import gc
+import mock
+import os
+import pytest
+import queue
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from twisted.internet import task
+
+from datavault import SessionStore, backend, wal
+
+
+class _ThreadedClock(task.Clock):
+    """Clock that queues calls made from other threads until runPending is called."""
+
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.pending = queue.Queue()
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.pending.put((f, args, kwargs))
+
+    def runPending(self):
+        while not self.pending.empty():
+            f, args, kwargs = self.pending.get()
+            f(*args, **kwargs)
+
+
+class WriteAheadLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp(prefix='dvtest')
+        self.root = os.path.basename(self.datadir)
+        self.clock = _ThreadedClock()
+        self.store = SessionStore(self.datadir, mock.MagicMock())
+        self.log = wal.WriteAheadLog(self.datadir, reactor=self.clock)
+        self.store.wal[self.root] = self.log
+
+    def tearDown(self):
+        self.log.worker.drain()
+        shutil.rmtree(self.datadir)
+
+    def _wait(self, d):
+        """
+        Run pending commits, and return the result of d.
+        """
+        results = []
+        d.addBoth(results.append)
+        self.clock.advance(self.log.interval)
+        self.log.worker.stop()
+        self.log.worker.drain()
+        self.clock.runPending()
+        if hasattr(results[0], 'raiseException'):
+            results[0].raiseException()
+        return results[0]
+
+    def _newDataset(self):
+        session = self.store.get(['', self.root])
+        return session.newDataset('Scan', ['Time [s]'], ['Voltage (Ch0) [V]'])
+
+    def _segments(self):
+        return [path for _, path in wal.find_segments(self.datadir)]
+
+    def test_group_commit(self):
+        dataset = self._newDataset()
+        dataset.addArrays(np.array([[0., 1.], [1., 2.]]))
+        dataset.addParameter('Param1', 1.5)
+        dataset.addComment('user', 'comment')
+        # nothing is written until the commit interval has elapsed
+        self.assertEqual(0, self.log.commits)
+        self._wait(self.log.sync())
+        self.assertEqual(1, self.log.commits)
+
+        records = wal.read_records(self.log.segmentPath(self.log.segment))
+        self.assertEqual(['new', 'add', 'params', 'comment'], [record[0] for record in records])
+        op, path, name, (start, data) = records[1]
+        self.assertEqual((['', self.root], dataset.name, 0), (path, name, start))
+        self.assertEqual([0., 1.], list(data['f0']))
+        self.assertEqual(('comment', 0, 'user', 'comment'), (records[3][0],) + records[3][3])
+
+        # already synced
+        self.assertIsNone(self._wait(self.log.sync()))
+        self.assertEqual(1, self.log.commits)
+
+    def test_record_encoding(self):
+        # records are encoded explicitly rather than pickled
+        data = np.zeros(2, dtype=[('f0', '<f8'), ('f1', '<c16', (2,)), ('f2', object)])
+        data['f0'] = [0., 1.]
+        data['f1'] = [[1j, 2.], [3., 4j]]
+        data['f2'] = ['a', 'bc']
+        path = os.path.join(self.datadir, 'records.log')
+        with open(path, 'wb') as f:
+            f.write(wal.encode_record('new', ['', 'x'], 'name', ('Scan', [('t', [1], 'v', 's')],
+                                                                  [('v', 'ch0', [], 'v', 'V')], True, [])))
+            f.write(wal.encode_record('add', ['', 'x'], 'name', (3, data)))
+            f.write(wal.encode_record('add', ['', 'x'], 'name', (5, np.array([[0., 1.], [2., 3.]]))))
+            f.write(wal.encode_record('params', ['', 'x'], 'name', ([('p', 1.5), ('q', 'foo'), ('r', [1, 2])],)))
+            f.write(wal.encode_record('comment', ['', 'x'], 'name', (0, 'user', 'comment')))
+        new, add, add_array, params, comment = wal.read_records(path)
+        self.assertEqual(('new', ['', 'x'], 'name'), new[:3])
+        self.assertEqual(('Scan', [('t', [1], 'v', 's')], [('v', 'ch0', [], 'v', 'V')], True, []), new[3])
+        start, decoded = add[3]
+        self.assertEqual(3, start)
+        self.assertEqual(data.dtype.names, decoded.dtype.names)
+        for name in data.dtype.names:
+            self.assertEqual(data[name].tolist(), decoded[name].tolist())
+        self.assertEqual([[0., 1.], [2., 3.]], add_array[3][1].tolist())
+        self.assertEqual([('p', 1.5), ('q', 'foo'), ('r', [1, 2])],
+                         [(name, np.asarray(value).tolist()) for name, value in params[3][0]])
+        self.assertEqual((0, 'user', 'comment'), comment[3])
+
+    def test_run_logged(self):
+        dataset = self._newDataset()
+        results = []
+        dataset.runLogged(dataset.addParameter, 'Param1', 1.5).addCallback(results.append)
+        # the result is held back until the change is synced
+        self.assertEqual([], results)
+        self._wait(self.log.sync())
+        self.assertEqual(['Param1'], results)
+
+    def test_torn_record(self):
+        dataset = self._newDataset()
+        dataset.addParameter('Param1', 1.5)
+        self._wait(self.log.sync())
+        path = self.log.segmentPath(self.log.segment)
+        with open(path, 'ab') as f:
+            f.write(wal.encode_record('params', ['', self.root], dataset.name, ([('Param2', 2)],))[:-3])
+        self.assertEqual(['new', 'params'], [record[0] for record in wal.read_records(path)])
+
+    def test_rotate(self):
+        dataset = self._newDataset()
+        old = self._wait(self.log.rotate())
+        self.assertEqual(1, len(old))
+        dataset.addParameter('Param1', 1.5)
+        self._wait(self.log.sync())
+        self.assertEqual(['new'], [record[0] for record in wal.read_records(old[0])])
+        self.log.remove(old)
+        self.assertEqual([self.log.segmentPath(self.log.segment)], self._segments())
+        # segments of this run aren't replayed
+        self.assertEqual([], self.log.previousSegments())
+        self.assertEqual(self._segments(), wal.WriteAheadLog(self.datadir).previousSegments())
+
+    @mock.patch.dict(backend._file_pools, clear=True)
+    def test_sync_unreferenced_dataset(self):
+        # buffered rows are saved even if nothing references the dataset anymore
+        dataset = self._newDataset()
+        container = dataset.data
+        container.setWriteBuffer(max_rows=100, max_bytes=1 << 20, interval=60.)
+        dataset.addArrays(np.array([[0., 1.], [1., 2.]]))
+        self.assertEqual(2, container._buffer_rows)
+        del dataset
+        gc.collect()
+        self._wait(backend.get_file_pool().sync())
+        self.assertEqual(0, container._buffer_rows)
+        self.assertEqual([0., 1.], list(container.dataset[:2]['f0']))
+        container._file.close()
+
+    def _writeLoggedDataset(self):
+        dataset = self._newDataset()
+        dataset.addArrays(np.array([[0., 1.], [1., 2.]]))
+        dataset.addArrays(np.array([[2.], [3.]]))
+        dataset.addParameters([('Param1', 1.5), ('Param2', 'foo')])
+        dataset.addComment('user', 'comment')
+        self._wait(self.log.sync())
+        self.log.close()
+        dataset.data._file.close()
+        return dataset.name, dataset.data._file.open_args[0]
+
+    def _recover(self):
+        store = SessionStore(self.datadir, mock.MagicMock(), wal=True)
+        self.assertEqual(0, store.recover())
+        # replayed segments are removed
+        self.assertEqual([], self._segments())
+        return store.get(['', self.root]).openDataset(self.name)
+
+    def _checkDataset(self, dataset):
+        data, _ = dataset.getData(None, 0)
+        self.assertEqual([[0., 1.], [1., 2.], [2., 3.]], data.tolist())
+        self.assertEqual(['Param1', 'Param2'], dataset.getParamNames())
+        self.assertEqual(1, len(dataset.getComments(None, 0)[0]))
+
+    def test_replay_saved(self):
+        # changes that reached the file aren't applied again
+        self.name, filename = self._writeLoggedDataset()
+        self._checkDataset(self._recover())
+
+    def test_replay_lost_file(self):
+        # the dataset is created again from the log
+        self.name, filename = self._writeLoggedDataset()
+        os.remove(filename)
+        self._checkDataset(self._recover())
+
+    def test_replay_corrupt_file(self):
+        self.name, filename = self._writeLoggedDataset()
+        with open(filename, 'wb') as f:
+            f.write(b'\0' * 16)
+        self._checkDataset(self._recover())
+        self.assertTrue(os.path.exists(filename + '.corrupt'))
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', '-s', __file__])
@@ -0,0 +1,489 @@
+"""
+Write-ahead log of the changes made to the datasets in a data directory.
+
+Added rows, parameters and comments (and the creation of new datasets) are appended
+to a log file in the root of the data directory, and the log is fsynced in groups:
+all records appended within WAL_INTERVAL seconds of each other are written with a
+single write and fsync on a worker thread. Settings that change a dataset wait for
+their records to be synced (see Dataset.runLogged), so a change that has been
+acknowledged survives a crash even though the HDF5 files are only flushed every few
+minutes.
+
+The log is split into segments (write_ahead_<n>.log). The server starts a new segment
+before it saves all datasets, and removes the older segments once they are saved.
+Segments left by a crash are replayed into the datasets when the server next starts
+(see SessionStore.recover). Replay is idempotent: each record holds the row or comment
+position it was made at, so changes that did reach the file aren't applied twice.
+Records are encoded as LabRAD data, with added rows stored as raw column bytes and
+their dtype, so replay doesn't depend on the layout of Python classes (see encode_record).
+Replay the logs of a data directory by hand (with the data vault stopped) from the servers directory:
+    python -m data_vault.wal [--dry-run] datadir
+"""
+import os
+import re
+import sys
+import zlib
+import struct
+import argparse
+import threading
+
+import numpy as np
+
+from labrad import types as T
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+
+from . import backend
+from .backend import fsync_file
+
+# max time between appending a record and syncing it to disk
+WAL_INTERVAL = 0.001
+
+_SEGMENT_FORMAT = 'write_ahead_{:06d}.log'
+_re_segment = re.compile(r'^write_ahead_(\d+)\.log$')
+# payload length and crc32 of each record
+_HEADER = struct.Struct('<II')
+
+
+def find_segments(datadir):
+    """
+    Get the log segments in a data directory.
+    Returns:
+                (list(int, str)): the number and path of each segment, oldest first.
+    """
+    segments = []
+    for filename in os.listdir(datadir):
+        match = _re_segment.match(filename)
+        if match:
+            segments.append((int(match.group(1)), os.path.join(datadir, filename)))
+    return sorted(segments)
+
+
+def _flatten(data, t=None):
+    """
+    Flatten data to LabRAD bytes.
+    Returns:
+                (bytes, str): the bytes, and their type tag.
+    """
+    if hasattr(T, 'FlatData'):
+        # pylabrad 0.95+
+        flat_data = T.flatten(data, t)
+        return flat_data.bytes, str(flat_data.tag)
+    data_bytes, t = T.flatten(data, t)
+    return data_bytes, str(t)
+
+
+def _unflatten(data_bytes, t):
+    # ensure data_bytes is of type bytes
+    if type(data_bytes) == str:
+        data_bytes = data_bytes.encode()
+    return T.unflatten(data_bytes, t)
+
+
+def _encode_columns(data):
+    """
+    Encode added rows as a list of columns of (name, dtype, shape, bytes).
+        Numeric columns are stored as their raw bytes, and string (vlen) columns
+        as LabRAD string lists.
+    """
+    data = np.asarray(data)
+    names = data.dtype.names
+    columns = [(name, data[name]) for name in names] if names else [('', data)]
+    encoded = []
+    for name, column in columns:
+        if column.dtype.hasobject:
+            column_bytes, _ = _flatten([str(value) for value in column.ravel()], '*s')
+            encoded.append((name, 'str', list(column.shape), column_bytes))
+        else:
+            encoded.append((name, column.dtype.str, list(column.shape), np.ascontiguousarray(column).tobytes()))
+    return encoded
+
+
+def _decode_columns(encoded):
+    columns = []
+    for name, dtype, shape, column_bytes in encoded:
+        if dtype == 'str':
+            column = np.array(_unflatten(column_bytes, '*s'), dtype=object)
+        else:
+            column = np.frombuffer(column_bytes, dtype=np.dtype(dtype))
+        columns.append((name, column.reshape(shape)))
+    if len(columns) == 1 and not columns[0][0]:
+        return columns[0][1]
+    rows = columns[0][1].shape[0] if columns else 0
+    data = np.empty(rows, dtype=[(name, column.dtype, column.shape[1:]) for name, column in columns])
+    for name, column in columns:
+        data[name] = column
+    return data
+
+
+# record: operation, session path, dataset name, type tag of the arguments, and the flattened arguments
+_RECORD_TYPE = 's*sssy'
+# arguments of 'add': start row, and the columns (see _encode_columns)
+_ADD_TYPE = '(w*(ss*wy))'
+# arguments of 'params': the name, type tag and flattened value of each parameter
+_PARAMS_TYPE = '(*(ssy))'
+# arguments of 'new': title, independents, dependents, extended and storage options (see Dataset)
+_NEW_TYPES = {False: '(s*(ss)*(sss)b*(ss))', True: '(s*(s*wss)*(ss*wss)b*(ss))'}
+# arguments of 'comment': comment position, user and comment
+_COMMENT_TYPE = '(wss)'
+
+
+def encode_record(op, path, name, args):
+    """
+    Encode a record as LabRAD data (plus raw array bytes for added rows), with a length and crc32 header.
+    """
+    if op == 'add':
+        start, data = args
+        args_bytes, t = _flatten((start, _encode_columns(data)), _ADD_TYPE)
+    elif op == 'params':
+        params = [(param,) + _flatten(value)[::-1] for param, value in args[0]]
+        args_bytes, t = _flatten((params,), _PARAMS_TYPE)
+    elif op == 'new':
+        args_bytes, t = _flatten(tuple(args), _NEW_TYPES[bool(args[3])])
+    else:
+        args_bytes, t = _flatten(tuple(args), _COMMENT_TYPE)
+    payload, _ = _flatten((op, list(path), name, t, args_bytes), _RECORD_TYPE)
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_record(payload):
+    """
+    Decode the payload of a record.
+    Returns:
+                (str, list(str), str, tuple): the operation, session path, dataset name and arguments.
+    """
+    op, path, name, t, args_bytes = _unflatten(payload, _RECORD_TYPE)
+    args = _unflatten(args_bytes, t)
+    if op == 'add':
+        start, columns = args
+        args = (start, _decode_columns(columns))
+    elif op == 'params':
+        args = ([(param, _unflatten(value_bytes, value_t)) for param, value_t, value_bytes in args[0]],)
+    elif op == 'new' and args[3]:
+        # shapes of extended variables are unflattened as arrays
+        title, independents, dependents, extended, storage = args
+        independents = [(label, [int(n) for n in shape], datatype, unit)
+                        for label, shape, datatype, unit in independents]
+        dependents = [(label, legend, [int(n) for n in shape], datatype, unit)
+                      for label, legend, shape, datatype, unit in dependents]
+        args = (title, independents, dependents, extended, storage)
+    return op, list(path), name, tuple(args)
+
+
+def read_records(filename):
+    """
+    Read the records of a log segment.
+        Stops at the first incomplete or corrupt record, which is where
+        the last write before a crash was cut off.
+    Returns:
+                (list(str, list(str), str, tuple)): the operation, session path, dataset name and arguments of each record.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    records = []
+    pos = 0
+    while pos + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, pos)
+        payload = data[pos + _HEADER.size: pos + _HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        records.append(decode_record(payload))
+        pos += _HEADER.size + length
+    return records
+
+
+class WriteAheadLog(object):
+    """
+    Append-only log of the changes made to the datasets in a data directory.
+
+    Records may be appended from any thread; they are written and synced
+    on a FileWorker thread, at most interval seconds after they are appended.
+    All other methods are called in the reactor thread.
+    Segments left by a previous run are never written to or removed; they
+    are replayed by SessionStore.recover.
+    """
+
+    def __init__(self, datadir, interval=WAL_INTERVAL, reactor=reactor):
+        self.dir = datadir
+        self.interval = interval
+        self.reactor = reactor
+        self.worker = backend.FileWorker('write-ahead log', reactor)
+        self._lock = threading.Lock()
+        # encoded records that haven't been written, and the number of records appended and synced
+        self._records = []
+        self._appended = 0
+        self._synced = 0
+        # (record number, Deferred) waiting for records to be synced
+        self._waiting = []
+        self._commitCall = None
+        self._writing = False
+        self._file = None
+        existing = find_segments(datadir)
+        self.segment = self._first = existing[-1][0] + 1 if existing else 1
+        # number of writes (each followed by an fsync)
+        self.commits = 0
+
+    def segmentPath(self, segment):
+        return os.path.join(self.dir, _SEGMENT_FORMAT.format(segment))
+
+    def previousSegments(self):
+        """
+        Get the paths of the segments left by a previous run.
+        """
+        return [path for segment, path in find_segments(self.dir) if segment < self._first]
+
+    def append(self, op, path, name, *args):
+        """
+        Append a record to the log.
+            May be called from any thread.
+        Arguments:
+            op      (str): the operation ('new', 'add', 'params', or 'comment').
+            path    (list(str)): the path of the session of the dataset.
+            name    (str): the name of the dataset.
+            args:   the arguments of the operation (see replay).
+        Returns:
+                    (bool): whether a commit needs to be scheduled with commitSoon.
+        """
+        record = encode_record(op, path, name, args)
+        with self._lock:
+            self._records.append(record)
+            self._appended += 1
+            return len(self._records) == 1
+
+    def commitSoon(self):
+        """
+        Write the appended records once the commit interval has elapsed.
+            Records appended while a write is in progress are written together once it finishes.
+        """
+        if self._commitCall is None and not self._writing:
+            self._commitCall = self.reactor.callLater(self.interval, self._commit)
+
+    def sync(self):
+        """
+        Wait for all records appended so far to be synced to disk.
+        Returns:
+            Deferred: fires once the records are synced.
+        """
+        with self._lock:
+            target = self._appended
+        if target <= self._synced:
+            return succeed(None)
+        d = Deferred()
+        self._waiting.append((target, d))
+        self.commitSoon()
+        return d
+
+    def _commit(self):
+        self._commitCall = None
+        with self._lock:
+            records, self._records = self._records, []
+            last = self._appended
+        if not records:
+            return
+        self._writing = True
+        d = self.worker.submit(self._write, self.segment, records)
+        d.addCallbacks(self._committed, self._failed, callbackArgs=(last,))
+        d.addBoth(self._written)
+
+    def _write(self, segment, records):
+        if self._file is None:
+            self._file = open(self.segmentPath(segment), 'ab')
+        self._file.write(b''.join(records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.commits += 1
+
+    def _committed(self, _, last):
+        self._synced = max(self._synced, last)
+        waiting, self._waiting = self._waiting, []
+        for target, d in waiting:
+            if target <= self._synced:
+                d.callback(None)
+            else:
+                self._waiting.append((target, d))
+
+    def _failed(self, failure):
+        print('write-ahead log of {} failed: {}'.format(self.dir, failure.getErrorMessage()))
+        waiting, self._waiting = self._waiting, []
+        for _, d in waiting:
+            d.errback(failure)
+
+    def _written(self, _):
+        self._writing = False
+        with self._lock:
+            pending = bool(self._records)
+        if pending:
+            self.commitSoon()
+
+    def rotate(self):
+        """
+        Start a new segment.
+            Records appended before this call are written to the old segments,
+            so once the datasets have been saved the old segments can be removed.
+        Returns:
+            Deferred: fires with the paths of the old segments of this run once they are closed.
+        """
+        if self._commitCall is not None:
+            self._commitCall.cancel()
+        self._commit()
+        self.segment += 1
+        return self.worker.submit(self._rotate)
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return [path for segment, path in find_segments(self.dir) if self._first <= segment < self.segment]
+
+    def remove(self, segments):
+        """
+        Remove old segments once the changes in them have been saved.
+        """
+        for path in segments:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        Write any remaining records and close the log (e.g. on shutdown).
+            Waits for the write to finish, so may be called when the reactor isn't running.
+            The segments are kept, and replayed when the server starts again.
+        """
+        if self._commitCall is not None:
+            self._commitCall.cancel()
+            self._commitCall = None
+        with self._lock:
+            records, self._records = self._records, []
+        if records:
+            self.worker.submit(self._write, self.segment, records)
+        self.worker.submit(self._rotate)
+        self.worker.drain()
+
+
+class _NoHub(object):
+    """Stands in for the server when logs are replayed without one; signals are dropped."""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def replay(session_store, segments):
+    """
+    Apply the records of log segments to the datasets they were made on.
+        Changes that are already in a dataset (because its file was saved before
+        the crash) are skipped. Datasets whose files are missing or can't be read
+        are created again from their 'new' record (unreadable files are kept with
+        a .corrupt suffix). The datasets are saved and closed at the end.
+    Arguments:
+        session_store   (SessionStore): a session store of the data directory, without a write-ahead log.
+        segments        (list(str)): the paths of the segments, oldest first.
+    Returns:
+                        (int, int): the number of records applied, and the number that couldn't be applied.
+    """
+    # imported here since the package imports this module
+    from . import Dataset, filename_encode
+    datasets = {}
+    applied = failed = 0
+
+    def openDataset(path, name, new_args=None):
+        key = (tuple(path), name)
+        if key in datasets:
+            return datasets[key]
+        session = session_store.get(path)
+        file_base = os.path.join(session.dir, filename_encode(name))
+        dataset = None
+        if os.path.exists(file_base + '.hdf5') or os.path.exists(file_base + '.csv'):
+            try:
+                dataset = Dataset(session, name)
+            except Exception:
+                if new_args is None:
+                    raise
+                os.replace(file_base + '.hdf5', file_base + '.hdf5.corrupt')
+        if dataset is None and new_args is not None:
+            title, independents, dependents, extended, storage = new_args
+            dataset = Dataset(session, name, title, create=True, independents=independents,
+                              dependents=dependents, extended=extended, storage=storage)
+            # don't reuse the number of the dataset for a new one
+            session.counter = max(session.counter, int(name[:5]) + 1)
+            session.save()
+        if dataset is None:
+            raise IOError('dataset file not found')
+        datasets[key] = dataset
+        return dataset
+
+    for segment in segments:
+        for op, path, name, args in read_records(segment):
+            try:
+                dataset = openDataset(path, name, args if op == 'new' else None)
+                if op == 'add':
+                    start, data = args
+                    rows = dataset._rowCount()
+                    if rows < start + len(data):
+                        dataset.addData(data[max(rows - start, 0):])
+                elif op == 'params':
+                    names = set(dataset.getParamNames())
+                    params = [(param, value) for param, value in args[0] if param not in names]
+                    if params:
+                        dataset.addParameters(params)
+                elif op == 'comment':
+                    pos, user, comment = args
+                    if dataset.data.numComments() <= pos:
+                        dataset.addComment(user, comment)
+                applied += 1
+            except Exception as e:
+                print('unable to replay {} of {}/{}: {}'.format(op, '/'.join(path[1:]), name, e))
+                failed += 1
+
+    # save and close the files
+    for dataset in datasets.values():
+        datafile = getattr(dataset.data, '_file', None)
+        if datafile is not None and hasattr(datafile, 'close'):
+            filename = datafile.open_args[0]
+            datafile.close()
+            fsync_file(filename)
+    return applied, failed
+
+
+def recover(datadir, segments=None):
+    """
+    Replay the log segments of a data directory, and remove them if they were all applied.
+        Datasets are opened with their own session store, so no signals are sent;
+        call before the data vault serves any requests.
+    Arguments:
+        datadir     (str): the root of the data vault directory tree.
+        segments    (list(str)): the paths of the segments (defaults to all the segments in datadir).
+    Returns:
+                    (int, int): the number of records applied, and the number that couldn't be applied.
+    """
+    # imported here since the package imports this module
+    from . import SessionStore
+    if segments is None:
+        segments = [path for _, path in find_segments(datadir)]
+    if not segments:
+        return 0, 0
+    applied, failed = replay(SessionStore(os.path.abspath(datadir), _NoHub()), segments)
+    print('replayed {:d} records from {:d} log segments in {} ({:d} failed)'.format(
+        applied, len(segments), datadir, failed))
+    if not failed:
+        for path in segments:
+            os.remove(path)
+    return applied, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay the write-ahead logs of a data vault directory.')
+    parser.add_argument('datadir', help='root of the data vault directory tree')
+    parser.add_argument('--dry-run', action='store_true', help='only count the records in the logs')
+    args = parser.parse_args(argv)
+    if args.dry_run:
+        for _, path in find_segments(args.datadir):
+            print('{}: {:d} records'.format(path, len(read_records(path))))
+        return 0
+    applied, failed = recover(args.datadir)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
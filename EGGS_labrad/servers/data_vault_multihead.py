@@ -205,7 +205,9 @@ class DataVaultServiceHost(MultiService):
         self.path = path
         self.managers = managers
         self.servers = set()
-        self.session_store = SessionStore(path, self)
+        self.session_store = SessionStore(path, self, wal=True)
+        # apply changes that were logged but not saved before the last shutdown
+        self.session_store.recover()
         for signal in self.signals:
             self.wrapSignal(signal)
         for host, port, password in managers:
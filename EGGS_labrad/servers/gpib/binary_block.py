@@ -0,0 +1,93 @@
+"""
+Reads IEEE-488.2 binary blocks (e.g. traces and waveforms) from VISA resources.
+
+A definite-length block is sent as #<N><length><data>, where N is the number of digits
+of length, which is the number of bytes of data. The block is read into a preallocated
+array in chunks, instead of being read as a single byte string and parsed as text.
+"""
+import numpy as np
+
+__all__ = ["DTYPES", "CHUNK_SIZE", "BinaryBlockError", "read_binary_block", "query_binary_block",
+           "to_labrad"]
+
+# data types of blocks, by name
+DTYPES = {'int8': 'i1', 'int16': 'i2', 'int32': 'i4', 'float32': 'f4', 'float64': 'f8'}
+# max number of bytes read from the resource at once
+CHUNK_SIZE = 1 << 20
+
+
+class BinaryBlockError(Exception):
+    """
+    The device didn't send a valid binary block.
+    """
+
+
+def _dtype(dtype, big_endian):
+    if dtype not in DTYPES:
+        raise ValueError('Invalid data type: {}. Must be one of: {}'.format(dtype, sorted(DTYPES)))
+    return np.dtype(DTYPES[dtype]).newbyteorder('>' if big_endian else '<')
+
+
+def read_binary_block(resource, dtype='float32', big_endian=False, termination=True):
+    """
+    Read a binary block from a resource.
+    Arguments:
+        resource    (pyvisa.Resource): the resource.
+        dtype       (str): the data type of the values. Must be one of DTYPES.
+        big_endian  (bool): whether the values are big-endian.
+        termination (bool): whether the device sends a termination character after the block.
+    Returns:
+                    (np.ndarray): the values.
+    """
+    dtype = _dtype(dtype, big_endian)
+    header = resource.read_bytes(2)
+    if header[:1] != b'#' or not header[1:2].isdigit():
+        raise BinaryBlockError('Invalid block header: {}'.format(header))
+    num_digits = int(header[1:2])
+    if num_digits == 0:
+        # indefinite-length block: the data ends with a newline sent with END.
+        # binary data can contain the termination character, so read until END instead
+        read_termination = resource.read_termination
+        resource.read_termination = ''
+        try:
+            data = resource.read_raw()
+        finally:
+            resource.read_termination = read_termination
+        term = (read_termination or '\n').encode()
+        if data.endswith(term):
+            data = data[:-len(term)]
+        if len(data) % dtype.itemsize:
+            raise BinaryBlockError('Block length ({:d} bytes) is not a multiple of the size of {}.'.format(len(data), dtype))
+        return np.frombuffer(data, dtype)
+    length = int(resource.read_bytes(num_digits))
+    if length % dtype.itemsize:
+        raise BinaryBlockError('Block length ({:d} bytes) is not a multiple of the size of {}.'.format(length, dtype))
+    block = np.empty(length // dtype.itemsize, dtype)
+    buf = block.view(np.uint8)
+    pos = 0
+    while pos < length:
+        chunk = resource.read_bytes(min(CHUNK_SIZE, length - pos))
+        buf[pos:pos + len(chunk)] = np.frombuffer(chunk, np.uint8)
+        pos += len(chunk)
+    if termination:
+        resource.read_bytes(len(resource.read_termination or '\n'))
+    return block
+
+
+def query_binary_block(resource, data, dtype='float32', big_endian=False, termination=True):
+    """
+    Write a query to a resource, and read the binary block it answers with.
+        Arguments are the same as read_binary_block.
+    """
+    resource.write(data)
+    return read_binary_block(resource, dtype, big_endian, termination)
+
+
+def to_labrad(block):
+    """
+    Convert values to a type that can be sent over LabRAD.
+        Integers are sent as int32, and floats as float64, in native byte order.
+    """
+    if block.dtype.kind == 'f':
+        return block.astype(np.float64)
+    return block.astype(np.int32)
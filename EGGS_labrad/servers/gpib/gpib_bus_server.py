@@ -44,12 +44,21 @@
 # 2022 December 28 - Clayton Ho (updated to 1.5.4)
 # Fixed error handling in _refreshDevices; bus server now works nearly perfectly.
 #
+# 2026 October 17 (updated to 1.6.0)
+# Moved all VISA I/O off the reactor thread: each device gets an InstrumentWorker thread
+# that runs its requests in order, so a slow device no longer blocks requests to the others.
+# Settings now return Deferreds, and _refreshDevices lists and opens resources on threads.
+#
+# 2026 October 17
+# Added query_binary_block, and its chunked variant, which parse IEEE-488.2 binary blocks on the
+# server and return them as numeric arrays.
+#
 
 """
 ### BEGIN NODE INFO
 [info]
 name = GPIB Bus
-version = 1.5.4
+version = 1.6.0
 description = Gives access to GPIB devices via pyvisa.
 instancename = %LABRADNODE% GPIB Bus
 
@@ -66,7 +75,12 @@ import pyvisa as visa
 from labrad.units import WithUnit
 from labrad.server import setting
 from labrad.errors import DeviceNotSelectedError
+from twisted.internet.threads import deferToThread
+from twisted.internet.defer import inlineCallbacks, returnValue, DeferredList, DeferredLock
+
 from EGGS_labrad.servers import PollingServer
+from EGGS_labrad.servers.gpib.instrument_worker import InstrumentWorker
+from EGGS_labrad.servers.gpib.binary_block import DTYPES, query_binary_block, to_labrad
 
 KNOWN_DEVICE_TYPES = ('GPIB', 'USB')
 
@@ -87,28 +101,31 @@ class GPIBBusServer(PollingServer):
     # GENERAL
     def initServer(self):
         super().initServer()
+        # workers that run the I/O of each device, by address
         self.devices = {}
+        # keeps refreshes (e.g. from polling and refresh_devices) from overlapping
+        self.refresh_lock = DeferredLock()
         # tmp remove
         #self.rm = visa.ResourceManager()
         # tmp remove close
         self._refreshDevices()
 
+    @inlineCallbacks
     def stopServer(self):
         """
         Close all open devices.
         """
-        for dev in self.devices.values():
-            try:
-                dev.close()
-            except Exception as e:
-                print("Error on closing: {}".format(e))
+        results = yield DeferredList([dev.close() for dev in self.devices.values()], consumeErrors=True)
+        for success, result in results:
+            if not success:
+                print("Error on closing: {}".format(result.value))
 
     def initContext(self, c):
         # todo: do I have to call parent's initContext to add c to listeners?
         c['timeout'] = self.defaultTimeout
 
     def _poll(self):
-        self._refreshDevices()
+        return self._refreshDevices()
 
     def _poll_fail(self, failure):
         print('Polling failed.')
@@ -119,7 +136,7 @@ class GPIBBusServer(PollingServer):
     '''
     def getDevice(self, c):
         """
-        Returns the GPIB device stored within the given context, if any.
+        Returns the worker of the GPIB device stored within the given context, if any.
         """
         if 'addr' not in c:
             raise DeviceNotSelectedError("No GPIB address selected.")
@@ -133,50 +150,54 @@ class GPIBBusServer(PollingServer):
         Refresh the list of known devices on this bus.
         Currently supported are GPIB devices and GPIB over USB.
         """
-        try:
-            rm = visa.ResourceManager()
+        return self.refresh_lock.run(self._refresh)
 
-            # get only desired device names
-            addresses = set([
-                str(addr)
-                for addr in rm.list_resources()
-                if addr.startswith(KNOWN_DEVICE_TYPES)
-            ])
+    @staticmethod
+    def _listResources():
+        """
+        Get the resource manager, and the addresses of the desired devices (called on a thread).
+        """
+        rm = visa.ResourceManager()
+        # get only desired device names
+        addresses = set([
+            str(addr)
+            for addr in rm.list_resources()
+            if addr.startswith(KNOWN_DEVICE_TYPES)
+        ])
+        return rm, addresses
+
+    @inlineCallbacks
+    def _refresh(self):
+        try:
+            rm, addresses = yield deferToThread(self._listResources)
 
             # get additions and deletions
             additions = addresses - set(self.devices.keys())
             deletions = set(self.devices.keys()) - addresses
 
             # process newly connected devices
-            for addr in additions:
-                try:
-                    instr = rm.open_resource(addr)
-
-                    # set up device communication
-                    instr.timeout = self.defaultTimeout['ms']
-                    instr.query_delay = 0.01
-                    # todo: why do we set termination like this? maybe b/c we want to figure out termination ourselves?
-                    instr.write_termination = ''
-                    if addr.endswith('SOCKET'):
-                        instr.write_termination = '\n'
-                    instr.clear()
-
+            # each device is opened (and cleared) on its own worker, so they're opened concurrently
+            workers = [InstrumentWorker(addr) for addr in sorted(additions)]
+            # todo: why do we set termination like this? maybe b/c we want to figure out termination ourselves?
+            results = yield DeferredList([
+                worker.open(rm, self.defaultTimeout['s'], query_delay=0.01,
+                            write_termination='\n' if worker.address.endswith('SOCKET') else '')
+                for worker in workers
+            ], consumeErrors=True)
+            for worker, (success, result) in zip(workers, results):
+                if success:
                     # recognize device and let listeners know
-                    self.devices[addr] = instr
-                    self.sendDeviceMessage('GPIB Device Connect', addr)
-
-                except Exception as e:
-                    print('Failed to add {}'.format(addr))
-                    print('\tError: {}'.format(e))
-
-                    # ensure problematic device is removed from self.devices
-                    if addr in self.devices:
-                        del self.devices[addr]
+                    self.devices[worker.address] = worker
+                    self.sendDeviceMessage('GPIB Device Connect', worker.address)
+                else:
+                    print('Failed to add {}'.format(worker.address))
+                    print('\tError: {}'.format(result.value))
+                    # ensure problematic device is removed
+                    worker.close()
 
             # process disconnected devices
             for addr in deletions:
-                self.devices[addr].close()
-                del self.devices[addr]
+                self.devices.pop(addr).close()
                 self.sendDeviceMessage('GPIB Device Disconnect', addr)
 
         except Exception as e:
@@ -215,23 +236,26 @@ class GPIBBusServer(PollingServer):
         """
         Get or set the GPIB timeout.
         """
+        instr = self.getDevice(c)
         if time is not None:
-            self.getDevice(c).timeout = time['ms']
-        return WithUnit(self.getDevice(c).timeout / 1000.0, 's')
+            yield instr.setTimeout(time['s'])
+        returnValue(WithUnit(instr.timeout, 's'))
 
     @setting(3, data='s', returns='')
     def write(self, c, data):
         """
         Write a string to the GPIB bus.
         """
-        self.getDevice(c).write(data)
+        instr = self.getDevice(c)
+        yield instr.submit(instr.resource.write, data)
 
     @setting(8, data='y', returns='')
     def write_raw(self, c, data):
         """
         Write a raw string to the GPIB bus.
         """
-        self.getDevice(c).write_raw(data)
+        instr = self.getDevice(c)
+        yield instr.submit(instr.resource.write_raw, data)
 
     @setting(4, returns='s')
     def read(self, c):
@@ -242,8 +266,9 @@ class GPIBBusServer(PollingServer):
         This includes any bytes corresponding to termination in
         binary data.
         """
-        ans = self.getDevice(c).read()
-        return ans.strip()
+        instr = self.getDevice(c)
+        ans = yield instr.submit(instr.resource.read)
+        returnValue(ans.strip())
 
     @setting(6, n_bytes='w', returns='y')
     def read_raw(self, c, n_bytes=None):
@@ -254,13 +279,12 @@ class GPIBBusServer(PollingServer):
         If n_bytes is specified, reads only that many bytes.
         Otherwise, reads until the device stops sending.
         """
-        ans = None
         instr = self.getDevice(c)
         if n_bytes is None:
-            ans = instr.read_raw()
+            ans = yield instr.submit(instr.resource.read_raw)
         else:
-            ans = instr.read_raw(n_bytes)
-        return bytes(ans)
+            ans = yield instr.submit(instr.resource.read_raw, n_bytes)
+        returnValue(bytes(ans))
 
     @setting(7, data='s', returns='s')
     def query(self, c, data):
@@ -270,8 +294,68 @@ class GPIBBusServer(PollingServer):
         This query is atomic. No other communication to the
         device will occur while the query is in progress.
         """
-        ans = self.getDevice(c).query(data)
-        return ans.strip()
+        instr = self.getDevice(c)
+        ans = yield instr.submit(instr.resource.query, data)
+        returnValue(ans.strip())
+
+    @setting(9, data='s', dtype='s', big_endian='b', termination='b', returns=['*v', '*i'])
+    def query_binary_block(self, c, data, dtype='float32', big_endian=False, termination=True):
+        """
+        Make a GPIB query that returns an IEEE-488.2 binary block (e.g. a trace in REAL,32 format),
+        and return its values.
+
+        The block is read into a preallocated array on the server, so the data isn't parsed as text.
+        Integers are returned as int32 values, and floats as float64 values.
+        For large blocks, use query_binary_block_chunked.
+        Arguments:
+            data        (str)   : the query.
+            dtype       (str)   : the data type of the values: one of int8, int16, int32, float32, float64.
+            big_endian  (bool)  : whether the values are big-endian.
+            termination (bool)  : whether the device sends a termination character after the block.
+        Returns:
+                        (*v, *i): the values.
+        """
+        if dtype not in DTYPES:
+            raise Exception('Error: invalid data type. Must be one of: {}'.format(sorted(DTYPES)))
+        instr = self.getDevice(c)
+        block = yield instr.submit(query_binary_block, instr.resource, data, dtype, big_endian, termination)
+        returnValue(to_labrad(block))
+
+    @setting(10, data='s', dtype='s', big_endian='b', termination='b', returns='w')
+    def query_binary_block_chunked(self, c, data, dtype='float32', big_endian=False, termination=True):
+        """
+        Make a GPIB query that returns an IEEE-488.2 binary block, and hold its values in
+        the current context, to be returned in chunks by read_binary_block.
+
+        Use this instead of query_binary_block for blocks too large to be sent in a single LabRAD
+        message (or that would block the connection for too long).
+        Arguments are the same as query_binary_block.
+        Returns:
+            (int): the number of values.
+        """
+        if dtype not in DTYPES:
+            raise Exception('Error: invalid data type. Must be one of: {}'.format(sorted(DTYPES)))
+        instr = self.getDevice(c)
+        c['block'] = None
+        block = yield instr.submit(query_binary_block, instr.resource, data, dtype, big_endian, termination)
+        c['block'] = (block, 0)
+        returnValue(len(block))
+
+    @setting(11, count='w', returns=['*v', '*i'])
+    def read_binary_block(self, c, count):
+        """
+        Return the next values of the block read by query_binary_block_chunked.
+        Arguments:
+            count   (int)   : the max number of values to return.
+        Returns:
+                    (*v, *i): the values (empty once all values have been returned).
+        """
+        if not c.get('block'):
+            raise Exception('Error: no binary block. Use query_binary_block_chunked first.')
+        block, pos = c['block']
+        chunk = block[pos:pos + count]
+        c['block'] = (block, pos + len(chunk))
+        return to_labrad(chunk)
 
     @setting(20, returns='*s')
     def list_devices(self, c):
@@ -285,7 +369,7 @@ class GPIBBusServer(PollingServer):
         """
         Manually refresh devices.
         """
-        self._refreshDevices()
+        yield self._refreshDevices()
 
 
 __server__ = GPIBBusServer()
@@ -0,0 +1,113 @@
+"""
+Runs VISA I/O for GPIB instruments off the reactor thread.
+
+Each instrument gets an InstrumentWorker: a thread that runs the instrument's calls
+in the order they were submitted, so a slow transfer from one instrument (e.g. an
+oscilloscope waveform) only delays requests to that instrument, and independent
+instruments run concurrently.
+"""
+import queue
+import threading
+
+from twisted.python import failure
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+
+__all__ = ["InstrumentWorker"]
+
+
+class InstrumentWorker(object):
+    """
+    Runs all calls to a single VISA resource, in order, on a dedicated thread.
+
+    Calls are submitted from the reactor thread and return Deferreds that fire
+    in the reactor thread.
+    """
+
+    def __init__(self, address, reactor=reactor):
+        self.address = address
+        self.reactor = reactor
+        # the VISA resource (set once it has been opened)
+        self.resource = None
+        # the resource's timeout, in seconds (kept here so it can be read without a call to the resource)
+        self.timeout = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='InstrumentWorker: {}'.format(address), daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        """
+        Get the number of calls waiting to run.
+        """
+        return self._queue.qsize()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) on the worker thread.
+        Returns:
+            Deferred: fires in the reactor thread with the result of the call.
+        """
+        d = Deferred()
+        self._queue.put((d, func, args, kwargs))
+        return d
+
+    def _run(self):
+        while True:
+            call = self._queue.get()
+            if call is None:
+                return
+            d, func, args, kwargs = call
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                self.reactor.callFromThread(d.errback, failure.Failure())
+            else:
+                self.reactor.callFromThread(d.callback, result)
+
+    def open(self, resource_manager, timeout, query_delay=0.01, write_termination=''):
+        """
+        Open and clear the resource.
+        Arguments:
+            resource_manager    (visa.ResourceManager): the resource manager.
+            timeout             (float): the resource's timeout, in seconds.
+        Returns:
+            Deferred: fires once the resource is open.
+        """
+        def _open():
+            resource = resource_manager.open_resource(self.address)
+            try:
+                resource.timeout = timeout * 1e3
+                resource.query_delay = query_delay
+                resource.write_termination = write_termination
+                resource.clear()
+            except Exception:
+                resource.close()
+                raise
+            self.resource, self.timeout = resource, timeout
+        return self.submit(_open)
+
+    def setTimeout(self, timeout):
+        """
+        Set the resource's timeout.
+        Arguments:
+            timeout (float): the timeout, in seconds.
+        Returns:
+            Deferred: fires once the timeout is set (after any calls before it).
+        """
+        def _setTimeout():
+            self.resource.timeout = timeout * 1e3
+            self.timeout = timeout
+        return self.submit(_setTimeout)
+
+    def close(self):
+        """
+        Close the resource (after any pending calls), and stop the thread.
+        Returns:
+            Deferred: fires once the resource is closed.
+        """
+        def _close():
+            if self.resource is not None:
+                self.resource.close()
+        d = self.submit(_close)
+        self._queue.put(None)
+        return d
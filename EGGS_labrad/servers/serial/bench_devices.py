@@ -0,0 +1,104 @@
+"""
+Load test of serial device servers' queries against simulated devices (Linux only).
+
+Each server's typical queries (mostly those of its polling loop) are sent to a simulated
+device, one after another, and their replies read back as the Serial Server does (from
+a SerialReader, as in its Transaction setting). Each server is run with its device at
+the server's baudrate, and without any baudrate emulation, which shows how much of
+each query is spent on the line.
+Run from the repository root:
+    python -m EGGS_labrad.servers.serial.bench_devices [queries] [device latency (ms)]
+"""
+import sys
+import time
+
+from serial import Serial
+from twisted.internet import defer, task
+
+from EGGS_labrad.servers.serial.serial_reader import SerialReader
+from EGGS_labrad.servers.serial.simulated_device import DEVICES, TwisTorr74Device
+
+
+def _twistorr_query(window):
+    return [(TwisTorr74Device.frame(window + TwisTorr74Device.READ), 0, TwisTorr74Device.ETX), (b'', 2, None)]
+
+
+# server name, device model, baudrate, and queries (each a list of (data, count, delimiter) steps)
+SERVERS = [
+    ('RGA Server', 'rga', 28800, [
+        [(b'ER?\r', 0, b'\r')],
+        [(b'SP?\r', 0, b'\r')],
+        [(b'TP?\r', 4, None)],
+        [(b'HS1\r', 4 * 66, None)],
+    ]),
+    ('DC Server', 'dc', 38400, [
+        [(b'HVin.r\r\n', 0, b'\n'), (b'', 0, b'\n')],
+        [(b'vout.r 1\r\n', 0, b'\n')],
+        [(b'vf.w 1 10.0\r\n', 0, b'\n')],
+    ]),
+    ('TwisTorr74 Server', 'twistorr74', 9600, [
+        _twistorr_query(b'224'),
+        _twistorr_query(b'202'),
+        _twistorr_query(b'120'),
+    ]),
+    ('Lakeshore336 Server', 'lakeshore336', 57600, [
+        [(b'KRDG? 0\r\n', 0, b'\n')],
+        [(b'RANGE? 1\r\n', 0, b'\n')],
+    ]),
+]
+
+
+@defer.inlineCallbacks
+def run_server(model, baudrate, queries, num_queries, latency):
+    """
+    Send a server's queries to a simulated device, and read back the replies.
+    Returns:
+        (float, float, float, int): queries per second, median and 99th percentile latency (in ms),
+                                        and the number of device errors.
+    """
+    device = DEVICES[model](baudrate, latency).start()
+    ser = Serial(device.path, timeout=0)
+    reader = SerialReader(ser)
+    reader.start()
+    try:
+        latencies = []
+        t_start = time.perf_counter()
+        for i in range(num_queries):
+            t_query = time.perf_counter()
+            for data, count, delim in queries[i % len(queries)]:
+                if data:
+                    ser.write(data)
+                if delim:
+                    resp = yield reader.readUntil(delim, 5)
+                else:
+                    resp = yield reader.read(count, 5)
+                    assert len(resp) == count
+            latencies.append(time.perf_counter() - t_query)
+        rate = num_queries / (time.perf_counter() - t_start)
+    finally:
+        reader.stop()
+        ser.close()
+        device.close()
+    latencies.sort()
+    defer.returnValue((rate, 1e3 * latencies[len(latencies) // 2],
+                       1e3 * latencies[int(len(latencies) * 0.99)], len(device.errors)))
+
+
+@defer.inlineCallbacks
+def run(reactor, num_queries, latency):
+    print('{:d} queries per server, {:.1f} ms device latency\n'.format(num_queries, latency * 1e3))
+    print('{:<22s}{:>10s}{:>12s}{:>14s}{:>12s}{:>8s}'.format('server', 'baudrate', 'queries/s', 'median (ms)',
+                                                            'p99 (ms)', 'errors'))
+    for name, model, baudrate, queries in SERVERS:
+        for line_rate in (baudrate, None):
+            rate, median, p99, errors = yield run_server(model, line_rate, queries, num_queries, latency)
+            print('{:<22s}{:>10s}{:>12.0f}{:>14.3f}{:>12.3f}{:>8d}'.format(name, str(line_rate or '-'), rate,
+                                                                           median, p99, errors))
+
+
+def main(num_queries=500, latency_ms=0):
+    task.react(run, (num_queries, latency_ms / 1e3))
+
+
+if __name__ == '__main__':
+    main(*[float(arg) if i else int(arg) for i, arg in enumerate(sys.argv[1:3])])
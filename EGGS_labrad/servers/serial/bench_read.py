@@ -0,0 +1,164 @@
+"""
+Benchmark of Serial Server reads against a fake device on a pseudo-terminal (Linux only).
+
+The fake device answers each query line with a reply line, and each bulk request
+with a block of bytes. Each query is written to the port and its reply read back
+with read_line (or read(count) for the bulk requests), as the Serial Server does, using:
+    polling:    the previous reader, which polls the port on a thread-pool thread,
+                sleeping 1 ms between attempts, and reads lines one byte at a time.
+    buffered:   SerialReader, whose thread blocks in the port's read call and fills
+                a ring buffer that reads are served from.
+Run from the repository root:
+    python -m EGGS_labrad.servers.serial.bench_read [queries] [reply bytes]
+"""
+import os
+import sys
+import time
+import threading
+
+from serial import Serial
+from twisted.internet import defer, task, threads
+
+from EGGS_labrad.servers.serial.serial_reader import SerialReader
+
+BULK_SIZE = 65536
+
+
+class FakeDevice(object):
+    """
+    Answers queries on the master side of a pseudo-terminal.
+        b'Q\\n' is answered with a reply line, and b'B\\n' with BULK_SIZE bytes.
+    """
+
+    def __init__(self, reply_size):
+        self.master, slave = os.openpty()
+        self.path = os.ttyname(slave)
+        self._slave = slave
+        self.reply = b'x' * reply_size + b'\r\n'
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        pending = b''
+        while self._running:
+            try:
+                pending += os.read(self.master, 4096)
+            except OSError:
+                return
+            while b'\n' in pending:
+                line, _, pending = pending.partition(b'\n')
+                os.write(self.master, self.reply if line == b'Q' else b'b' * BULK_SIZE)
+
+    def close(self):
+        self._running = False
+        os.close(self.master)
+        os.close(self._slave)
+
+
+class PollingReader(object):
+    """
+    The Serial Server's previous reads: poll the port on a thread-pool thread.
+    """
+
+    def __init__(self, ser):
+        self.ser = ser
+
+    def _deferredRead(self, count, timeout):
+        stop = time.time() + timeout
+
+        def doRead():
+            data = b''
+            while time.time() < stop:
+                data = self.ser.read(count)
+                if data:
+                    break
+                time.sleep(0.001)
+            return data
+        return threads.deferToThread(doRead)
+
+    @defer.inlineCallbacks
+    def read(self, count, timeout):
+        recd = b''
+        while len(recd) < count:
+            r = self.ser.read(count - len(recd))
+            if r == b'':
+                r = yield self._deferredRead(count - len(recd), timeout)
+                if r == b'':
+                    break
+            recd += r
+        defer.returnValue(recd)
+
+    @defer.inlineCallbacks
+    def readUntil(self, delim, timeout, skip=b''):
+        recd = b''
+        while True:
+            r = self.ser.read(1)
+            if r == b'':
+                r = yield self._deferredRead(1, timeout)
+            if r in (b'', delim):
+                break
+            elif r != skip:
+                recd += r
+        defer.returnValue(recd)
+
+
+@defer.inlineCallbacks
+def run_mode(name, device, queries):
+    """
+    Query the device and read back the replies.
+    Returns:
+        (float, float, float, float): queries per second, median and 99th percentile latency (in ms),
+                                        and bulk throughput (in MB/s).
+    """
+    ser = Serial(device.path, timeout=0)
+    if name == 'buffered':
+        reader = SerialReader(ser)
+        reader.start()
+    else:
+        reader = PollingReader(ser)
+    try:
+        latencies = []
+        t_start = time.perf_counter()
+        for _ in range(queries):
+            t_query = time.perf_counter()
+            ser.write(b'Q\n')
+            reply = yield reader.readUntil(b'\n', 5, b'\r')
+            latencies.append(time.perf_counter() - t_query)
+            assert len(reply) == len(device.reply) - 2
+        rate = queries / (time.perf_counter() - t_start)
+
+        t_bulk = time.perf_counter()
+        for _ in range(10):
+            ser.write(b'B\n')
+            block = yield reader.read(BULK_SIZE, 5)
+            assert len(block) == BULK_SIZE
+        throughput = 10 * BULK_SIZE / 1e6 / (time.perf_counter() - t_bulk)
+    finally:
+        if name == 'buffered':
+            reader.stop()
+        ser.close()
+    latencies.sort()
+    defer.returnValue((rate, 1e3 * latencies[len(latencies) // 2],
+                       1e3 * latencies[int(len(latencies) * 0.99)], throughput))
+
+
+@defer.inlineCallbacks
+def run(reactor, queries, reply_size):
+    print('{:d} queries, {:d} byte replies\n'.format(queries, reply_size))
+    print('{:<12s}{:>12s}{:>14s}{:>14s}{:>12s}'.format('reader', 'queries/s', 'median (ms)', 'p99 (ms)', 'bulk MB/s'))
+    for name in ('polling', 'buffered'):
+        device = FakeDevice(reply_size)
+        try:
+            rate, median, p99, throughput = yield run_mode(name, device, queries)
+        finally:
+            device.close()
+        print('{:<12s}{:>12.0f}{:>14.3f}{:>14.3f}{:>12.2f}'.format(name, rate, median, p99, throughput))
+
+
+def main(queries=1000, reply_size=32):
+    task.react(run, (queries, reply_size))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
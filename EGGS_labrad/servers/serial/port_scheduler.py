@@ -0,0 +1,130 @@
+"""
+Priority scheduling of access to a serial port.
+
+A PortScheduler is a lock with a queue for each priority class. When the port is
+released, it is given to the oldest waiting request of the highest priority class, so
+interactive requests go ahead of queued polls (but never interrupt the request that has
+the port). Requests that wait longer than their max wait are dropped from the queue and
+fail, so that stale polls don't pile up behind a long request.
+"""
+from time import monotonic
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+
+__all__ = ["PRIORITIES", "DEFAULT_MAX_WAIT", "DeadlineExpiredError", "PortScheduler"]
+
+# priority classes, from highest to lowest
+PRIORITIES = ('interactive', 'poll', 'bulk')
+# default max time that a request of each class waits for the port, in seconds (0 to wait forever)
+DEFAULT_MAX_WAIT = {'interactive': 5., 'poll': 2., 'bulk': 60.}
+
+
+class DeadlineExpiredError(Exception):
+    """
+    A request waited longer than its max wait for the port.
+    """
+
+
+class _ClassStats(object):
+    """Queue-depth and wait-time metrics of a priority class."""
+
+    def __init__(self):
+        self.max_queued = 0
+        self.granted = 0
+        self.expired = 0
+        self.total_wait = 0.
+        self.max_wait = 0.
+
+
+class PortScheduler(object):
+    """
+    Gives a serial port to one request at a time, in order of priority.
+    """
+
+    def __init__(self, reactor=reactor):
+        self.reactor = reactor
+        self.locked = False
+        # priority class of the request that has the port (None if the port is free)
+        self.holder = None
+        self._queues = {priority: deque() for priority in PRIORITIES}
+        self._stats = {priority: _ClassStats() for priority in PRIORITIES}
+
+    def acquire(self, priority='interactive', max_wait=None):
+        """
+        Wait for the port.
+        Arguments:
+            priority    (str): the priority class of the request. Must be one of PRIORITIES.
+            max_wait    (float): the max time to wait, in seconds (defaults to DEFAULT_MAX_WAIT[priority];
+                                    0 waits forever).
+        Returns:
+                        Deferred: fires once the request has the port, or fails with
+                                    DeadlineExpiredError once the max wait has elapsed.
+        """
+        if priority not in self._queues:
+            raise ValueError('Invalid priority: {}. Must be one of: {}'.format(priority, PRIORITIES))
+        stats = self._stats[priority]
+        if not self.locked:
+            self.locked = True
+            self.holder = priority
+            stats.granted += 1
+            return succeed(self)
+        d = Deferred()
+        request = [d, priority, monotonic(), None]
+        if max_wait is None:
+            max_wait = DEFAULT_MAX_WAIT[priority]
+        if max_wait:
+            request[3] = self.reactor.callLater(max_wait, self._expire, request)
+        queue = self._queues[priority]
+        queue.append(request)
+        stats.max_queued = max(stats.max_queued, len(queue))
+        return d
+
+    def release(self):
+        """
+        Give the port to the next request.
+        """
+        assert self.locked, "Tried to release an unlocked port."
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            if queue:
+                d, _, t_queued, expiry = queue.popleft()
+                self.holder = priority
+                if expiry is not None:
+                    expiry.cancel()
+                wait = monotonic() - t_queued
+                stats = self._stats[priority]
+                stats.granted += 1
+                stats.total_wait += wait
+                stats.max_wait = max(stats.max_wait, wait)
+                d.callback(self)
+                return
+        self.locked = False
+        self.holder = None
+
+    def _expire(self, request):
+        d, priority, t_queued, _ = request
+        self._queues[priority].remove(request)
+        self._stats[priority].expired += 1
+        d.errback(DeadlineExpiredError('{:s} request waited more than {:.3f} s for the port.'.format(
+            priority, monotonic() - t_queued)))
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self):
+        """
+        Get the queue-depth and wait-time metrics of each priority class.
+        Returns:
+            list(str, int, int, int, int, float, float): the priority class, number of queued requests, max
+                number of queued requests, number of requests given the port, number of requests that expired,
+                and mean and max wait (in seconds) of requests given the port.
+        """
+        stats = []
+        for priority in PRIORITIES:
+            s = self._stats[priority]
+            mean_wait = s.granted and s.total_wait / s.granted
+            stats.append((priority, len(self._queues[priority]), s.max_queued, s.granted, s.expired,
+                          mean_wait, s.max_wait))
+        return stats
@@ -2,7 +2,7 @@
 ### BEGIN NODE INFO
 [info]
 name = Serial Server
-version = 1.5.1
+version = 1.5.2
 description = Gives access to serial devices via pyserial.
 instancename = %LABRADNODE% Serial Server
 
@@ -16,16 +16,14 @@ timeout = 10
 ### END NODE INFO
 """
 import os
-import time
 import collections
 
 from labrad.units import Value
 from labrad.errors import Error
-from labrad.util import wakeupCall
 from labrad.server import setting, Signal
-from twisted.internet import reactor, threads
+from twisted.internet import reactor
 from twisted.internet.task import deferLater
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import returnValue
 
 # import ft232
 from serial import Serial
@@ -33,6 +31,13 @@ from serial.tools import list_ports
 from serial.serialutil import SerialException
 
 from EGGS_labrad.servers import PollingServer
+from EGGS_labrad.servers.serial.serial_reader import SerialReader
+from EGGS_labrad.servers.serial.port_scheduler import PRIORITIES, DEFAULT_MAX_WAIT, PortScheduler
+# simulated devices use pseudo-terminals, which are only available on Linux
+if os.name == 'posix':
+    from EGGS_labrad.servers.serial.simulated_device import DEVICES
+else:
+    DEVICES = None
 
 
 # ERRORS
@@ -64,6 +69,12 @@ class SerialServer(PollingServer):
 
     def initServer(self):
         super().initServer()
+        # open ports, shared by all contexts that opened them: [Serial, SerialReader, number of contexts], by path
+        self.open_ports = {}
+        # schedulers that run transactions on the same port (from any context) one at a time, by priority
+        self.port_schedulers = collections.defaultdict(PortScheduler)
+        # simulated devices, by port name
+        self.simulated_devices = {}
         # use enumerate_serial_pyserial instead of enumerate_serial_windows
         self.enumerate_serial_pyserial()
 
@@ -138,13 +149,21 @@ class SerialServer(PollingServer):
                 _, _, dev_name = dev_path.rpartition(os.sep)
                 self.SerialPorts.append(SerialDevice(dev_name, dev_path))
 
+        # add ports of simulated devices
+        for dev_name, device in self.simulated_devices.items():
+            self.SerialPorts.append(SerialDevice(dev_name, device.path))
+
         # send name of all available serial ports via Signal to all listeners
         available_port_list = [x.name for x in self.SerialPorts]
         self.port_update(self.name, available_port_list)
 
+    def stopServer(self):
+        for device in self.simulated_devices.values():
+            device.close()
+        super().stopServer()
+
     def expireContext(self, c):
-        if 'PortObject' in c:
-            c['PortObject'].close()
+        self._closePort(c)
 
     def getPort(self, c):
         try:
@@ -152,6 +171,48 @@ class SerialServer(PollingServer):
         except Exception as e:
             raise NoPortSelectedError()
 
+    def getReader(self, c):
+        """
+        Get the reader that buffers incoming data for the port of a context.
+        """
+        try:
+            return c['Reader']
+        except Exception as e:
+            raise NoPortSelectedError()
+
+    def _openPort(self, c, devicepath):
+        """
+        Open a serial port in a context, and start reading it into a buffer.
+            Contexts that open the same port share its Serial and SerialReader, so
+            that incoming bytes go to a single buffer, and transactions on the port
+            are ordered by a single scheduler.
+        """
+        port = self.open_ports.get(devicepath)
+        if port is None:
+            ser = Serial(devicepath, timeout=0)
+            reader = SerialReader(ser)
+            reader.start()
+            port = self.open_ports[devicepath] = [ser, reader, 0]
+        port[2] += 1
+        c['PortObject'], c['Reader'], _ = port
+        c['PortPath'] = devicepath
+
+    def _closePort(self, c):
+        """
+        Leave the port of a context, and stop reading and close it once no contexts have it open.
+        """
+        c.pop('PortObject', None)
+        c.pop('Reader', None)
+        devicepath = c.pop('PortPath', None)
+        port = self.open_ports.get(devicepath)
+        if port is None:
+            return
+        port[2] -= 1
+        if port[2] <= 0:
+            del self.open_ports[devicepath]
+            port[1].stop()
+            port[0].close()
+
     @setting(1, 'List Serial Ports', returns=['*s: List of serial ports'])
     def list_serial_ports(self, c):
         """
@@ -164,6 +225,57 @@ class SerialServer(PollingServer):
         return port_list
 
 
+    # SIMULATED DEVICES
+    @setting(3, 'Add Simulated Device', model='s', name='s', baudrate='w', latency='v[s]',
+             returns='s: Port of the device')
+    def add_simulated_device(self, c, model, name='', baudrate=0, latency=Value(0, 's')):
+        """
+        Create a simulated device on a pseudo-terminal (Linux only), which can be opened like any other port.
+        Arguments:
+            model       (str)   : the device model. Must be one of the models in simulated_device.DEVICES.
+            name        (str)   : the port name (defaults to the model name).
+            baudrate    (int)   : the line rate to emulate (0 for no emulation).
+            latency     (float) : the time the device takes to answer each message.
+        Returns:
+                        (str)   : the port name.
+        """
+        if DEVICES is None:
+            raise Exception('Error: simulated devices are only available on Linux.')
+        if model not in DEVICES:
+            raise Exception('Error: invalid model. Must be one of: {}'.format(sorted(DEVICES)))
+        name = name or model
+        if name in self.simulated_devices:
+            raise Exception('Error: a simulated device already exists on port {:s}.'.format(name))
+        self.simulated_devices[name] = DEVICES[model](baudrate or None, latency['s']).start()
+        self.enumerate_serial_pyserial()
+        return name
+
+    @setting(4, 'Remove Simulated Device', name='s', returns='')
+    def remove_simulated_device(self, c, name):
+        """
+        Remove a simulated device.
+        Arguments:
+            name    (str)   : the port name of the device.
+        """
+        if name not in self.simulated_devices:
+            raise Exception('Error: no simulated device on port {:s}.'.format(name))
+        self.simulated_devices.pop(name).close()
+        self.enumerate_serial_pyserial()
+
+    @setting(5, 'Get Device Errors', returns='*(sss): (time, message, error) of each error')
+    def get_device_errors(self, c):
+        """
+        Get the messages that the simulated device on the current port couldn't answer.
+        Returns:
+            (*(str, str, str)): the time, message, and error of each message (empty for real devices).
+        """
+        path = c.get('PortPath')
+        for device in self.simulated_devices.values():
+            if device.path == path:
+                return device.errors
+        return []
+
+
     # CONNECT
     @setting(10, 'Open', port=[': Open the first available port', 's: Port to open, e.g. COM4'],
              returns=['s: Opened port'])
@@ -182,14 +294,13 @@ class SerialServer(PollingServer):
         """
         c['Timeout'] = 0
         c['Debug'] = False
-        if 'PortObject' in c:
-            c['PortObject'].close()
-            del c['PortObject']
+        c.setdefault('Priority', 'interactive')
+        c.setdefault('MaxWait', None)
+        self._closePort(c)
         if not port:
             for i in range(len(self.SerialPorts)):
                 try:
-                    c['PortObject'] = Serial(self.SerialPorts[i].devicepath,
-                                             timeout=0)
+                    self._openPort(c, self.SerialPorts[i].devicepath)
                     break
                 except SerialException:
                     pass
@@ -199,7 +310,7 @@ class SerialServer(PollingServer):
             for x in self.SerialPorts:
                 if os.path.normcase(x.name) == os.path.normcase(port):
                     try:
-                        c['PortObject'] = Serial(x.devicepath, timeout=0)
+                        self._openPort(c, x.devicepath)
                         return x.name
                     except SerialException as e:
                         if e.message.find('cannot find') >= 0:
@@ -213,9 +324,7 @@ class SerialServer(PollingServer):
         """
         Closes the current serial port.
         """
-        if 'PortObject' in c:
-            c['PortObject'].close()
-            del c['PortObject']
+        self._closePort(c)
 
 
     # CONNECTION PARAMETERS
@@ -367,73 +476,6 @@ class SerialServer(PollingServer):
 
 
     # READ
-    @inlineCallbacks
-    def deferredRead(self, ser, timeout, count=1):
-        """
-        todo: document
-        """
-        # killit stops the read
-        killit = False
-
-        def doRead(count):
-            """
-            Waits until it reads <count> characters or is told to stop.
-            """
-            d = b''
-            while not killit:
-                d = ser.read(count)
-                if d:
-                    break
-                # todo: maybe move to wakeupCall
-                # yield wakeupCall(0.001)
-                time.sleep(0.001)
-            return d
-
-        # read until the timeout
-        data = threads.deferToThread(doRead, count)
-        timeout_object = []
-        start_time = time.time()
-        r = yield util.maybeTimeout(data, min(timeout, 300), timeout_object)
-        killit = True
-
-        # check if we have timed out
-        if r == timeout_object:
-            elapsed = time.time() - start_time
-            print("deferredRead timed out after {} seconds".format(elapsed))
-            r = b''
-        if r == b'':
-            r = ser.read(count)
-
-        returnValue(r)
-
-    @inlineCallbacks
-    def readSome(self, c, count=0):
-        """
-        todo: document
-        """
-        ser = self.getPort(c)
-        if count == 0:
-            returnValue(ser.read(10000))
-
-        timeout = c['Timeout']
-        if timeout == 0:
-            returnValue(ser.read(count))
-
-        # read until we either hit timeout or meet character count
-        recd = b''
-        while len(recd) < count:
-            # try to read remaining characters
-            r = ser.read(count - len(recd))
-            # if nothing, keep reading until timeout
-            if r == b'':
-                r = yield self.deferredRead(ser, timeout, count - len(recd))
-                if r == b'':
-                    ser.close()
-                    ser.open()
-                    break
-            recd += r
-        returnValue(recd)
-
     @setting(50, 'Read', count=[': Read all bytes in buffer', 'w: Read this many bytes'],
              returns=['s: Received data'])
     def read(self, c, count=0):
@@ -444,11 +486,10 @@ class SerialServer(PollingServer):
         Arguments:
             count:   bytes to read.
         """
-        ans = yield self.readSome(c, count)
+        ans = yield self.getReader(c).read(count, c['Timeout'])
         # debug output
-        ser_name = self.getPort(c).name
         if c['Debug']:
-            print("{:s}\tREAD: {:s}".format(ser_name, ans))
+            print("{:s}\tREAD: {}".format(self.getPort(c).name, ans))
         returnValue(ans)
 
     @setting(51, 'Read as Words', data=[': Read all bytes in buffer', 'w: Read this many bytes'],
@@ -457,12 +498,11 @@ class SerialServer(PollingServer):
         """
         Read data from the port.
         """
-        ans = yield self.readSome(c, data)
-        ans = [int(ord(x)) for x in ans]
+        ans = yield self.getReader(c).read(data, c['Timeout'])
+        ans = list(ans)
         # debug output
-        ser_name = self.getPort(c).name
         if c['Debug']:
-            print("{:s}\tREADASWORDS: {:s}".format(ser_name, ans))
+            print("{:s}\tREADASWORDS: {}".format(self.getPort(c).name, ans))
         returnValue(ans)
 
     @setting(52, 'Read Line', data=[': Read until LF, ignoring CRs', 's: Other delimiter to use'],
@@ -471,8 +511,6 @@ class SerialServer(PollingServer):
         """
         Read data from the port, up to but not including the specified delimiter.
         """
-        ser = self.getPort(c)
-        timeout = c['Timeout']
         # set default end character if not specified
         if data:
             # ensure end character is of type byte
@@ -482,23 +520,99 @@ class SerialServer(PollingServer):
         else:
             delim, skip = b'\n', b'\r'
 
-        recd = b''
-        while True:
-            r = ser.read(1)
-            # only try a deferred read if there is a timeout
-            if r == b'' and timeout > 0:
-                r = yield self.deferredRead(ser, timeout)
-
-            # stop if r is empty or the delimiter
-            if r in (b'', delim):
-                break
-            elif r != skip:
-                recd += r
+        recd = yield self.getReader(c).readUntil(delim, c['Timeout'], skip)
         if c['Debug']:
-            print("{:s}\tREADLINE: {:s}".format(ser.name, recd))
+            print("{:s}\tREADLINE: {}".format(self.getPort(c).name, recd))
         returnValue(recd)
 
 
+    # TRANSACTIONS
+    @setting(70, 'Transaction', steps='*(swsv): (data, count, delimiter, timeout) of each step',
+             returns='*s: Data read by each step')
+    def transaction(self, c, steps):
+        """
+        Run a sequence of writes and reads as a single request.
+            The steps are run in order, without any other transaction on the port in between.
+            Transactions waiting for the port are run in order of the priority of their context.
+            Each step writes its data (if any), then reads:
+                up to (but not including) its delimiter, if it has one;
+                otherwise, count bytes (or nothing, if count is 0).
+            Each read waits for up to timeout seconds (0 uses the context's timeout).
+        Arguments:
+            steps   (list(str, int, str, float)): the data, count, delimiter and timeout of each step.
+        Returns:
+                    (list(str)): the data read by each step ('' for steps that don't read).
+        """
+        ser = self.getPort(c)
+        reader = self.getReader(c)
+        scheduler = self.port_schedulers[c['PortPath']]
+        yield scheduler.acquire(c['Priority'], c['MaxWait'])
+        try:
+            responses = []
+            for data, count, delim, timeout in steps:
+                # encode as needed
+                if type(data) == str:
+                    data = data.encode()
+                if type(delim) == str:
+                    delim = delim.encode()
+                if data:
+                    ser.write(data)
+                timeout = min(timeout, 300) if timeout > 0 else c['Timeout']
+                if delim:
+                    resp = yield reader.readUntil(delim, timeout)
+                elif count:
+                    resp = yield reader.read(count, timeout)
+                else:
+                    resp = b''
+                responses.append(resp)
+        finally:
+            scheduler.release()
+        # debug output
+        if c['Debug']:
+            print("{:s}\tTRANSACTION: {}".format(ser.name, list(zip([step[0] for step in steps], responses))))
+        returnValue(responses)
+
+    @setting(71, 'Priority', priority='s', max_wait='v[s]', returns='(sv[s])')
+    def priority(self, c, priority=None, max_wait=None):
+        """
+        Set the priority class of transactions in the current context.
+            When the port is released, the oldest waiting transaction of the
+            highest priority class runs next.
+        Arguments:
+            priority    (str)   : the priority class. Must be one of ('interactive', 'poll', 'bulk').
+            max_wait    (float) : the max time a transaction waits for the port before failing
+                                    (0 waits forever; defaults to the default of the priority class).
+        Returns:
+                        (str, float): the priority class and max wait (0 if transactions wait forever).
+        """
+        if priority is not None:
+            if priority not in PRIORITIES:
+                raise Exception('Error: invalid priority. Must be one of: {}'.format(PRIORITIES))
+            c['Priority'] = priority
+            c['MaxWait'] = None
+        if max_wait is not None:
+            c['MaxWait'] = max_wait['s']
+        priority = c.get('Priority', 'interactive')
+        max_wait = c.get('MaxWait')
+        if max_wait is None:
+            max_wait = DEFAULT_MAX_WAIT[priority]
+        return (priority, Value(max_wait, 's'))
+
+    @setting(72, 'Queue Stats', returns='*(siiiivv): (priority, queued, max queued, granted, expired, '
+                                         'mean wait, max wait) of each priority class')
+    def queue_stats(self, c):
+        """
+        Get the queue-depth and wait-time metrics of transactions on the current port.
+        Returns:
+            (*(str, int, int, int, int, float, float)): for each priority class: the number of
+                queued transactions, the max number of queued transactions, the number of
+                transactions given the port, the number that expired while waiting, and the
+                mean and max wait for the port (in seconds).
+        """
+        self.getPort(c)
+        return self.port_schedulers[c['PortPath']].stats()
+
+
     # BUFFER
     @setting(61, 'Flush Input', returns='')
     def flush_input(self, c):
@@ -506,6 +620,7 @@ class SerialServer(PollingServer):
         Flush the input buffer.
         """
         yield self.getPort(c).reset_input_buffer()
+        self.getReader(c).clear()
 
     @setting(62, 'Flush Output', returns='')
     def flush_output(self, c):
@@ -522,7 +637,10 @@ class SerialServer(PollingServer):
         Arguments:
             size    (int)   : the serial buffer size.
         """
-        yield self.getPort(c).set_buffer_size(size)
+        ser = self.getPort(c)
+        # only supported on windows (incoming data is also buffered by the port's reader)
+        if hasattr(ser, 'set_buffer_size'):
+            yield ser.set_buffer_size(size)
 
     @setting(64, 'Buffer Waiting Input', returns='i')
     def input_waiting(self, c):
@@ -532,7 +650,8 @@ class SerialServer(PollingServer):
             (int)   : the number of bytes waiting at the input port.
         """
         ser = self.getPort(c)
-        val = ser.in_waiting
+        # include data that has been read into the buffer but not requested
+        val = ser.in_waiting + len(self.getReader(c))
         return val
 
     @setting(65, 'Buffer Waiting Output', returns='i')
@@ -0,0 +1,314 @@
+"""
+Event-driven reading of serial ports.
+
+Each open port gets a reader thread that blocks in the port's read call (so it wakes
+as soon as bytes arrive, instead of polling) and moves whatever arrives into a ring
+buffer. Reads are served from the buffer in the reactor thread, in the order they were
+made, and return Deferreds that fire once enough bytes (or the delimiter) have arrived,
+or the timeout has elapsed.
+"""
+import threading
+
+from collections import deque
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+
+__all__ = ["RingBuffer", "SerialReader"]
+
+# capacity of each port's buffer, in bytes (the oldest bytes are dropped once it's full)
+BUFFER_SIZE = 1 << 20
+# max time the reader thread blocks in a single read, so it notices when it's stopped
+READ_TIMEOUT = 0.1
+
+
+class RingBuffer(object):
+    """
+    Fixed-capacity FIFO of bytes.
+        If more bytes are written than there is room for, the oldest bytes are
+        dropped, and counted in dropped.
+    """
+
+    def __init__(self, capacity=BUFFER_SIZE):
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._start = 0
+        self._len = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._len
+
+    def _segments(self):
+        """
+        Get the bounds of the (up to two) contiguous segments holding the data.
+        Returns:
+            (int, int, int): the end of the first segment, and the length of each.
+        """
+        end = min(self._start + self._len, self.capacity)
+        first = end - self._start
+        return end, first, self._len - first
+
+    def write(self, data):
+        """
+        Append bytes to the buffer.
+        """
+        data = memoryview(data)
+        if len(data) >= self.capacity:
+            self.dropped += self._len + len(data) - self.capacity
+            self._buf[:] = data[-self.capacity:]
+            self._start, self._len = 0, self.capacity
+            return
+        overflow = self._len + len(data) - self.capacity
+        if overflow > 0:
+            self.dropped += overflow
+            self._start = (self._start + overflow) % self.capacity
+            self._len -= overflow
+        pos = (self._start + self._len) % self.capacity
+        first = min(len(data), self.capacity - pos)
+        self._buf[pos:pos + first] = data[:first]
+        self._buf[:len(data) - first] = data[first:]
+        self._len += len(data)
+
+    def peek(self, count=None, offset=0):
+        """
+        Get bytes from the buffer without removing them.
+        Arguments:
+            count   (int): the number of bytes to get (defaults to all of them).
+            offset  (int): the position of the first byte to get.
+        Returns:
+                    (bytes): the bytes.
+        """
+        count = self._len - offset if count is None else min(count, self._len - offset)
+        if count <= 0:
+            return b''
+        pos = (self._start + offset) % self.capacity
+        first = min(count, self.capacity - pos)
+        if first == count:
+            return bytes(self._buf[pos:pos + count])
+        return bytes(self._buf[pos:]) + bytes(self._buf[:count - first])
+
+    def read(self, count=None):
+        """
+        Remove and return bytes from the front of the buffer.
+        Arguments:
+            count   (int): the number of bytes to read (defaults to all of them).
+        Returns:
+                    (bytes): the bytes (fewer than count if there aren't enough).
+        """
+        data = self.peek(count)
+        self.skip(len(data))
+        return data
+
+    def skip(self, count):
+        """
+        Remove bytes from the front of the buffer.
+        """
+        count = min(count, self._len)
+        self._start = (self._start + count) % self.capacity
+        self._len -= count
+        if not self._len:
+            self._start = 0
+
+    def find(self, delim, start=0):
+        """
+        Find the first occurrence of delim in the buffer, searching the buffer in place.
+        Arguments:
+            delim   (bytes): the bytes to search for.
+            start   (int): the position to start searching from.
+        Returns:
+                    (int): the position of delim, or -1 if it isn't in the buffer.
+        """
+        end, first, second = self._segments()
+        if start < first:
+            idx = self._buf.find(delim, self._start + start, end)
+            if idx >= 0:
+                return idx - self._start
+        if not second:
+            return -1
+        # delim may straddle the end of the array
+        lo = max(start, first - len(delim) + 1)
+        if lo < first:
+            idx = self.peek(first + len(delim) - 1 - lo, lo).find(delim)
+            if idx >= 0:
+                return lo + idx
+        idx = self._buf.find(delim, max(start - first, 0), second)
+        return first + idx if idx >= 0 else -1
+
+    def clear(self):
+        self._start = self._len = 0
+
+
+class _Request(object):
+    """A pending read: count bytes, or up to a delimiter."""
+
+    def __init__(self, count=0, delim=None, skip=b''):
+        self.d = Deferred()
+        self.count = count
+        self.delim = delim
+        self.skip = skip
+        self.timeoutCall = None
+        # position in the buffer to continue searching for the delimiter from
+        self.searched = 0
+
+
+class SerialReader(object):
+    """
+    Reads a serial port on a dedicated thread into a ring buffer.
+
+    The thread only touches the buffer (under a lock) and hands control back
+    to the reactor when bytes arrive; all other methods are called in the
+    reactor thread.
+    """
+
+    def __init__(self, ser, capacity=BUFFER_SIZE, reactor=reactor):
+        self.ser = ser
+        self.reactor = reactor
+        self.buffer = RingBuffer(capacity)
+        self._lock = threading.Lock()
+        self._requests = deque()
+        # whether a call to _serve has been scheduled in the reactor but hasn't run yet
+        self._servePending = False
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """
+        Start reading the port.
+        """
+        # block in the read call, but wake up regularly to check whether we've been stopped
+        self.ser.timeout = READ_TIMEOUT
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='SerialReader: {}'.format(self.ser.name),
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop reading the port (before it's closed).
+            Pending reads get whatever has arrived.
+        """
+        self._running = False
+        if hasattr(self.ser, 'cancel_read'):
+            try:
+                self.ser.cancel_read()
+            except Exception:
+                pass
+        while self._requests:
+            self._finish(self._requests[0], self._partial(self._requests[0]))
+
+    def _run(self):
+        while self._running:
+            try:
+                data = self.ser.read(max(1, self.ser.in_waiting))
+            except Exception as e:
+                # the port was closed, or the device was disconnected
+                if self._running:
+                    print('SerialReader: {} stopped reading: {}'.format(self.ser.name, e))
+                return
+            if data:
+                with self._lock:
+                    self.buffer.write(data)
+                    wake, self._servePending = not self._servePending, True
+                if wake:
+                    self.reactor.callFromThread(self._serve)
+
+    def __len__(self):
+        with self._lock:
+            return len(self.buffer)
+
+    def clear(self):
+        """
+        Discard all buffered bytes.
+        """
+        with self._lock:
+            self.buffer.clear()
+        for request in self._requests:
+            request.searched = 0
+
+    def read(self, count=0, timeout=0):
+        """
+        Read bytes from the port.
+        Arguments:
+            count   (int): the number of bytes to read (0 reads all buffered bytes immediately).
+            timeout (float): the max time to wait for count bytes, in seconds.
+        Returns:
+                    Deferred(bytes): fires with the bytes (fewer than count if the timeout elapsed).
+        """
+        if not count:
+            with self._lock:
+                return succeed(self.buffer.read())
+        return self._request(_Request(count=count), timeout)
+
+    def readUntil(self, delim, timeout=0, skip=b''):
+        """
+        Read bytes from the port up to a delimiter.
+        Arguments:
+            delim   (bytes): the delimiter, which is removed from the buffer but not returned.
+            timeout (float): the max time to wait for the delimiter, in seconds.
+            skip    (bytes): a byte to remove from the result (e.g. b'\\r').
+        Returns:
+                    Deferred(bytes): fires with the bytes before the delimiter (or all
+                                        buffered bytes if the timeout elapsed).
+        """
+        return self._request(_Request(delim=delim, skip=skip), timeout)
+
+    def _request(self, request, timeout):
+        self._requests.append(request)
+        self._serve()
+        if not request.d.called:
+            if timeout > 0 and self._running:
+                request.timeoutCall = self.reactor.callLater(timeout, self._timedOut, request)
+            else:
+                self._timedOut(request)
+        return request.d
+
+    def _serve(self):
+        """
+        Complete pending reads, in order, with the bytes that have arrived.
+        """
+        with self._lock:
+            self._servePending = False
+        while self._requests:
+            request = self._requests[0]
+            with self._lock:
+                data = self._take(request)
+            if data is None:
+                return
+            self._finish(request, data)
+
+    def _take(self, request):
+        """
+        Remove the bytes for a request from the buffer, if they have all arrived.
+        """
+        if request.delim is None:
+            if len(self.buffer) < request.count:
+                return None
+            return self.buffer.read(request.count)
+        idx = self.buffer.find(request.delim, request.searched)
+        if idx < 0:
+            request.searched = max(len(self.buffer) - len(request.delim) + 1, 0)
+            return None
+        data = self.buffer.read(idx)
+        self.buffer.skip(len(request.delim))
+        return data.replace(request.skip, b'') if request.skip else data
+
+    def _partial(self, request):
+        """
+        Remove whatever has arrived for a request from the buffer.
+        """
+        with self._lock:
+            data = self.buffer.read(request.count or None)
+        return data.replace(request.skip, b'') if request.skip else data
+
+    def _timedOut(self, request):
+        request.timeoutCall = None
+        # only the oldest read can take bytes; later ones get nothing
+        data = self._partial(request) if request is self._requests[0] else b''
+        self._finish(request, data)
+        self._serve()
+
+    def _finish(self, request, data):
+        self._requests.remove(request)
+        if request.timeoutCall is not None and request.timeoutCall.active():
+            request.timeoutCall.cancel()
+        request.d.callback(data)
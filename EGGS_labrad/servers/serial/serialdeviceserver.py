@@ -129,13 +129,27 @@
 # SerialDeviceServer's timeout class variable.
 #===============================================================================
 
-from twisted.internet.defer import returnValue, inlineCallbacks, DeferredLock
+#===============================================================================
+# 2026 - 10 - 17
+#
+# Added transaction to SerialConnection, which runs a sequence of write/read
+# steps in a single request to the serial server.
+#
+# Replaced the DeferredLock of SerialConnection with a PortScheduler, so that
+# SerialConnection.acquire() takes a priority class (interactive, poll, bulk),
+# and waiting requests get the lock in order of priority. Requests that wait
+# longer than their max wait fail without releasing the lock held by another.
+#
+# SerialConnection.acquire() passes DeadlineExpiredError through unchanged, so
+# polling loops can skip a cycle when a poll waits too long for the port.
+#===============================================================================
+
+from twisted.internet.defer import returnValue, inlineCallbacks
 
 from labrad.errors import Error
 from labrad.server import LabradServer, setting
 
-# note: import reactor here to support error handling in SerialConnection object
-from twisted.internet import reactor
+from EGGS_labrad.servers.serial.port_scheduler import DeadlineExpiredError, PortScheduler
 
 __all__ = ["SerialDeviceError", "SerialConnectionError", "SerialDeviceServer"]
 
@@ -219,6 +233,8 @@ class SerialDeviceServer(LabradServer):
             self.read =                     lambda x=0:         ser.read(x)
             self.read_line =                lambda x='':        ser.read_line(x)
             self.read_as_words =            lambda x=0:         ser.read_as_words(x)
+            # write-then-read sequences in a single request (see the serial server's Transaction setting)
+            self.transaction =              lambda steps:       ser.transaction(steps)
 
             # other
             self.ID =                       ser.ID
@@ -229,17 +245,23 @@ class SerialDeviceServer(LabradServer):
 
             # create error handler function in case we are unable to acquire comm_lock
             def acquire_error_handler(failure):
-                self.release()
+                # note: requests that time out are removed from the queue, so we don't release comm_lock
+                # pass expired deadlines through as is, so polling loops can skip the cycle
+                if failure.check(DeadlineExpiredError):
+                    return failure
                 # need to raise an exception here to prevent any downstream serial functions from running
                 raise Exception('\t\tError in ser.acquire(): {}\n'.format(failure))
 
             # comm lock
-            self.comm_lock =                DeferredLock()
-            # note: we don't use the class variable "timeout" since it might be some strange type (e.g. labrad.WithUnit)
-            # and I can't be bothered to implement support/error handling for different types, so I just use
-            # a fixed timeout of 5 seconds for now.
-            self.acquire =                  lambda:             self.comm_lock.acquire().addTimeout(5., reactor).addErrback(acquire_error_handler)
+            # note: requests wait for up to the default max wait of their priority class (e.g. 5 seconds for
+            # interactive requests), then fail
+            self.comm_lock =                PortScheduler()
+            self.acquire =                  lambda priority='interactive', max_wait=None: \
+                                                self.comm_lock.acquire(priority, max_wait).addErrback(acquire_error_handler)
             self.release =                  lambda:             self.comm_lock.release()
+            # priority of transactions on the serial server, and their queue metrics
+            self.priority =                 lambda *args:       ser.priority(*args)
+            self.queue_stats =              lambda:             ser.queue_stats()
 
             # buffer
             self.buffer_size =              lambda size:        ser.buffer_size(size)
@@ -387,6 +409,17 @@ class SerialDeviceServer(LabradServer):
         nodeMatch = serNode.lower() in potMatch.lower()
         return serMatch and nodeMatch
 
+    @staticmethod
+    def _priority(c):
+        """
+        Get the priority class of a request to the device (for SerialConnection.acquire).
+        Polling loops call settings without a context, so their requests are polls.
+
+        @param c: Context of the request
+        @return: 'poll' if the request is from a polling loop, 'interactive' otherwise
+        """
+        return 'poll' if c is None else 'interactive'
+
 
     # SIGNALS
     @inlineCallbacks
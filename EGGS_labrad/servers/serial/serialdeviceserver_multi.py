@@ -114,12 +114,23 @@
 # connection of required serial bus server.
 # ===============================================================================
 
-from twisted.internet.defer import returnValue, inlineCallbacks, DeferredLock
+# ===============================================================================
+# 2026 - 10 - 17
+#
+# Added transaction to SerialConnection, which runs a sequence of write/read
+# steps in a single request to the serial server.
+#
+# Replaced the DeferredLock of SerialConnection with a PortScheduler, so that
+# SerialConnection.acquire() takes a priority class (interactive, poll, bulk).
+# ===============================================================================
+
+from twisted.internet.defer import returnValue, inlineCallbacks
 
 from labrad.server import LabradServer, setting
 from labrad.errors import Error, NoDevicesAvailableError, DeviceNotSelectedError, NoSuchDeviceError
 
 from EGGS_labrad.servers import ContextServer
+from EGGS_labrad.servers.serial.port_scheduler import PortScheduler
 
 __all__ = ["SerialDeviceError", "SerialConnectionError", "MultipleSerialDeviceServer"]
 
@@ -207,15 +218,20 @@ class MultipleSerialDeviceServer(ContextServer):
             self.read = lambda x=0: ser.read(x, context=self.ctxt)
             self.read_line = lambda x='': ser.read_line(x, context=self.ctxt)
             self.read_as_words = lambda x=0: ser.read_as_words(x, context=self.ctxt)
+            # write-then-read sequences in a single request (see the serial server's Transaction setting)
+            self.transaction = lambda steps: ser.transaction(steps, context=self.ctxt)
             # other
             self.close = lambda: ser.close(context=self.ctxt)
             self.flush_input = lambda: ser.flush_input(context=self.ctxt)
             self.flush_output = lambda: ser.flush_output(context=self.ctxt)
             self.ID = ser.ID
             # comm lock
-            self.comm_lock = DeferredLock()
-            self.acquire = lambda: self.comm_lock.acquire()
+            # note: requests wait for the lock indefinitely (max_wait=0), in order of priority
+            self.comm_lock = PortScheduler()
+            self.acquire = lambda priority='interactive', max_wait=0: self.comm_lock.acquire(priority, max_wait)
             self.release = lambda: self.comm_lock.release()
+            self.priority = lambda *args: ser.priority(*args, context=self.ctxt)
+            self.queue_stats = lambda: ser.queue_stats(context=self.ctxt)
             # buffer
             self.buffer_size = lambda size: ser.buffer_size(size, context=self.ctxt)
             self.buffer_input_waiting = lambda: ser.in_waiting(context=self.ctxt)
@@ -0,0 +1,436 @@
+"""
+Simulated serial devices on pseudo-terminals (Linux only).
+
+Each SimulatedDevice opens a pseudo-terminal, and answers messages written to its
+slave end (its path, e.g. /dev/pts/3) on a thread, so that it can be opened like any
+other serial port (e.g. by the Serial Server, which can host them with Add Simulated
+Device). Subclasses split incoming bytes into messages and answer them with a model of
+the device's protocol.
+
+Replies are delayed by the device's latency, plus the time taken to send the message
+and the reply at the device's baudrate (if given), so the device can be run at
+realistic line rates.
+Run a device from the repository root, and print its path:
+    python -m EGGS_labrad.servers.serial.simulated_device [model] [baudrate] [latency (s)]
+"""
+import os
+import re
+import sys
+import tty
+import time
+import threading
+
+import numpy as np
+
+from datetime import datetime
+
+__all__ = ["SimulatedDevice", "SimulatedDeviceError", "RGADevice", "DCDevice", "TwisTorr74Device",
+           "Lakeshore336Device", "DEVICES"]
+
+# bits sent per byte (8N1: a start bit, 8 data bits, and a stop bit)
+BITS_PER_BYTE = 10
+# max time between paced writes of a reply, in seconds
+PACE_INTERVAL = 0.001
+
+
+class SimulatedDeviceError(Exception):
+    """
+    A message that the simulated device couldn't answer.
+    """
+
+
+class SimulatedDevice(object):
+    """
+    Answers messages written to a pseudo-terminal.
+        Messages that can't be answered are recorded in errors,
+        as (time, message, error) tuples.
+    """
+
+    # model name
+    name = 'device'
+    # end of each message
+    terminator = b'\n'
+    # reply to messages that can't be answered (None to not reply)
+    error_reply = None
+
+    def __init__(self, baudrate=None, latency=0.):
+        """
+        Arguments:
+            baudrate    (int): the line rate to send messages and replies at (None to not emulate it).
+            latency     (float): the time the device takes to answer a message, in seconds.
+        """
+        self.baudrate = baudrate
+        self.latency = latency
+        self.errors = []
+        self.received = 0
+        self.master, self._slave = os.openpty()
+        # pass bytes through unchanged, even before the port is opened
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='{}: {}'.format(type(self).__name__, self.path),
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._running = False
+        for fd in (self.master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _run(self):
+        pending = b''
+        while self._running:
+            try:
+                pending += os.read(self.master, 4096)
+            except OSError:
+                return
+            t_received = time.perf_counter()
+            messages, pending = self.frames(pending)
+            for message in messages:
+                self.received += 1
+                try:
+                    reply = self.respond(message)
+                except Exception as e:
+                    self.errors.append((datetime.now().isoformat(), repr(message), str(e)))
+                    reply = self.error_reply
+                try:
+                    self._send(reply or b'', t_received + self.latency + self._lineTime(message))
+                except OSError:
+                    return
+
+    def _lineTime(self, data):
+        """
+        Get the time taken to send data at the device's baudrate.
+        """
+        return len(data) * BITS_PER_BYTE / self.baudrate if self.baudrate else 0.
+
+    def _send(self, reply, t_start):
+        """
+        Write a reply, starting at t_start, and pacing it at the device's baudrate.
+        """
+        chunk = max(int(self.baudrate * PACE_INTERVAL / BITS_PER_BYTE), 1) if self.baudrate else len(reply)
+        for pos in range(0, len(reply), chunk or 1):
+            # each chunk is written once it would have been completely sent
+            delay = t_start + self._lineTime(reply[:pos + chunk]) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            os.write(self.master, reply[pos:pos + chunk])
+
+    def frames(self, data):
+        """
+        Split received bytes into messages.
+        Arguments:
+            data    (bytes): the bytes received since the last complete message.
+        Returns:
+            (list(bytes), bytes): the complete messages (without terminators), and the remaining bytes.
+        """
+        *messages, data = data.split(self.terminator)
+        return [message for message in messages if message.strip()], data
+
+    def respond(self, message):
+        """
+        Answer a message.
+            Raises SimulatedDeviceError if the message can't be answered.
+        Arguments:
+            message (bytes): the message.
+        Returns:
+                    (bytes): the reply (or None to not reply).
+        """
+        raise NotImplementedError
+
+
+class RGADevice(SimulatedDevice):
+    """
+    SRS RGA200: two-letter commands ending in <CR>, with ASCII replies ending in <LF><CR>,
+    and binary (32-bit little-endian) scan data.
+        Unknown commands set the serial error bits read by ER? and EC?, as on the device.
+    """
+
+    name = 'rga'
+    terminator = b'\r'
+    # default parameters (SP and ST are the partial and total pressure sensitivities, in mA/Torr)
+    DEFAULTS = {'EE': '70', 'IE': '1', 'FL': '0.00', 'VF': '90', 'HV': '0', 'NF': '4', 'MO': '1',
+                'MI': '1', 'MF': '65', 'SA': '10', 'SP': '2.9290E-04', 'ST': '5.0520E-04'}
+    # settings that don't reply with the status byte
+    NO_STATUS = ('NF', 'MI', 'MF', 'SA', 'MR')
+    # partial pressures of residual gas species (in 1e-16 A)
+    PEAKS = {2: 8000, 18: 20000, 28: 6000, 32: 1500, 44: 2500}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.params = dict(self.DEFAULTS)
+        self.serial_errors = 0
+
+    def frames(self, data):
+        *messages, data = data.replace(b'\n', b'\r').split(b'\r')
+        return [message.strip() for message in messages if message.strip()], data
+
+    def _spectrum(self, masses):
+        current = np.random.randint(0, 50, size=len(masses))
+        for mass, peak in self.PEAKS.items():
+            current += (peak * np.exp(-8. * (masses - mass) ** 2)).astype(int)
+        return current
+
+    def _scan(self, num_scans, masses):
+        # each scan is followed by a total pressure measurement
+        scans = [np.append(self._spectrum(masses), sum(self.PEAKS.values())) for _ in range(num_scans)]
+        return np.concatenate(scans).astype('<i4').tobytes()
+
+    def respond(self, message):
+        message = message.decode()
+        cmd, arg = message[:2].upper(), message[2:].strip()
+        mass_initial, mass_final, steps = int(self.params['MI']), int(self.params['MF']), int(self.params['SA'])
+        if cmd == 'ER' and arg == '?':
+            return '{:d}\n\r'.format(1 if self.serial_errors else 0).encode()
+        elif cmd == 'EC' and arg == '?':
+            # reading the register clears it
+            errors, self.serial_errors = self.serial_errors, 0
+            return '{:d}\n\r'.format(errors).encode()
+        elif cmd in ('EF', 'EM', 'EQ', 'ED', 'EP') and arg == '?':
+            return b'0\n\r'
+        elif cmd == 'AP' and arg == '?':
+            return '{:d}\n\r'.format((mass_final - mass_initial) * steps + 1).encode()
+        elif cmd == 'HP' and arg == '?':
+            return '{:d}\n\r'.format(mass_final - mass_initial + 1).encode()
+        elif cmd == 'TP' and arg == '?':
+            return int(sum(self.PEAKS.values())).to_bytes(4, 'little', signed=True)
+        elif cmd == 'SC':
+            masses = np.linspace(mass_initial, mass_final, (mass_final - mass_initial) * steps + 1)
+            return self._scan(int(arg or 1), masses)
+        elif cmd == 'HS':
+            return self._scan(int(arg or 1), np.arange(mass_initial, mass_final + 1))
+        elif cmd == 'MR':
+            mass = int(arg)
+            if mass == 0:
+                return None
+            return int(self._spectrum(np.array([mass]))[0]).to_bytes(4, 'little', signed=True)
+        elif cmd == 'IN':
+            if arg == '1':
+                self.params = dict(self.DEFAULTS)
+            return b'0\n\r'
+        elif cmd in ('CA', 'DG'):
+            return b'0\n\r'
+        elif cmd in self.params:
+            if arg == '?':
+                return '{:s}\n\r'.format(self.params[cmd]).encode()
+            self.params[cmd] = self.DEFAULTS[cmd] if arg == '*' else arg
+            return None if cmd in self.NO_STATUS else b'0\n\r'
+        # bad command
+        self.serial_errors |= 0b1
+        raise SimulatedDeviceError('Unknown command: {}'.format(cmd))
+
+
+class DCDevice(SimulatedDevice):
+    """
+    DC box: ASCII commands (e.g. vout.r 1) ending in <CR><LF>, with replies ending in <CR><LF>,
+    and binary fast voltage messages (b'x <channel> <DAC value>').
+    """
+
+    name = 'dc'
+    error_reply = b'ERR\r\n'
+    NUM_CHANNELS = 28
+    # DAC counts per volt of fast voltage messages
+    DAC_SCALE = 79.1026938
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.voltages = [0.] * (self.NUM_CHANNELS + 1)
+        self.outputs = [False] * (self.NUM_CHANNELS + 1)
+        self.alarm = True
+
+    def frames(self, data):
+        messages = []
+        while data:
+            # fast voltage messages are fixed length, and have no terminator
+            if data.startswith(b'x '):
+                if len(data) < 8:
+                    break
+                messages.append(data[:8])
+                data = data[8:]
+                continue
+            message, sep, rest = data.partition(b'\n')
+            if not sep:
+                break
+            if message.strip():
+                messages.append(message.strip())
+            data = rest
+        return messages, data
+
+    def _channel(self, arg):
+        channel = int(arg)
+        if not 1 <= channel <= self.NUM_CHANNELS:
+            raise SimulatedDeviceError('Invalid channel: {:d}'.format(channel))
+        return channel
+
+    def respond(self, message):
+        if message.startswith(b'x '):
+            channel = self._channel(message[2])
+            self.voltages[channel] = int.from_bytes(message[4:8], 'big') / self.DAC_SCALE
+            return b'ACK\r\n'
+        cmd, *args = message.decode().split()
+        if cmd == 'HVin.r':
+            return b'HVin1: 50.00\r\nIin1: 0.0100\r\n'
+        elif cmd in ('alarm.r', 'alarm.w'):
+            if args:
+                self.alarm = bool(int(args[0]))
+            return b'ON\r\n' if self.alarm else b'OFF\r\n'
+        elif cmd in ('clear.w', 'remote.w'):
+            return b'OK\r\n'
+        elif cmd in ('allon.w', 'alloff.w'):
+            self.outputs = [cmd == 'allon.w'] * (self.NUM_CHANNELS + 1)
+            return b'OK\r\n'
+        elif cmd in ('out.r', 'out.w'):
+            if not args:
+                return ''.join('CH{:02d}: {:s}\r\n'.format(channel, 'ON' if self.outputs[channel] else 'OFF')
+                               for channel in range(1, self.NUM_CHANNELS + 1)).encode()
+            channel = self._channel(args[0])
+            if len(args) > 1:
+                self.outputs[channel] = bool(int(args[1]))
+            return b'ON\r\n' if self.outputs[channel] else b'OFF\r\n'
+        elif cmd in ('vout.r', 'vout.w', 'vf.w'):
+            if not args:
+                return ''.join('CH{:02d}: {:.3f}V\r\n'.format(channel, self.voltages[channel])
+                               for channel in range(1, self.NUM_CHANNELS + 1)).encode()
+            channel = self._channel(args[0])
+            if len(args) > 1:
+                self.voltages[channel] = float(args[1])
+            return '{:.3f}V\r\n'.format(self.voltages[channel]).encode()
+        elif cmd == 'ramp.w':
+            channel = self._channel(args[0])
+            self.voltages[channel] = float(args[1])
+            return 'RAMP, {:d}, {:.3f}, {:.3f}\r\n'.format(channel, float(args[1]), float(args[2])).encode()
+        raise SimulatedDeviceError('Unknown command: {}'.format(cmd))
+
+
+class TwisTorr74Device(SimulatedDevice):
+    """
+    Agilent TwisTorr 74: <STX><ADDR><WIN><DIR><DATA><ETX><CRC> frames, where CRC is the XOR
+    of all bytes after STX (up to and including ETX), in hexadecimal.
+    """
+
+    name = 'twistorr74'
+    STX, ETX, ACK, NACK, UNKNOWN_WINDOW = b'\x02', b'\x03', b'\x06', b'\x15', b'\x32'
+    READ, WRITE = b'\x30', b'\x31'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # windows: start/stop, pressure units, speed (Hz), power (W), pressure (mbar)
+        self.windows = {b'000': '1', b'163': '000000', b'120': 1167, b'202': 12, b'224': 2.3e-9}
+
+    @classmethod
+    def frame(cls, body):
+        """
+        Create a reply frame.
+        """
+        msg = cls.STX + b'\x80' + body + cls.ETX
+        crc = 0
+        for byte in msg[1:]:
+            crc ^= byte
+        return msg + '{:02X}'.format(crc).encode()
+
+    def frames(self, data):
+        messages = []
+        while True:
+            start, end = data.find(self.STX), data.find(self.ETX)
+            if start < 0 or end < start:
+                return messages, data[start:] if start >= 0 else b''
+            # the CRC is up to two hexadecimal characters
+            crc_end = end + 1
+            while crc_end < min(end + 3, len(data)) and data[crc_end:crc_end + 1] in b'0123456789abcdefABCDEF':
+                crc_end += 1
+            if crc_end == end + 1:
+                return messages, data[start:]
+            messages.append(data[start:crc_end])
+            data = data[crc_end:]
+
+    def respond(self, message):
+        body, crc = message[1:message.index(self.ETX) + 1], message[message.index(self.ETX) + 1:]
+        expected = 0
+        for byte in body:
+            expected ^= byte
+        if int(crc, 16) != expected:
+            self.errors.append((datetime.now().isoformat(), repr(message), 'Bad checksum'))
+            return self.frame(self.NACK)
+        window, direction, data = body[1:4], body[4:5], body[5:-1]
+        if window not in self.windows:
+            self.errors.append((datetime.now().isoformat(), repr(message), 'Unknown window'))
+            return self.frame(self.UNKNOWN_WINDOW)
+        if direction == self.WRITE:
+            self.windows[window] = data.decode()
+            return self.frame(self.ACK)
+        value = self.windows[window]
+        if isinstance(value, float):
+            value = '{:.3E}'.format(value * np.random.uniform(0.95, 1.05))
+        elif isinstance(value, int):
+            value = '{:06d}'.format(value)
+        return self.frame(window + self.READ + value.encode())
+
+
+class Lakeshore336Device(SimulatedDevice):
+    """
+    Lakeshore 336: ASCII commands ending in <CR><LF>, with replies ending in <CR><LF>.
+        Settings (e.g. RANGE 1,2) don't reply, and queries (e.g. RANGE? 1) return them.
+        The device's 7-bit, odd parity framing isn't emulated.
+    """
+
+    name = 'lakeshore336'
+    INPUTS = 'ABCD'
+    DEFAULTS = {'HTRSET': '1,0,0.000,1', 'OUTMODE': '0,1,0', 'RANGE': '0', 'MOUT': '+0.000'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.temperatures = {'A': 4.2, 'B': 40., 'C': 77., 'D': 295.}
+        self.settings = {}
+
+    def frames(self, data):
+        messages, data = super().frames(data)
+        return [message.strip() for message in messages], data
+
+    def respond(self, message):
+        # queries may or may not have a space before their argument (e.g. OUTMODE?1)
+        cmd, query, args = re.match(r'([*\w]+)(\??)\s*(.*)', message.decode()).groups()
+        if cmd == '*IDN' and query:
+            return b'LSCI,MODEL336,SIMULATED,1.0\r\n'
+        elif cmd == 'KRDG' and query:
+            channels = self.INPUTS if args in ('', '0') else args
+            if any(channel not in self.INPUTS for channel in channels):
+                raise SimulatedDeviceError('Invalid input: {}'.format(args))
+            temps = [self.temperatures[channel] * np.random.uniform(0.999, 1.001) for channel in channels]
+            return (','.join('{:+08.3f}'.format(temp) for temp in temps) + '\r\n').encode()
+        elif cmd not in self.DEFAULTS:
+            raise SimulatedDeviceError('Unknown command: {}'.format(cmd))
+        elif query:
+            return (self.settings.get((cmd, args.strip()), self.DEFAULTS[cmd]) + '\r\n').encode()
+        output, _, value = args.partition(',')
+        self.settings[(cmd, output.strip())] = value
+        return None
+
+
+# models by name
+DEVICES = {device.name: device for device in (RGADevice, DCDevice, TwisTorr74Device, Lakeshore336Device)}
+
+
+def main(model='rga', baudrate=None, latency=0.):
+    device = DEVICES[model](int(baudrate) if baudrate else None, float(latency)).start()
+    print('Simulated {:s} device at {:s} (ctrl-c to stop)'.format(model, device.path))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.close()
+        for error in device.errors:
+            print('\t'.join(error))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:4])
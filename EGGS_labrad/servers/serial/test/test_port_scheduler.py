@@ -0,0 +1,122 @@
+import unittest
+
+import pytest
+
+from twisted.internet import task
+
+from EGGS_labrad.servers.serial.port_scheduler import DEFAULT_MAX_WAIT, DeadlineExpiredError, PortScheduler
+
+
+class PortSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.scheduler = PortScheduler(reactor=self.clock)
+
+    def _acquire(self, name, order, priority, max_wait=None):
+        """
+        Request the port, recording the name of the request in order once it has the port.
+        """
+        d = self.scheduler.acquire(priority, max_wait)
+        d.addCallback(lambda _: order.append(name))
+        return d
+
+    def _stats(self):
+        return {stats[0]: stats[1:5] for stats in self.scheduler.stats()}
+
+    def test_acquire_free_port(self):
+        results = []
+        self.scheduler.acquire('bulk').addCallback(results.append)
+        self.assertEqual([self.scheduler], results)
+        self.assertTrue(self.scheduler.locked)
+        self.assertEqual('bulk', self.scheduler.holder)
+        self.scheduler.release()
+        self.assertFalse(self.scheduler.locked)
+        self.assertIsNone(self.scheduler.holder)
+
+    def test_priority_order(self):
+        order = []
+        self._acquire('first', order, 'bulk')
+        self._acquire('bulk', order, 'bulk')
+        self._acquire('poll 1', order, 'poll')
+        self._acquire('poll 2', order, 'poll')
+        self._acquire('interactive', order, 'interactive')
+        # the request with the port isn't interrupted
+        self.assertEqual(['first'], order)
+        self.assertEqual(4, len(self.scheduler))
+
+        # the port goes to the highest priority class, then to the oldest request in it
+        holders = []
+        for _ in range(4):
+            self.scheduler.release()
+            holders.append(self.scheduler.holder)
+        self.assertEqual(['first', 'interactive', 'poll 1', 'poll 2', 'bulk'], order)
+        self.assertEqual(['interactive', 'poll', 'poll', 'bulk'], holders)
+        self.scheduler.release()
+        self.assertFalse(self.scheduler.locked)
+        self.assertEqual({'interactive': (0, 1, 1, 0), 'poll': (0, 2, 2, 0), 'bulk': (0, 1, 2, 0)},
+                         self._stats())
+
+    def test_deadline_expiry(self):
+        order = []
+        self._acquire('first', order, 'interactive')
+        poll = self._acquire('poll', order, 'poll')
+        bulk = self._acquire('bulk', order, 'bulk', max_wait=0)
+        failures = []
+        poll.addErrback(failures.append)
+
+        # the poll is dropped from the queue once its max wait has elapsed
+        self.clock.advance(DEFAULT_MAX_WAIT['poll'] - 0.1)
+        self.assertEqual([], failures)
+        self.clock.advance(0.1)
+        self.assertEqual(1, len(failures))
+        self.assertTrue(failures[0].check(DeadlineExpiredError))
+        self.assertEqual(1, len(self.scheduler))
+        self.assertEqual((0, 1, 0, 1), self._stats()['poll'])
+
+        # requests with a max wait of 0 wait forever
+        self.clock.advance(DEFAULT_MAX_WAIT['bulk'] * 10)
+        self.assertFalse(bulk.called)
+        self.scheduler.release()
+        self.assertEqual(['first', 'bulk'], order)
+        self.assertEqual('bulk', self.scheduler.holder)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_granted_request_doesnt_expire(self):
+        order = []
+        self._acquire('first', order, 'bulk')
+        d = self._acquire('poll', order, 'poll')
+        self.scheduler.release()
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.clock.advance(DEFAULT_MAX_WAIT['poll'] * 2)
+        self.assertEqual(['first', 'poll'], order)
+        self.assertIsNone(d.result)
+        self.assertEqual((0, 1, 1, 0), self._stats()['poll'])
+
+    def test_release_by_non_holder(self):
+        # nothing holds a free port, so it can't be released
+        with self.assertRaises(AssertionError):
+            self.scheduler.release()
+        self.assertFalse(self.scheduler.locked)
+
+        # a queued request doesn't hold the port, so it mustn't release it when it fails (see _poll_fail)
+        order = []
+        self._acquire('interactive', order, 'interactive')
+        poll = self._acquire('poll', order, 'poll')
+        poll.addErrback(lambda failure: None)
+        self.clock.advance(DEFAULT_MAX_WAIT['poll'])
+        self.assertEqual('interactive', self.scheduler.holder)
+        self.assertTrue(self.scheduler.locked)
+        self.scheduler.release()
+        self.assertIsNone(self.scheduler.holder)
+        with self.assertRaises(AssertionError):
+            self.scheduler.release()
+
+    def test_invalid_priority(self):
+        with self.assertRaises(ValueError):
+            self.scheduler.acquire('urgent')
+        self.assertFalse(self.scheduler.locked)
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', '-s', __file__])
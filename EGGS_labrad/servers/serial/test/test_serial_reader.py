@@ -0,0 +1,192 @@
+import queue
+import time
+import unittest
+
+import pytest
+
+from twisted.internet import task
+
+from EGGS_labrad.servers.serial.serial_reader import RingBuffer, SerialReader
+
+
+class _ThreadedClock(task.Clock):
+    """Clock that queues calls made from other threads until runPending is called."""
+
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.pending = queue.Queue()
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.pending.put((f, args, kwargs))
+
+    def runPending(self):
+        while not self.pending.empty():
+            f, args, kwargs = self.pending.get()
+            f(*args, **kwargs)
+
+
+class _FakeSerial(object):
+    """Serial port whose incoming bytes are fed by the test."""
+
+    def __init__(self):
+        self.name = 'fake'
+        self.timeout = None
+        self.incoming = queue.Queue()
+        self.reads = 0
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def feed(self, data):
+        self.incoming.put(data)
+
+    def read(self, count):
+        self.reads += 1
+        try:
+            return self.incoming.get(timeout=self.timeout)
+        except queue.Empty:
+            return b''
+
+    def cancel_read(self):
+        self.incoming.put(b'')
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_write_read(self):
+        buf = RingBuffer(8)
+        buf.write(b'abc')
+        self.assertEqual(3, len(buf))
+        self.assertEqual(b'ab', buf.peek(2))
+        self.assertEqual(b'ab', buf.read(2))
+        self.assertEqual(b'c', buf.read())
+        self.assertEqual(0, len(buf))
+        self.assertEqual(b'', buf.read())
+
+    def test_wraparound(self):
+        buf = RingBuffer(8)
+        buf.write(b'abcdef')
+        self.assertEqual(b'abcd', buf.read(4))
+        # the next write wraps around the end of the array
+        buf.write(b'ghijk')
+        self.assertEqual(7, len(buf))
+        self.assertEqual(b'efghijk', buf.peek())
+        self.assertEqual(b'hij', buf.peek(3, 3))
+        # including delimiters that straddle the end of the array
+        self.assertEqual(3, buf.find(b'hi'))
+        self.assertEqual(2, buf.find(b'gh'))
+        self.assertEqual(5, buf.find(b'j'))
+        self.assertEqual(-1, buf.find(b'ab'))
+        self.assertEqual(-1, buf.find(b'gh', 3))
+        self.assertEqual(b'efghijk', buf.read())
+
+    def test_overflow(self):
+        buf = RingBuffer(8)
+        buf.write(b'abcdef')
+        # the oldest bytes are dropped
+        buf.write(b'ghij')
+        self.assertEqual(8, len(buf))
+        self.assertEqual(2, buf.dropped)
+        self.assertEqual(b'cdefghij', buf.peek())
+        # writes larger than the buffer only keep their last bytes
+        buf.write(b'0123456789')
+        self.assertEqual(12, buf.dropped)
+        self.assertEqual(b'23456789', buf.read())
+
+    def test_skip_and_clear(self):
+        buf = RingBuffer(8)
+        buf.write(b'abcdef')
+        buf.skip(2)
+        self.assertEqual(b'cdef', buf.peek())
+        buf.skip(10)
+        self.assertEqual(0, len(buf))
+        buf.write(b'abc')
+        buf.clear()
+        self.assertEqual(b'', buf.read())
+
+
+class SerialReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = _ThreadedClock()
+        self.ser = _FakeSerial()
+        self.reader = SerialReader(self.ser, capacity=64, reactor=self.clock)
+        self.reader.start()
+
+    def tearDown(self):
+        self.reader.stop()
+        self.reader._thread.join(5)
+
+    def _receive(self, data):
+        """
+        Send bytes to the reader thread, and hand them to the reactor once they're buffered.
+        """
+        rows = len(self.reader) + len(data)
+        self.ser.feed(data)
+        deadline = time.monotonic() + 5
+        while len(self.reader) < rows and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(rows, len(self.reader))
+        self.clock.runPending()
+
+    def _result(self, d):
+        results = []
+        d.addBoth(results.append)
+        return results
+
+    def test_read_count(self):
+        results = self._result(self.reader.read(4, timeout=1))
+        self._receive(b'ab')
+        self.assertEqual([], results)
+        self._receive(b'cdef')
+        self.assertEqual([b'abcd'], results)
+        # a count of 0 reads whatever is buffered
+        self.assertEqual([b'ef'], self._result(self.reader.read()))
+
+    def test_read_until_terminator(self):
+        results = self._result(self.reader.readUntil(b'\n', timeout=1, skip=b'\r'))
+        self._receive(b'fir')
+        self.assertEqual([], results)
+        self._receive(b'st\r\nsecond\r\n')
+        self.assertEqual([b'first'], results)
+        # bytes after the terminator are kept for the next read
+        self.assertEqual([b'second'], self._result(self.reader.readUntil(b'\n', timeout=1, skip=b'\r')))
+        self.assertEqual(0, len(self.reader))
+
+    def test_reads_are_served_in_order(self):
+        first = self._result(self.reader.readUntil(b';', timeout=1))
+        second = self._result(self.reader.read(2, timeout=1))
+        self._receive(b'ab;cd')
+        self.assertEqual([b'ab'], first)
+        self.assertEqual([b'cd'], second)
+
+    def test_timeout_returns_partial_data(self):
+        results = self._result(self.reader.readUntil(b'\n', timeout=1))
+        self._receive(b'partial')
+        self.clock.advance(0.5)
+        self.assertEqual([], results)
+        self.clock.advance(0.5)
+        self.assertEqual([b'partial'], results)
+        self.assertEqual(0, len(self.reader))
+        # reads without a timeout return immediately
+        self._receive(b'ab')
+        self.assertEqual([b'ab'], self._result(self.reader.read(4)))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_stop(self):
+        results = self._result(self.reader.read(4, timeout=1))
+        self._receive(b'ab')
+        self.reader.stop()
+        # pending reads get whatever has arrived
+        self.assertEqual([b'ab'], results)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        # and the thread exits
+        self.reader._thread.join(5)
+        self.assertFalse(self.reader._thread.is_alive())
+        # later reads don't wait for bytes that won't arrive
+        self.assertEqual([b''], self._result(self.reader.read(4, timeout=1)))
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', '-s', __file__])
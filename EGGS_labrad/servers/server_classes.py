@@ -1,6 +1,8 @@
 from twisted.internet.task import LoopingCall
 from labrad.server import LabradServer, setting
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, maybeDeferred
+
+from EGGS_labrad.servers.serial.port_scheduler import DeadlineExpiredError
 
 
 __all__ = ["ContextServer", "PollingServer", "ARTIQServer"]
@@ -89,7 +91,7 @@ class PollingServer(ContextServer):
         super().initServer()
 
         # create refresher for polling
-        self.refresher = LoopingCall(self._poll)
+        self.refresher = LoopingCall(self._pollCycle)
         # set startup polling
         self.refresher.start(self.POLL_INTERVAL_ON_STARTUP, now=False)
         if not self.POLL_ON_STARTUP:
@@ -163,15 +165,28 @@ class PollingServer(ContextServer):
         """
         pass
 
+    def _pollCycle(self):
+        """
+        Runs a single poll.
+        Skips the cycle if the poll waited too long for its device (e.g. while a long
+        request had the serial port), instead of stopping the polling loop.
+        """
+        def _skip(failure):
+            failure.trap(DeadlineExpiredError)
+        return maybeDeferred(self._poll).addErrback(_skip)
+
     @inlineCallbacks
     def _poll_fail(self, failure):
         # todo: why is this here and not in serial-type servers?
-        # flush serial buffers and release the serial device
-        if hasattr(self, 'ser') and (self.ser is not None):
-            print('\tError in polling: polling failed.\n\tFlushing serial inputs/outputs and releasing DeferredLock.')
-            yield self.ser.flush_input()
-            yield self.ser.flush_output()
-            self.ser.release()
+        # flush serial buffers and release the serial device, but only if a poll has it
+        # (otherwise the port belongs to another request, which may be in the middle of a transfer)
+        ser = getattr(self, 'ser', None)
+        comm_lock = getattr(ser, 'comm_lock', None)
+        if (comm_lock is not None) and (comm_lock.holder == 'poll'):
+            print('\tError in polling: polling failed.\n\tFlushing serial inputs/outputs and releasing serial port.')
+            yield ser.flush_input()
+            yield ser.flush_output()
+            ser.release()
 
 
 """
@@ -5,10 +5,24 @@ from twisted.internet.defer import inlineCallbacks, returnValue
 
 class RigolDSA800Wrapper(GPIBDeviceWrapper):
 
+    # SETUP
+    def initialize(self):
+        # cached sweep configuration: (start frequency, stop frequency), and the sweep time;
+        # cleared by the setters that change them (the number of points is the length of each trace)
+        self._sweep = None
+        self._sweep_time = None
+        # trace data format set on the device (None if unknown), and whether traces are sent in binary
+        self._trace_format = None
+        self.binary = True
+
     # SYSTEM
     @inlineCallbacks
     def reset(self):
         yield self.write('*RST')
+        # the device's settings are back to their defaults (but keep the trace transfer mode)
+        self._sweep = None
+        self._sweep_time = None
+        self._trace_format = None
 
     @inlineCallbacks
     def clear_buffers(self):
@@ -17,6 +31,8 @@ class RigolDSA800Wrapper(GPIBDeviceWrapper):
     @inlineCallbacks
     def autoset(self):
         yield self.write(':SENS:POW:ATUN')
+        self._sweep = None
+        self._sweep_time = None
 
     @inlineCallbacks
     def operationComplete(self):
@@ -49,6 +65,8 @@ class RigolDSA800Wrapper(GPIBDeviceWrapper):
         if freq is not None:
             if (freq >= 0) and (freq <= 7.5e9):
                 yield self.write(':SENS:FREQ:STAR {:f}'.format(freq))
+                self._sweep = None
+                self._sweep_time = None
             else:
                 raise Exception('Error: start frequency must be in range: [0, 7.5e9].')
         resp = yield self.query(':SENS:FREQ:STAR?')
@@ -59,6 +77,8 @@ class RigolDSA800Wrapper(GPIBDeviceWrapper):
         if freq is not None:
             if (freq > 0) and (freq < 7.5e9):
                 yield self.write(':SENS:FREQ:STOP {:f}'.format(freq))
+                self._sweep = None
+                self._sweep_time = None
             else:
                 raise Exception('Error: stop frequency must be in range: [0, 7.5e9].')
         resp = yield self.query(':SENS:FREQ:STOP?')
@@ -69,6 +89,8 @@ class RigolDSA800Wrapper(GPIBDeviceWrapper):
         if freq is not None:
             if (freq > 0) and (freq < 7.5e9):
                 yield self.write(':SENS:FREQ:CENT {:f}'.format(freq))
+                self._sweep = None
+                self._sweep_time = None
             else:
                 raise Exception('Error: center frequency must be in range: [0, 7.5e9].')
         resp = yield self.query(':SENS:FREQ:CENT?')
@@ -79,6 +101,8 @@ class RigolDSA800Wrapper(GPIBDeviceWrapper):
         if span is not None:
             if (span > 0) and (span < 7.5e9):
                 yield self.write(':SENS:FREQ:SPAN {:f}'.format(span))
+                self._sweep = None
+                self._sweep_time = None
             else:
                 raise Exception('Error: frequency span must be in range: [0, 7.5e9].')
         resp = yield self.query(':SENS:FREQ:SPAN?')
@@ -222,13 +246,15 @@ class RigolDSA800Wrapper(GPIBDeviceWrapper):
             else:
                 raise Exception('Error: sweep time must be in range: [2e-6, 7500].')
         resp = yield self.query(':SENS:SWE:TIME?')
-        returnValue(float(resp))
+        self._sweep_time = float(resp)
+        returnValue(self._sweep_time)
 
     @inlineCallbacks
     def bandwidthResolution(self, bw):
         if bw is not None:
             if (bw > 10) and (bw < 1e7):
                 yield self.write(':SENS:BAND:RES {:f}'.format(bw))
+                self._sweep_time = None
             else:
                 raise Exception('Error: resolution bandwidth must be in range: [10, 1e7].')
         resp = yield self.query(':SENS:BAND:RES?')
@@ -239,6 +265,7 @@ class RigolDSA800Wrapper(GPIBDeviceWrapper):
         if bw is not None:
             if (bw > 10) and (bw < 1e7):
                 yield self.write(':SENS:BAND:VID {:f}'.format(bw))
+                self._sweep_time = None
             else:
                 raise Exception('Error: video bandwidth must be in range: [10, 1e7].')
         resp = yield self.query(':SENS:BAND:VID?')
@@ -247,18 +274,52 @@ class RigolDSA800Wrapper(GPIBDeviceWrapper):
 
     # TRACE
     @inlineCallbacks
-    def getTrace(self, channel):
-        # set data format
-        yield self.write(':FORM:TRAC:DATA ASC')
+    def sweepConfig(self):
+        """
+        Get the start and stop frequencies of the sweep (cached until changed by a setter).
+        """
+        if self._sweep is None:
+            p = self._packet()
+            p.query(':SENS:FREQ:STAR?', key='start')
+            p.query(':SENS:FREQ:STOP?', key='stop')
+            resp = yield p.send()
+            self._sweep = (float(resp['start']), float(resp['stop']))
+        returnValue(self._sweep)
 
-        # get data
-        data = yield self.query(':TRAC:DATA? TRACE{:d}'.format(channel))
-        data = self._processData(data)
+    @inlineCallbacks
+    def sweepTime(self):
+        """
+        Get the sweep time (cached until changed by a setter).
+        """
+        if self._sweep_time is None:
+            yield self.bandwidthSweepTime(None)
+        returnValue(self._sweep_time)
+
+    @inlineCallbacks
+    def getTrace(self, channel):
+        if self.binary:
+            # set data format to big-endian 32-bit floats
+            if self._trace_format != 'REAL':
+                yield self.write(':FORM:TRAC:DATA REAL,32')
+                yield self.write(':FORM:BORD NORM')
+                self._trace_format = 'REAL'
+            # get data as a binary block
+            p = self._packet()
+            p.query_binary_block(':TRAC:DATA? TRACE{:d}'.format(channel), 'float32', True)
+            resp = yield p.send()
+            data = np.asarray(resp.query_binary_block, dtype=float)
+        else:
+            # set data format
+            if self._trace_format != 'ASC':
+                yield self.write(':FORM:TRAC:DATA ASC')
+                self._trace_format = 'ASC'
+            # get data
+            data = yield self.query(':TRAC:DATA? TRACE{:d}'.format(channel))
+            data = self._processData(data)
 
         # create x-axis
-        freq_start = yield self.query(':SENS:FREQ:START?')
-        freq_stop = yield self.query(':SENS:FREQ:STOP?')
-        xAxis = np.linspace(int(freq_start), int(freq_stop), len(data))
+        freq_start, freq_stop = yield self.sweepConfig()
+        xAxis = np.linspace(freq_start, freq_stop, len(data))
 
         returnValue((xAxis, data))
 
@@ -272,5 +333,5 @@ class RigolDSA800Wrapper(GPIBDeviceWrapper):
         tmc_N = int(data[1])
 
         # remove header and split data
-        processed_data = np.array(data[2 + tmc_N:].split(', '), dtype=float)
+        processed_data = np.array(data[2 + tmc_N:].split(','), dtype=float)
         return processed_data
@@ -2,7 +2,7 @@
 ### BEGIN NODE INFO
 [info]
 name = Spectrum Analyzer Server
-version = 1.1.0
+version = 1.2.0
 description = Talks to spectrum analyzers.
 
 [startup]
@@ -14,14 +14,20 @@ message = 987654321
 timeout = 20
 ### END NODE INFO
 """
-from labrad.server import setting
+from labrad.server import setting, Signal
 from labrad.util import wakeupCall
 from labrad.gpib import GPIBManagedServer
 
+from twisted.internet.task import LoopingCall
+from twisted.internet.defer import inlineCallbacks
+
 # import device wrappers
 from RigolDSA800 import RigolDSA800Wrapper
 from AgilentN9010A import AgilentN9010AWrapper
 
+# minimum interval between streamed traces (in s), for fast sweeps
+TRACE_STREAM_INTERVAL_MIN = 0.05
+
 
 class SpectrumAnalyzerServer(GPIBManagedServer):
     """
@@ -35,6 +41,22 @@ class SpectrumAnalyzerServer(GPIBManagedServer):
         'Agilent Technologies N9010A': AgilentN9010AWrapper
     }
 
+    # SIGNALS
+    trace_update = Signal(999999, 'signal: trace update', '(si*v*v)')
+
+
+    # SETUP
+    def initServer(self):
+        # trace streams, by device name
+        self.trace_streams = {}
+        return super().initServer()
+
+    def stopServer(self):
+        for stream in self.trace_streams.values():
+            stream.stop()
+        self.trace_streams.clear()
+        return super().stopServer()
+
 
     # SYSTEM
     @setting(11, "Reset", returns='')
@@ -408,6 +430,73 @@ class SpectrumAnalyzerServer(GPIBManagedServer):
         """
         return self.selectedDevice(c).getTrace(channel)
 
+    @setting(912, "Trace Binary", status=['b', 'i'], returns='b')
+    def traceBinary(self, c, status=None):
+        """
+        Get/set whether traces are transferred in binary (REAL,32) instead of ASCII.
+        Arguments:
+            status  (bool): whether traces are transferred in binary.
+        Returns:
+                    (bool): whether traces are transferred in binary.
+        """
+        if type(status) is int:
+            if status not in (0, 1):
+                raise Exception('Error: input must be a boolean, 0, or 1.')
+        dev = self.selectedDevice(c)
+        if status is not None:
+            dev.binary = bool(status)
+        return dev.binary
+
+    @setting(913, "Trace Stream", channel='i', status=['b', 'i'], returns='b')
+    def traceStream(self, c, channel=1, status=None):
+        """
+        Start/stop streaming traces from the selected device.
+        While streaming, a trace is read once per sweep and sent
+            as a signal (device name, channel, frequencies, amplitudes).
+        Arguments:
+            channel (int) : the trace channel to stream.
+            status  (bool): whether to stream traces.
+        Returns:
+                    (bool): whether traces are being streamed.
+        """
+        if type(status) is int:
+            if status not in (0, 1):
+                raise Exception('Error: input must be a boolean, 0, or 1.')
+        dev = self.selectedDevice(c)
+        if status is not None:
+            # stop any existing stream
+            stream = self.trace_streams.pop(dev.name, None)
+            if (stream is not None) and stream.running:
+                stream.stop()
+            # start a new stream
+            if status:
+                stream = LoopingCall(self._streamTrace, dev, channel)
+                self.trace_streams[dev.name] = stream
+                d = stream.start(TRACE_STREAM_INTERVAL_MIN, now=True)
+                d.addErrback(self._streamTraceFailed, dev.name, stream)
+        return dev.name in self.trace_streams
+
+    @inlineCallbacks
+    def _streamTrace(self, dev, channel):
+        """
+        Read a trace and send it to listeners, then pace the stream to the sweep time.
+        """
+        freqs, ampls = yield dev.getTrace(channel)
+        self.trace_update((dev.name, channel, freqs, ampls))
+        # sweep time is cached, so this only queries the device after it has changed
+        sweep_time = yield dev.sweepTime()
+        stream = self.trace_streams.get(dev.name)
+        if stream is not None:
+            stream.interval = max(sweep_time, TRACE_STREAM_INTERVAL_MIN)
+
+    def _streamTraceFailed(self, failure, name, stream):
+        """
+        Remove a trace stream after an error (e.g. if the device disconnects).
+        """
+        if self.trace_streams.get(name) is stream:
+            del self.trace_streams[name]
+        print('Trace stream for {} stopped: {}'.format(name, failure.getErrorMessage()))
+
 
 if __name__ == '__main__':
     from labrad import util
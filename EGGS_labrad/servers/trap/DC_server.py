@@ -71,7 +71,7 @@ class DCServer(SerialDeviceServer, PollingServer):
             (vv): (HVin1, Iin1)
         """
         # getter
-        yield self.ser.acquire()
+        yield self.ser.acquire(priority=self._priority(c))
         yield self.ser.write('HVin.r\r\n')
         # add delay to allow messages to finish transferring
         yield wakeupCall(0.2)